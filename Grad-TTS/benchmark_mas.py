@@ -0,0 +1,60 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import argparse
+import datetime as dt
+
+import torch
+
+from model import monotonic_align
+from model.utils import sequence_mask
+
+
+def random_inputs(batch_size, t_x, t_y, device):
+    # Text lengths vary in [t_x / 2, t_x], mel lengths keep ratio of 1 to 5 frames per token
+    x_lengths = torch.randint(t_x // 2, t_x + 1, (batch_size,), device=device)
+    y_lengths = torch.clamp(x_lengths * torch.randint(1, 6, (batch_size,), device=device), max=t_y)
+    y_lengths = torch.max(y_lengths, x_lengths)
+    x_mask = sequence_mask(x_lengths, t_x).float()
+    y_mask = sequence_mask(y_lengths, t_y).float()
+    mask = x_mask.unsqueeze(-1) * y_mask.unsqueeze(1)
+    value = torch.randn(batch_size, t_x, t_y, device=device)
+    return value, mask
+
+
+def measure(impl, value, mask, n_runs):
+    if value.is_cuda:
+        torch.cuda.synchronize()
+    t = dt.datetime.now()
+    for _ in range(n_runs):
+        path = monotonic_align.maximum_path(value, mask, impl=impl)
+    if value.is_cuda:
+        torch.cuda.synchronize()
+    return path, (dt.datetime.now() - t).total_seconds() / n_runs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--n_runs', type=int, required=False, default=10, help='number of runs per setting')
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    impls = ['torch'] + (['cython'] if monotonic_align.maximum_path_c is not None else [])
+
+    print(f'Device: {device}')
+    print('batch | t_x | t_y  | ' + ' | '.join(f'{impl:>9s}, ms' for impl in impls) + ' | same paths')
+    for batch_size in [1, 16, 64]:
+        for t_x, t_y in [(50, 200), (150, 600), (300, 1200)]:
+            value, mask = random_inputs(batch_size, t_x, t_y, device)
+            paths, times = [], []
+            for impl in impls:
+                path, t = measure(impl, value, mask, args.n_runs)
+                paths.append(path)
+                times.append(t)
+            same = all(torch.equal(paths[0], path) for path in paths[1:])
+            print(f'{batch_size:5d} | {t_x:3d} | {t_y:4d} | ' +
+                  ' | '.join(f'{t * 1000:13.2f}' for t in times) + f' | {same}')
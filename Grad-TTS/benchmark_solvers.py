@@ -0,0 +1,83 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import argparse
+import datetime as dt
+
+import torch
+
+import params
+from model import GradTTS
+from text import text_to_sequence, cmudict
+from text.symbols import symbols
+from utils import intersperse
+
+
+SETTINGS = [('euler', 50), ('euler', 10), ('euler', 4),
+            ('heun', 25), ('heun', 5), ('heun', 2),
+            ('dpm', 10), ('dpm', 4), ('dpm', 3),
+            ('adaptive', 4)]
+
+
+def synthesize(generator, x, x_lengths, n_timesteps, solver, seed):
+    # Same seed gives the same terminal latent, so solvers are compared on equal footing
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    t = dt.datetime.now()
+    _, y_dec, _ = generator.forward(x, x_lengths, n_timesteps=n_timesteps, temperature=1.5,
+                                    stoc=False, length_scale=0.91, solver=solver)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return y_dec, (dt.datetime.now() - t).total_seconds()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', type=str, required=True, help='path to a file with texts to synthesize')
+    parser.add_argument('-c', '--checkpoint', type=str, required=True, help='path to a checkpoint of Grad-TTS')
+    parser.add_argument('-r', '--reference_timesteps', type=int, required=False, default=1000, help='number of euler steps of reference sampler')
+    parser.add_argument('--seed', type=int, required=False, default=37, help='random seed of terminal latent')
+    args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    generator = GradTTS(len(symbols)+1, params.n_spks, params.spk_emb_dim,
+                        params.n_enc_channels, params.filter_channels,
+                        params.filter_channels_dp, params.n_heads, params.n_enc_layers,
+                        params.enc_kernel, params.enc_dropout, params.window_size,
+                        params.n_feats, params.dec_dim, params.beta_min, params.beta_max, params.pe_scale)
+    generator.load_state_dict(torch.load(args.checkpoint, map_location=lambda loc, storage: loc))
+    _ = generator.to(device).eval()
+
+    n_calls = [0]
+    def count_call(module, inputs):
+        n_calls[0] += 1
+    generator.decoder.estimator.register_forward_pre_hook(count_call)
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f.readlines()]
+    cmu = cmudict.CMUDict(params.cmudict_path)
+
+    results = {setting: [0, 0.0, 0.0] for setting in SETTINGS}
+    with torch.no_grad():
+        for text in texts:
+            x = torch.LongTensor(intersperse(text_to_sequence(text, dictionary=cmu), len(symbols))).to(device)[None]
+            x_lengths = torch.LongTensor([x.shape[-1]]).to(device)
+            y_ref, _ = synthesize(generator, x, x_lengths, args.reference_timesteps, 'euler', args.seed)
+            for solver, n_timesteps in SETTINGS:
+                n_calls[0] = 0
+                y_dec, t = synthesize(generator, x, x_lengths, n_timesteps, solver, args.seed)
+                results[(solver, n_timesteps)][0] += n_calls[0]
+                results[(solver, n_timesteps)][1] += t
+                results[(solver, n_timesteps)][2] += torch.mean(torch.abs(y_dec - y_ref)).item()
+
+    print(f'Reference: euler with {args.reference_timesteps} steps, {len(texts)} texts')
+    print('solver   | steps | estimator calls | wall time, s | mel L1')
+    for (solver, n_timesteps), (calls, t, l1) in results.items():
+        print(f'{solver:8s} | {n_timesteps:5d} | {calls / len(texts):15.1f} | '
+              f'{t / len(texts):12.4f} | {l1 / len(texts):.4f}')
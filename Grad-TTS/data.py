@@ -6,6 +6,8 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 # MIT License for more details.
 
+import os
+import json
 import random
 import numpy as np
 
@@ -23,10 +25,78 @@ sys.path.insert(0, 'hifi-gan')
 from meldataset import mel_spectrogram
 
 
+class FeatureStore(object):
+    """
+    Memory-mapped store of precomputed mel-spectrograms and phoneme id sequences written by
+    `extract_features.py`. Items are looked up by audio file path and returned as
+    zero-copy views of the mapped files.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        with open(os.path.join(store_dir, 'filepaths.txt'), encoding='utf-8') as f:
+            filepaths = [line.rstrip('\n') for line in f]
+        index = np.load(os.path.join(store_dir, 'index.npy'))
+        self.index = {filepath: tuple(row) for filepath, row in zip(filepaths, index.tolist())}
+        # Files are mapped lazily, so that every dataloader worker opens its own mapping
+        self.mels, self.texts = None, None
+
+    def check(self, **kwargs):
+        for key, value in kwargs.items():
+            assert self.meta[key] == value, \
+                f'Feature store {self.store_dir} was extracted with {key}={self.meta[key]}, got {value}.'
+
+    def open(self):
+        # Copy-on-write mapping gives writable arrays without reading or modifying the files
+        self.mels = np.memmap(os.path.join(self.store_dir, 'mels.bin'), dtype=np.float32, mode='c')
+        self.mels = self.mels.reshape(-1, self.meta['n_mels'])
+        self.texts = np.memmap(os.path.join(self.store_dir, 'texts.bin'), dtype=np.int32, mode='c')
+
+    def get_mel_length(self, filepath):
+        return self.index[filepath][1]
+
+    def get_mel(self, filepath):
+        if self.mels is None:
+            self.open()
+        mel_offset, mel_length, _, _ = self.index[filepath]
+        return torch.from_numpy(self.mels[mel_offset:mel_offset + mel_length]).transpose(0, 1)
+
+    def get_text(self, filepath):
+        if self.texts is None:
+            self.open()
+        _, _, text_offset, text_length = self.index[filepath]
+        return torch.from_numpy(self.texts[text_offset:text_offset + text_length])
+
+
+def get_mel_lengths(filepaths, hop_length, feature_store=None, cache_path=None):
+    """
+    Returns number of mel-spectrogram frames for every audio file without computing features.
+    Lengths are taken from feature store or audio headers and cached in json file `cache_path`.
+    """
+    cache = {}
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    for filepath in filepaths:
+        if filepath in cache:
+            continue
+        if feature_store is not None:
+            cache[filepath] = int(feature_store.get_mel_length(filepath))
+        else:
+            # `mel_spectrogram` pads audio by (n_fft - hop_length) / 2 and uses center=False
+            cache[filepath] = ta.info(filepath).num_frames // hop_length
+    if cache_path is not None:
+        with open(cache_path, 'w') as f:
+            json.dump(cache, f)
+    return [cache[filepath] for filepath in filepaths]
+
+
 class TextMelDataset(torch.utils.data.Dataset):
     def __init__(self, filelist_path, cmudict_path, add_blank=True,
                  n_fft=1024, n_mels=80, sample_rate=22050,
-                 hop_length=256, win_length=1024, f_min=0., f_max=8000):
+                 hop_length=256, win_length=1024, f_min=0., f_max=8000,
+                 feature_store=None):
         self.filepaths_and_text = parse_filelist(filelist_path)
         self.cmudict = cmudict.CMUDict(cmudict_path)
         self.add_blank = add_blank
@@ -37,13 +107,27 @@ class TextMelDataset(torch.utils.data.Dataset):
         self.win_length = win_length
         self.f_min = f_min
         self.f_max = f_max
+        self.feature_store = self.get_feature_store(feature_store)
         random.seed(random_seed)
         random.shuffle(self.filepaths_and_text)
 
+    def get_feature_store(self, store_dir):
+        if store_dir is None:
+            return None
+        feature_store = FeatureStore(store_dir)
+        feature_store.check(add_blank=self.add_blank, n_fft=self.n_fft, n_mels=self.n_mels,
+                            sample_rate=self.sample_rate, hop_length=self.hop_length,
+                            win_length=self.win_length, f_min=self.f_min, f_max=self.f_max)
+        return feature_store
+
     def get_pair(self, filepath_and_text):
         filepath, text = filepath_and_text[0], filepath_and_text[1]
-        text = self.get_text(text, add_blank=self.add_blank)
-        mel = self.get_mel(filepath)
+        if self.feature_store is not None:
+            text = self.feature_store.get_text(filepath)
+            mel = self.feature_store.get_mel(filepath)
+        else:
+            text = self.get_text(text, add_blank=self.add_blank)
+            mel = self.get_mel(filepath)
         return (text, mel)
 
     def get_mel(self, filepath):
@@ -60,6 +144,10 @@ class TextMelDataset(torch.utils.data.Dataset):
         text_norm = torch.IntTensor(text_norm)
         return text_norm
 
+    def get_mel_lengths(self, cache_path=None):
+        filepaths = [filepath_and_text[0] for filepath_and_text in self.filepaths_and_text]
+        return get_mel_lengths(filepaths, self.hop_length, self.feature_store, cache_path)
+
     def __getitem__(self, index):
         text, mel = self.get_pair(self.filepaths_and_text[index])
         item = {'y': mel, 'x': text}
@@ -76,6 +164,42 @@ class TextMelDataset(torch.utils.data.Dataset):
         return test_batch
 
 
+class FrameBucketBatchSampler(torch.utils.data.Sampler):
+    """
+    Groups items of similar mel-spectrogram length into batches, whose padded size
+    (batch size x longest mel in batch) does not exceed `max_frames`.
+    Batches are formed once and shuffled every epoch.
+    Items longer than `max_frames` make batches of their own.
+    """
+    def __init__(self, lengths, max_frames, shuffle=True, seed=random_seed):
+        self.lengths = lengths
+        self.max_frames = max_frames
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(seed)
+        # Random permutation before stable sort mixes items of equal length
+        order = self.rng.permutation(len(lengths))
+        order = order[np.argsort(np.asarray(lengths)[order], kind='stable')]
+        self.batches = []
+        batch = []
+        for index in order:
+            # Items are sorted, so the current one is the longest in batch
+            y_max_length = fix_len_compatibility(lengths[index])
+            if batch and (len(batch) + 1) * y_max_length > max_frames:
+                self.batches.append(batch)
+                batch = []
+            batch.append(int(index))
+        if batch:
+            self.batches.append(batch)
+
+    def __iter__(self):
+        order = self.rng.permutation(len(self.batches)) if self.shuffle else range(len(self.batches))
+        for i in order:
+            yield self.batches[i]
+
+    def __len__(self):
+        return len(self.batches)
+
+
 class TextMelBatchCollate(object):
     def __call__(self, batch):
         B = len(batch)
@@ -103,7 +227,8 @@ class TextMelBatchCollate(object):
 class TextMelSpeakerDataset(torch.utils.data.Dataset):
     def __init__(self, filelist_path, cmudict_path, add_blank=True,
                  n_fft=1024, n_mels=80, sample_rate=22050,
-                 hop_length=256, win_length=1024, f_min=0., f_max=8000):
+                 hop_length=256, win_length=1024, f_min=0., f_max=8000,
+                 feature_store=None):
         super().__init__()
         self.filelist = parse_filelist(filelist_path, split_char='|')
         self.cmudict = cmudict.CMUDict(cmudict_path)
@@ -115,13 +240,27 @@ class TextMelSpeakerDataset(torch.utils.data.Dataset):
         self.f_min = f_min
         self.f_max = f_max
         self.add_blank = add_blank
+        self.feature_store = self.get_feature_store(feature_store)
         random.seed(random_seed)
         random.shuffle(self.filelist)
 
+    def get_feature_store(self, store_dir):
+        if store_dir is None:
+            return None
+        feature_store = FeatureStore(store_dir)
+        feature_store.check(add_blank=self.add_blank, n_fft=self.n_fft, n_mels=self.n_mels,
+                            sample_rate=self.sample_rate, hop_length=self.hop_length,
+                            win_length=self.win_length, f_min=self.f_min, f_max=self.f_max)
+        return feature_store
+
     def get_triplet(self, line):
         filepath, text, speaker = line[0], line[1], line[2]
-        text = self.get_text(text, add_blank=self.add_blank)
-        mel = self.get_mel(filepath)
+        if self.feature_store is not None:
+            text = self.feature_store.get_text(filepath)
+            mel = self.feature_store.get_mel(filepath)
+        else:
+            text = self.get_text(text, add_blank=self.add_blank)
+            mel = self.get_mel(filepath)
         speaker = self.get_speaker(speaker)
         return (text, mel, speaker)
 
@@ -139,6 +278,10 @@ class TextMelSpeakerDataset(torch.utils.data.Dataset):
         text_norm = torch.LongTensor(text_norm)
         return text_norm
 
+    def get_mel_lengths(self, cache_path=None):
+        filepaths = [line[0] for line in self.filelist]
+        return get_mel_lengths(filepaths, self.hop_length, self.feature_store, cache_path)
+
     def get_speaker(self, speaker):
         speaker = torch.LongTensor([int(speaker)])
         return speaker
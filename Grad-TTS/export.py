@@ -0,0 +1,146 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import os
+import json
+import argparse
+
+import torch
+
+import params
+from model import GradTTS
+from model.utils import fix_len_compatibility
+from text import text_to_sequence, cmudict
+from text.symbols import symbols
+from utils import intersperse
+
+import sys
+sys.path.append('./hifi-gan/')
+from env import AttrDict
+from models import Generator as HiFiGAN
+
+
+HIFIGAN_CONFIG = './checkpts/hifigan-config.json'
+HIFIGAN_CHECKPT = './checkpts/hifigan.pt'
+
+
+class TextEncoderExport(torch.nn.Module):
+    """
+    Speaker embedding, text encoder and duration predictor of Grad-TTS.
+    Traced for a fixed maximum text length, shorter texts are zero-padded.
+    """
+    def __init__(self, generator):
+        super(TextEncoderExport, self).__init__()
+        self.n_spks = generator.n_spks
+        self.spk_emb = generator.spk_emb if generator.n_spks > 1 else None
+        self.encoder = generator.encoder
+
+    def forward(self, x, x_lengths, spk):
+        spk = self.spk_emb(spk) if self.spk_emb is not None else None
+        mu_x, logw, x_mask = self.encoder(x, x_lengths, spk)
+        return mu_x, logw, x_mask
+
+
+class Aligner(torch.nn.Module):
+    """
+    Expands encoder outputs of a single text to mel-spectrogram frames with predicted durations.
+    Scripted, so output length is not fixed.
+    """
+    def forward(self, mu_x, logw, x_mask, length_scale: float):
+        w = torch.exp(logw) * x_mask
+        w_ceil = torch.ceil(w) * length_scale
+        y_length = int(torch.clamp_min(torch.sum(w_ceil), 1).long())
+        cum_duration = torch.cumsum(w_ceil[:, 0], 1).contiguous()
+        frames = torch.arange(y_length, dtype=cum_duration.dtype, device=mu_x.device).unsqueeze(0)
+        index = torch.searchsorted(cum_duration, frames, right=True).clamp(max=mu_x.shape[-1] - 1)
+        return torch.gather(mu_x, 2, index.unsqueeze(1).expand(1, mu_x.shape[1], y_length))
+
+
+class EulerStepExport(torch.nn.Module):
+    """
+    Single first-order step of reverse diffusion, traced for a fixed window length.
+    """
+    def __init__(self, generator):
+        super(EulerStepExport, self).__init__()
+        self.spk_emb = generator.spk_emb if generator.n_spks > 1 else None
+        self.estimator = generator.decoder.estimator
+        self.beta_min = generator.decoder.beta_min
+        self.beta_max = generator.decoder.beta_max
+
+    def forward(self, xt, mask, mu, t, h, spk):
+        spk = self.spk_emb(spk) if self.spk_emb is not None else None
+        noise_t = (self.beta_min + (self.beta_max - self.beta_min) * t).view(-1, 1, 1)
+        dxt = 0.5 * (mu - xt - self.estimator(xt, mask, mu, t, spk)) * noise_t * h
+        return (xt - dxt) * mask
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--checkpoint', type=str, required=True, help='path to a checkpoint of Grad-TTS')
+    parser.add_argument('-o', '--output', type=str, required=True, help='directory to write exported modules to')
+    parser.add_argument('--max_text_length', type=int, required=False, default=512, help='maximum number of phoneme ids (with blanks) of a text')
+    parser.add_argument('--chunk_size', type=int, required=False, default=128, help='number of mel frames between window boundaries')
+    parser.add_argument('--overlap', type=int, required=False, default=16, help='number of context frames added to each side of a chunk')
+    args = parser.parse_args()
+    window = fix_len_compatibility(args.chunk_size + 2 * args.overlap)
+
+    print('Initializing Grad-TTS...')
+    generator = GradTTS(len(symbols)+1, params.n_spks, params.spk_emb_dim,
+                        params.n_enc_channels, params.filter_channels,
+                        params.filter_channels_dp, params.n_heads, params.n_enc_layers,
+                        params.enc_kernel, params.enc_dropout, params.window_size,
+                        params.n_feats, params.dec_dim, params.beta_min, params.beta_max, params.pe_scale)
+    generator.load_state_dict(torch.load(args.checkpoint, map_location=lambda loc, storage: loc))
+    _ = generator.eval()
+
+    print('Initializing HiFi-GAN...')
+    with open(HIFIGAN_CONFIG) as f:
+        h = AttrDict(json.load(f))
+    vocoder = HiFiGAN(h)
+    vocoder.load_state_dict(torch.load(HIFIGAN_CHECKPT, map_location=lambda loc, storage: loc)['generator'])
+    _ = vocoder.eval()
+    vocoder.remove_weight_norm()
+
+    os.makedirs(args.output, exist_ok=True)
+    spk = torch.LongTensor([0])
+    with torch.no_grad():
+        print('Exporting text encoder...')
+        cmu = cmudict.CMUDict(params.cmudict_path)
+        sequence = intersperse(text_to_sequence('Here are the match lineups.', dictionary=cmu), len(symbols))
+        x = torch.zeros(1, args.max_text_length, dtype=torch.long)
+        x[0, :len(sequence)] = torch.LongTensor(sequence)
+        x_lengths = torch.LongTensor([len(sequence)])
+        encoder = torch.jit.trace(TextEncoderExport(generator), (x, x_lengths, spk))
+        encoder.save(os.path.join(args.output, 'encoder.pt'))
+        # Padded texts should give the same outputs as unpadded ones
+        mu_x, _, _ = encoder(x, x_lengths, spk)
+        mu_x_ref, _, _ = TextEncoderExport(generator)(x[:, :len(sequence)], x_lengths, spk)
+        print(f'Max abs difference to eager encoder: {(mu_x[:, :, :len(sequence)] - mu_x_ref).abs().max()}')
+
+        print('Exporting aligner...')
+        aligner = torch.jit.script(Aligner())
+        aligner.save(os.path.join(args.output, 'aligner.pt'))
+
+        print('Exporting estimator step...')
+        xt = torch.randn(1, params.n_feats, window)
+        mask = torch.ones(1, 1, window)
+        mu = torch.randn(1, params.n_feats, window)
+        t, h = torch.Tensor([0.5]), torch.Tensor([0.1])
+        step = torch.jit.trace(EulerStepExport(generator), (xt, mask, mu, t, h, spk))
+        step.save(os.path.join(args.output, 'estimator_step.pt'))
+
+        print('Exporting vocoder...')
+        vocoder = torch.jit.trace(vocoder, (mu,))
+        vocoder.save(os.path.join(args.output, 'vocoder.pt'))
+
+    with open(os.path.join(args.output, 'meta.json'), 'w') as f:
+        json.dump({'max_text_length': args.max_text_length, 'chunk_size': args.chunk_size,
+                   'overlap': args.overlap, 'window': window, 'n_feats': params.n_feats,
+                   'n_vocab': len(symbols) + 1, 'add_blank': params.add_blank,
+                   'sample_rate': params.sample_rate, 'hop_length': params.hop_length}, f, indent=4)
+    print(f'Done. Check out `{args.output}` folder for exported modules.')
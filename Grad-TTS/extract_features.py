@@ -0,0 +1,56 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import os
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+
+import params
+from data import TextMelDataset
+from utils import parse_filelist
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--filelist', type=str, required=True, help='path to a filelist of Grad-TTS dataset')
+    parser.add_argument('-o', '--output', type=str, required=True, help='directory to write feature store to')
+    args = parser.parse_args()
+
+    # Dataset is only used for its text and mel-spectrogram processing, filelist is read in original order
+    dataset = TextMelDataset(args.filelist, params.cmudict_path, params.add_blank,
+                             params.n_fft, params.n_feats, params.sample_rate, params.hop_length,
+                             params.win_length, params.f_min, params.f_max)
+    filepaths_and_text = parse_filelist(args.filelist)
+    filepaths = [line[0] for line in filepaths_and_text]
+    texts = [line[1] for line in filepaths_and_text]
+
+    os.makedirs(args.output, exist_ok=True)
+    index = np.zeros((len(filepaths), 4), dtype=np.int64)
+    mel_offset, text_offset = 0, 0
+    with open(os.path.join(args.output, 'mels.bin'), 'wb') as mel_file, \
+            open(os.path.join(args.output, 'texts.bin'), 'wb') as text_file:
+        for i, (filepath, text) in enumerate(tqdm(zip(filepaths, texts), total=len(filepaths))):
+            mel = dataset.get_mel(filepath).numpy().astype(np.float32)
+            sequence = dataset.get_text(text, add_blank=params.add_blank).numpy().astype(np.int32)
+            # Mel-spectrograms are stored frame-major, so that every item is a contiguous slice
+            mel_file.write(np.ascontiguousarray(mel.T).tobytes())
+            text_file.write(sequence.tobytes())
+            index[i] = [mel_offset, mel.shape[-1], text_offset, sequence.shape[-1]]
+            mel_offset += mel.shape[-1]
+            text_offset += sequence.shape[-1]
+
+    np.save(os.path.join(args.output, 'index.npy'), index)
+    with open(os.path.join(args.output, 'filepaths.txt'), 'w', encoding='utf-8') as f:
+        f.write(''.join(f'{filepath}\n' for filepath in filepaths))
+    with open(os.path.join(args.output, 'meta.json'), 'w') as f:
+        json.dump({'add_blank': params.add_blank, 'n_fft': params.n_fft, 'n_mels': params.n_feats,
+                   'sample_rate': params.sample_rate, 'hop_length': params.hop_length,
+                   'win_length': params.win_length, 'f_min': params.f_min, 'f_max': params.f_max}, f, indent=4)
+    print(f'Done. Stored {mel_offset} mel frames of {len(filepaths)} files in {args.output}.')
@@ -19,6 +19,7 @@ from model import GradTTS
 from text import text_to_sequence, cmudict
 from text.symbols import symbols
 from utils import intersperse
+from streaming import synthesize_stream
 
 import sys
 sys.path.append('./hifi-gan/')
@@ -30,17 +31,42 @@ HIFIGAN_CONFIG = './checkpts/hifigan-config.json'
 HIFIGAN_CHECKPT = './checkpts/hifigan.pt'
 
 
+def group_by_length(sequences, batch_size):
+    """
+    Splits indices of sequences into batches of similar length to reduce padding.
+    """
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def pad_sequences(sequences):
+    """
+    Pads phoneme id sequences with zeros into a single batch. Returns:
+        1. padded batch of shape [B, T_x]
+        2. lengths of sequences
+    """
+    x_lengths = torch.LongTensor([len(seq) for seq in sequences])
+    x = torch.zeros((len(sequences), int(x_lengths.max())), dtype=torch.long)
+    for i, seq in enumerate(sequences):
+        x[i, :len(seq)] = torch.LongTensor(seq)
+    return x, x_lengths
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('-f', '--file', type=str, required=True, help='path to a file with texts to synthesize')
     parser.add_argument('-c', '--checkpoint', type=str, required=True, help='path to a checkpoint of Grad-TTS')
     parser.add_argument('-t', '--timesteps', type=int, required=False, default=10, help='number of timesteps of reverse diffusion')
+    parser.add_argument('--solver', type=str, required=False, default='euler', choices=['euler', 'heun', 'dpm', 'adaptive'], help='ODE solver of reverse diffusion')
     parser.add_argument('-s', '--speaker_id', type=int, required=False, default=None, help='speaker id for multispeaker model')
+    parser.add_argument('-b', '--batch_size', type=int, required=False, default=1, help='number of texts synthesized in one forward pass')
+    parser.add_argument('--stream', type=int, required=False, default=None, help='synthesize each text in overlapping windows of this number of mel frames')
     args = parser.parse_args()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     
     if not isinstance(args.speaker_id, type(None)):
         assert params.n_spks > 1, "Ensure you set right number of speakers in `params.py`."
-        spk = torch.LongTensor([args.speaker_id]).cuda()
+        spk = torch.LongTensor([args.speaker_id]).to(device)
     else:
         spk = None
     
@@ -51,7 +77,7 @@ if __name__ == '__main__':
                         params.enc_kernel, params.enc_dropout, params.window_size,
                         params.n_feats, params.dec_dim, params.beta_min, params.beta_max, params.pe_scale)
     generator.load_state_dict(torch.load(args.checkpoint, map_location=lambda loc, storage: loc))
-    _ = generator.cuda().eval()
+    _ = generator.to(device).eval()
     print(f'Number of parameters: {generator.nparams}')
     
     print('Initializing HiFi-GAN...')
@@ -59,27 +85,51 @@ if __name__ == '__main__':
         h = AttrDict(json.load(f))
     vocoder = HiFiGAN(h)
     vocoder.load_state_dict(torch.load(HIFIGAN_CHECKPT, map_location=lambda loc, storage: loc)['generator'])
-    _ = vocoder.cuda().eval()
+    _ = vocoder.to(device).eval()
     vocoder.remove_weight_norm()
     
     with open(args.file, 'r', encoding='utf-8') as f:
         texts = [line.strip() for line in f.readlines()]
     cmu = cmudict.CMUDict('./resources/cmu_dictionary')
     
+    sequences = [intersperse(text_to_sequence(text, dictionary=cmu), len(symbols)) for text in texts]
+    
     with torch.no_grad():
-        for i, text in enumerate(texts):
-            print(f'Synthesizing {i} text...', end=' ')
-            x = torch.LongTensor(intersperse(text_to_sequence(text, dictionary=cmu), len(symbols))).cuda()[None]
-            x_lengths = torch.LongTensor([x.shape[-1]]).cuda()
-            
-            t = dt.datetime.now()
-            y_enc, y_dec, attn = generator.forward(x, x_lengths, n_timesteps=args.timesteps, temperature=1.5,
-                                                   stoc=False, spk=spk, length_scale=0.91)
-            t = (dt.datetime.now() - t).total_seconds()
-            print(f'Grad-TTS RTF: {t * 22050 / (y_dec.shape[-1] * 256)}')
-
-            audio = (vocoder.forward(y_dec).cpu().squeeze().clamp(-1, 1).numpy() * 32768).astype(np.int16)
-            
-            write(f'./out/sample_{i}.wav', 22050, audio)
+        if args.stream:
+            for i, sequence in enumerate(sequences):
+                print(f'Streaming {i} text...', end=' ')
+                x = torch.LongTensor(sequence).to(device)[None]
+                x_lengths = torch.LongTensor([x.shape[-1]]).to(device)
+
+                t = dt.datetime.now()
+                chunks = []
+                for chunk in synthesize_stream(generator, vocoder, x, x_lengths, args.timesteps,
+                                               chunk_size=args.stream, temperature=1.5, stoc=False,
+                                               spk=spk, length_scale=0.91, solver=args.solver):
+                    if not chunks:
+                        print(f'Time to first chunk: {(dt.datetime.now() - t).total_seconds()}')
+                    chunks.append(chunk)
+
+                write(f'./out/sample_{i}.wav', 22050, np.concatenate(chunks))
+        else:
+            for batch in group_by_length(sequences, args.batch_size):
+                print(f'Synthesizing texts {batch}...', end=' ')
+                x, x_lengths = pad_sequences([sequences[i] for i in batch])
+                x, x_lengths = x.to(device), x_lengths.to(device)
+                spk_ = spk.repeat(len(batch)) if not isinstance(spk, type(None)) else None
+
+                t = dt.datetime.now()
+                y_enc, y_dec, _, y_lengths = generator.forward(x, x_lengths, n_timesteps=args.timesteps,
+                                                               temperature=1.5, stoc=False, spk=spk_,
+                                                               length_scale=0.91, solver=args.solver,
+                                                               return_attn=False, return_lengths=True)
+                t = (dt.datetime.now() - t).total_seconds()
+                y_lengths = y_lengths.long().cpu()
+                print(f'Grad-TTS RTF: {t * 22050 / (int(y_lengths.sum()) * 256)}')
+
+                audio = vocoder.forward(y_dec).cpu().squeeze(1).clamp(-1, 1).numpy()
+                for j, (i, y_length) in enumerate(zip(batch, y_lengths)):
+                    audio_ = (audio[j, :int(y_length) * 256] * 32768).astype(np.int16)
+                    write(f'./out/sample_{i}.wav', 22050, audio_)
 
     print('Done. Check out `out` folder for samples.')
@@ -0,0 +1,115 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import os
+import json
+import argparse
+import datetime as dt
+import numpy as np
+from scipy.io.wavfile import write
+
+import torch
+
+from text import text_to_sequence, cmudict
+from streaming import crossfade_windows
+
+
+class ExportedGradTTS(object):
+    """
+    Runs Grad-TTS and HiFi-GAN from modules written by `export.py`, without model code.
+    Mel-spectrogram is generated in overlapping windows of the fixed length the estimator was traced for.
+    """
+    def __init__(self, export_dir, device='cpu'):
+        with open(os.path.join(export_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.device = torch.device(device)
+        self.encoder = torch.jit.load(os.path.join(export_dir, 'encoder.pt'), map_location=self.device)
+        self.aligner = torch.jit.load(os.path.join(export_dir, 'aligner.pt'), map_location=self.device)
+        self.step = torch.jit.load(os.path.join(export_dir, 'estimator_step.pt'), map_location=self.device)
+        self.vocoder = torch.jit.load(os.path.join(export_dir, 'vocoder.pt'), map_location=self.device)
+
+    def encode(self, sequence, spk, length_scale):
+        max_text_length = self.meta['max_text_length']
+        assert len(sequence) <= max_text_length, f'Text is longer than {max_text_length} phoneme ids.'
+        x = torch.zeros(1, max_text_length, dtype=torch.long, device=self.device)
+        x[0, :len(sequence)] = torch.LongTensor(sequence)
+        x_lengths = torch.LongTensor([len(sequence)]).to(self.device)
+        mu_x, logw, x_mask = self.encoder(x, x_lengths, spk)
+        return self.aligner(mu_x, logw, x_mask, length_scale)
+
+    def windows(self, mu_y, n_timesteps, temperature, spk):
+        chunk_size, overlap, window = self.meta['chunk_size'], self.meta['overlap'], self.meta['window']
+        y_length = mu_y.shape[-1]
+        z = mu_y + torch.randn_like(mu_y) / temperature
+        h = torch.Tensor([1.0 / n_timesteps]).to(self.device)
+        for chunk_start in range(0, y_length, chunk_size):
+            start = max(0, chunk_start - overlap)
+            end = min(y_length, chunk_start + chunk_size + overlap)
+            length = end - start
+            mu = torch.zeros(1, self.meta['n_feats'], window, device=self.device)
+            xt = torch.zeros_like(mu)
+            mask = torch.zeros(1, 1, window, device=self.device)
+            mu[:, :, :length] = mu_y[:, :, start:end]
+            xt[:, :, :length] = z[:, :, start:end]
+            mask[:, :, :length] = 1.0
+            for i in range(n_timesteps):
+                t = torch.Tensor([1.0 - (i + 0.5) / n_timesteps]).to(self.device)
+                xt = self.step(xt, mask, mu, t, h, spk)
+            yield xt[:, :, :length], start, end
+
+    def vocode(self, mel):
+        # Vocoder is traced for the window length, shorter windows are zero-padded
+        length = mel.shape[-1]
+        mel_ = torch.zeros(1, self.meta['n_feats'], self.meta['window'], device=self.device)
+        mel_[:, :, :length] = mel
+        return self.vocoder(mel_)[:, :, :length * self.meta['hop_length']]
+
+    @torch.no_grad()
+    def synthesize_stream(self, sequence, n_timesteps=10, temperature=1.5, speaker_id=0, length_scale=0.91):
+        """
+        Yields int16 audio chunks of text, converted to phoneme ids with blanks.
+        """
+        spk = torch.LongTensor([speaker_id]).to(self.device)
+        mu_y = self.encode(sequence, spk, length_scale)
+        windows = self.windows(mu_y, n_timesteps, temperature, spk)
+        yield from crossfade_windows(windows, self.vocode, self.meta['chunk_size'], self.meta['overlap'],
+                                     self.meta['hop_length'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', '--file', type=str, required=True, help='path to a file with texts to synthesize')
+    parser.add_argument('-e', '--export_dir', type=str, required=True, help='path to a directory written by `export.py`')
+    parser.add_argument('-t', '--timesteps', type=int, required=False, default=10, help='number of timesteps of reverse diffusion')
+    parser.add_argument('-s', '--speaker_id', type=int, required=False, default=0, help='speaker id for multispeaker model')
+    parser.add_argument('--cmudict', type=str, required=False, default='./resources/cmu_dictionary', help='path to CMU dictionary')
+    args = parser.parse_args()
+
+    t = dt.datetime.now()
+    model = ExportedGradTTS(args.export_dir)
+    print(f'Loaded exported modules in {(dt.datetime.now() - t).total_seconds()}s')
+
+    with open(args.file, 'r', encoding='utf-8') as f:
+        texts = [line.strip() for line in f.readlines()]
+    cmu = cmudict.CMUDict(args.cmudict)
+    blank = model.meta['n_vocab'] - 1
+
+    for i, text in enumerate(texts):
+        print(f'Synthesizing {i} text...', end=' ')
+        sequence = text_to_sequence(text, dictionary=cmu)
+        if model.meta['add_blank']:
+            sequence_ = [blank] * (len(sequence) * 2 + 1)
+            sequence_[1::2] = sequence
+            sequence = sequence_
+        t = dt.datetime.now()
+        audio = np.concatenate(list(model.synthesize_stream(sequence, args.timesteps, speaker_id=args.speaker_id)))
+        t = (dt.datetime.now() - t).total_seconds()
+        print(f'RTF: {t * model.meta["sample_rate"] / audio.shape[-1]}')
+        write(f'./out/sample_{i}.wav', model.meta['sample_rate'], audio)
+
+    print('Done. Check out `out` folder for samples.')
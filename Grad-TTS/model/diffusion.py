@@ -251,8 +251,46 @@ class Diffusion(BaseModule):
         xt = mean + z * torch.sqrt(variance)
         return xt * mask, z * mask
 
+    def ode_drift(self, xt, mask, mu, t, spk=None):
+        """
+        Drift of the probability flow ODE, which is integrated backwards from t=1 to t=0.
+        """
+        time = t.unsqueeze(-1).unsqueeze(-1)
+        noise_t = get_noise(time, self.beta_min, self.beta_max, 
+                            cumulative=False)
+        return 0.5 * (mu - xt - self.estimator(xt, mask, mu, t, spk)) * noise_t
+
+    def time_from_lambda(self, lmbd):
+        """
+        Inverts half log-SNR `lmbd` = log(alpha_t / sigma_t) of forward diffusion to time t.
+        """
+        cum_noise = math.log1p(math.exp(-2.0 * lmbd))
+        beta_diff = self.beta_max - self.beta_min
+        return (math.sqrt(self.beta_min**2 + 2.0 * beta_diff * cum_noise) - self.beta_min) / beta_diff
+
     @torch.no_grad()
-    def reverse_diffusion(self, z, mask, mu, n_timesteps, stoc=False, spk=None):
+    def reverse_diffusion(self, z, mask, mu, n_timesteps, stoc=False, spk=None,
+                          solver='euler', tol=1e-2):
+        """
+        Generates sample by solving reverse dynamics from terminal latent `z`.
+
+        Args:
+            n_timesteps (int): number of solver steps (initial number of steps for `adaptive`).
+            stoc (bool, optional): flag that adds stochastic term, supported by `euler` only.
+            solver (str, optional): one of `euler` (1st order, ICML paper sampler),
+                `heun` (2nd order Runge-Kutta, 2 estimator calls per step),
+                `dpm` (DPM-Solver++ 2nd order multistep, 1 estimator call per step)
+                or `adaptive` (embedded Heun-Euler pair with step size control).
+            tol (float, optional): relative and absolute error tolerance for `adaptive` solver.
+        """
+        assert solver in ['euler', 'heun', 'dpm', 'adaptive'], f'Unknown solver: {solver}'
+        assert not stoc or solver == 'euler', 'Stochastic sampling is supported only by `euler` solver.'
+        if solver == 'heun':
+            return self.reverse_diffusion_heun(z, mask, mu, n_timesteps, spk)
+        if solver == 'dpm':
+            return self.reverse_diffusion_dpm(z, mask, mu, n_timesteps, spk)
+        if solver == 'adaptive':
+            return self.reverse_diffusion_adaptive(z, mask, mu, n_timesteps, spk, tol)
         h = 1.0 / n_timesteps
         xt = z * mask
         for i in range(n_timesteps):
@@ -275,8 +313,81 @@ class Diffusion(BaseModule):
         return xt
 
     @torch.no_grad()
-    def forward(self, z, mask, mu, n_timesteps, stoc=False, spk=None):
-        return self.reverse_diffusion(z, mask, mu, n_timesteps, stoc, spk)
+    def reverse_diffusion_heun(self, z, mask, mu, n_timesteps, spk=None, offset=1e-5):
+        times = torch.linspace(1.0, offset, n_timesteps + 1).tolist()
+        ones = torch.ones(z.shape[0], dtype=z.dtype, device=z.device)
+        xt = z * mask
+        for t, t_next in zip(times[:-1], times[1:]):
+            h = t - t_next
+            dxt = self.ode_drift(xt, mask, mu, t * ones, spk)
+            xt_next = (xt - h * dxt) * mask
+            dxt_next = self.ode_drift(xt_next, mask, mu, t_next * ones, spk)
+            xt = (xt - 0.5 * h * (dxt + dxt_next)) * mask
+        return xt
+
+    @torch.no_grad()
+    def reverse_diffusion_dpm(self, z, mask, mu, n_timesteps, spk=None, offset=1e-5):
+        # DPM-Solver++(2M) with steps uniform in half log-SNR, applied to `xt - mu`
+        # which follows standard VP diffusion with alpha_t = exp(-0.5 * cum_noise_t)
+        def alpha_sigma(t):
+            cum_noise = get_noise(t, self.beta_min, self.beta_max, cumulative=True)
+            return math.exp(-0.5 * cum_noise), math.sqrt(-math.expm1(-cum_noise))
+
+        alpha_start, sigma_start = alpha_sigma(1.0)
+        alpha_end, sigma_end = alpha_sigma(offset)
+        lmbd_start = math.log(alpha_start / sigma_start)
+        lmbd_end = math.log(alpha_end / sigma_end)
+        lmbds = torch.linspace(lmbd_start, lmbd_end, n_timesteps + 1).tolist()
+        times = [1.0] + [self.time_from_lambda(lmbd) for lmbd in lmbds[1:-1]] + [offset]
+
+        ones = torch.ones(z.shape[0], dtype=z.dtype, device=z.device)
+        xt = z * mask
+        x0_prev, h_prev = None, None
+        for i in range(n_timesteps):
+            t, t_next = times[i], times[i + 1]
+            alpha_t, sigma_t = alpha_sigma(t)
+            alpha_next, sigma_next = alpha_sigma(t_next)
+            h = lmbds[i + 1] - lmbds[i]
+            # Estimator approximates the score, so data prediction is (y + sigma^2 * score) / alpha
+            score = self.estimator(xt, mask, mu, t * ones, spk)
+            x0 = ((xt - mu) + sigma_t**2 * score) / alpha_t
+            if x0_prev is None:
+                d = x0
+            else:
+                r = h_prev / h
+                d = (1.0 + 0.5 / r) * x0 - (0.5 / r) * x0_prev
+            yt = (sigma_next / sigma_t) * (xt - mu) - alpha_next * math.expm1(-h) * d
+            xt = (yt + mu) * mask
+            x0_prev, h_prev = x0, h
+        return xt
+
+    @torch.no_grad()
+    def reverse_diffusion_adaptive(self, z, mask, mu, n_timesteps, spk=None, tol=1e-2,
+                                   offset=1e-5, safety=0.9, min_factor=0.2, max_factor=5.0):
+        ones = torch.ones(z.shape[0], dtype=z.dtype, device=z.device)
+        n_elements = torch.sum(mask) * self.n_feats
+        xt = z * mask
+        t, h = 1.0, 1.0 / n_timesteps
+        dxt = self.ode_drift(xt, mask, mu, t * ones, spk)
+        while t > offset:
+            h = min(h, t - offset)
+            xt_euler = (xt - h * dxt) * mask
+            dxt_euler = self.ode_drift(xt_euler, mask, mu, (t - h) * ones, spk)
+            xt_heun = (xt - 0.5 * h * (dxt + dxt_euler)) * mask
+            # Difference between 1st and 2nd order solutions estimates local error
+            scale = tol + tol * torch.max(xt.abs(), xt_heun.abs())
+            err = torch.sqrt(torch.sum(((xt_heun - xt_euler) / scale)**2 * mask) / n_elements).item()
+            if err <= 1.0:
+                t, xt = t - h, xt_heun
+                if t > offset:
+                    dxt = self.ode_drift(xt, mask, mu, t * ones, spk)
+            factor = safety * err**-0.5 if err > 0 else max_factor
+            h = h * min(max_factor, max(min_factor, factor))
+        return xt
+
+    @torch.no_grad()
+    def forward(self, z, mask, mu, n_timesteps, stoc=False, spk=None, solver='euler', tol=1e-2):
+        return self.reverse_diffusion(z, mask, mu, n_timesteps, stoc, spk, solver, tol)
 
     def loss_t(self, x0, mask, mu, t, spk=None):
         xt, z = self.forward_diffusion(x0, mask, mu, t)
@@ -2,14 +2,32 @@
 
 import numpy as np
 import torch
-from .model.monotonic_align.core import maximum_path_c
+try:
+    from .model.monotonic_align.core import maximum_path_c
+except ImportError:
+    maximum_path_c = None
 
 
-def maximum_path(value, mask):  
+def maximum_path(value, mask, impl='auto'):
+    """ Finds most likely monotonic alignment.
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    impl: `cython`, `torch` or `auto` (torch for GPU tensors, cython for CPU tensors if it is built)
+    """
+    assert impl in ['auto', 'cython', 'torch'], f'Unknown implementation: {impl}'
+    if impl == 'auto':
+        impl = 'cython' if not value.is_cuda and maximum_path_c is not None else 'torch'
+    if impl == 'cython':
+        return maximum_path_cython(value, mask)
+    return maximum_path_torch(value, mask)
+
+
+def maximum_path_cython(value, mask):
     """ Cython optimised version.
     value: [b, t_x, t_y]
     mask: [b, t_x, t_y]
     """
+    assert maximum_path_c is not None, 'Build `monotonic_align` with Cython first.'
     value = value * mask
     device = value.device
     dtype = value.dtype
@@ -21,3 +39,47 @@ def maximum_path(value, mask):
     t_y_max = mask.sum(2)[:, 0].astype(np.int32)
     maximum_path_c(path, value, t_x_max, t_y_max)
     return torch.from_numpy(path).to(device=device, dtype=dtype)
+
+
+@torch.no_grad()
+def maximum_path_torch(value, mask, max_neg_val=-1e9):
+    """ Batched torch version, runs on device of inputs without host synchronization.
+    Each column of the dynamic programming table depends on the previous column only,
+    so the whole batch is processed one mel frame at a time.
+    value: [b, t_x, t_y]
+    mask: [b, t_x, t_y]
+    """
+    dtype = value.dtype
+    value = (value * mask).float()
+    b, t_x, t_y = value.shape
+    device = value.device
+
+    t_x_max = mask.sum(1)[:, 0].long()
+    t_y_max = mask.sum(2)[:, 0].long()
+    x_range = torch.arange(t_x, device=device).view(1, t_x, 1)
+    y_range = torch.arange(t_y, device=device).view(1, 1, t_y)
+    # Cells which lie on some monotonic path from (0, 0) to (t_x_max - 1, t_y_max - 1)
+    valid = (x_range <= y_range) & (x_range >= t_x_max.view(b, 1, 1) + y_range - t_y_max.view(b, 1, 1))
+    valid = valid & (x_range < t_x_max.view(b, 1, 1)) & (y_range < t_y_max.view(b, 1, 1))
+
+    scores = torch.empty_like(value)
+    score = torch.full((b, t_x), max_neg_val, dtype=value.dtype, device=device)
+    for y in range(t_y):
+        score_shifted = torch.nn.functional.pad(score[:, :-1], (1, 0), value=0. if y == 0 else max_neg_val)
+        score = torch.max(score, score_shifted) + value[:, :, y]
+        score = torch.where(valid[:, :, y], score, torch.full_like(score, max_neg_val))
+        scores[:, :, y] = score
+
+    path = torch.zeros_like(value)
+    batch_range = torch.arange(b, device=device)
+    index = t_x_max - 1
+    for y in range(t_y - 1, -1, -1):
+        active = y < t_y_max
+        path[batch_range, index, y] = active.float()
+        if y == 0:
+            break
+        score_cur = scores[batch_range, index, y - 1]
+        score_prev = scores[batch_range, (index - 1).clamp(min=0), y - 1]
+        move = active & (index != 0) & ((index == y) | (score_cur < score_prev))
+        index = index - move.long()
+    return path.to(dtype=dtype)
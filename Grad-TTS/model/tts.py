@@ -15,7 +15,7 @@ from model import monotonic_align
 from model.base import BaseModule
 from model.text_encoder import TextEncoder
 from model.diffusion import Diffusion
-from model.utils import sequence_mask, generate_path, duration_loss, fix_len_compatibility
+from model.utils import sequence_mask, expand_by_duration, index_to_path, duration_loss, fix_len_compatibility
 
 
 class GradTTS(BaseModule):
@@ -48,12 +48,46 @@ class GradTTS(BaseModule):
         self.decoder = Diffusion(n_feats, dec_dim, n_spks, spk_emb_dim, beta_min, beta_max, pe_scale)
 
     @torch.no_grad()
-    def forward(self, x, x_lengths, n_timesteps, temperature=1.0, stoc=False, spk=None, length_scale=1.0):
+    def align_prior(self, x, x_lengths, spk=None, length_scale=1.0, return_attn=True):
+        """
+        Encodes text and expands encoder outputs to mel-spectrogram frames with predicted durations. Returns:
+            1. aligned encoder outputs `mu_y`, padded to length compatible with U-Net downsamplings
+            2. mask of mel-spectrogram frames
+            3. lengths of mel-spectrograms
+            4. generated alignment, None if `return_attn` is False
+            
+        Args:
+            x (torch.Tensor): batch of texts, converted to a tensor with phoneme embedding ids.
+            x_lengths (torch.Tensor): lengths of texts in batch.
+            spk (torch.Tensor, optional): batch of speaker embeddings.
+            length_scale (float, optional): controls speech pace.
+            return_attn (bool, optional): flag that builds alignment map of shape [B, 1, T_x, T_y].
+                Otherwise memory does not depend on T_x * T_y.
+        """
+        # Get encoder_outputs `mu_x` and log-scaled token durations `logw`
+        mu_x, logw, x_mask = self.encoder(x, x_lengths, spk)
+
+        w = torch.exp(logw) * x_mask
+        w_ceil = torch.ceil(w) * length_scale
+        y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+        y_max_length = int(y_lengths.max())
+        y_max_length_ = fix_len_compatibility(y_max_length)
+        y_mask = sequence_mask(y_lengths, y_max_length_).unsqueeze(1).to(x_mask.dtype)
+
+        # Align encoded text with obtained durations `w` and get mu_y
+        mu_y, index = expand_by_duration(mu_x, w_ceil.squeeze(1), y_mask)
+        attn = index_to_path(index, mu_x.shape[-1], y_mask).unsqueeze(1) if return_attn else None
+        return mu_y, y_mask, y_lengths, attn
+
+    @torch.no_grad()
+    def forward(self, x, x_lengths, n_timesteps, temperature=1.0, stoc=False, spk=None, length_scale=1.0,
+                solver='euler', tol=1e-2, return_attn=True, return_lengths=False):
         """
         Generates mel-spectrogram from text. Returns:
             1. encoder outputs
             2. decoder outputs
             3. generated alignment
+            4. lengths of generated mel-spectrograms, only if `return_lengths` is True
         
         Args:
             x (torch.Tensor): batch of texts, converted to a tensor with phoneme embedding ids.
@@ -64,6 +98,10 @@ class GradTTS(BaseModule):
                 Usually, does not provide synthesis improvements.
             length_scale (float, optional): controls speech pace.
                 Increase value to slow down generated speech and vice versa.
+            solver (str, optional): ODE solver used by decoder: `euler`, `heun`, `dpm` or `adaptive`.
+            tol (float, optional): error tolerance of `adaptive` solver.
+            return_attn (bool, optional): flag that builds alignment, otherwise None is returned instead.
+            return_lengths (bool, optional): flag that also returns output lengths.
         """
         x, x_lengths = self.relocate_input([x, x_lengths])
 
@@ -71,32 +109,63 @@ class GradTTS(BaseModule):
             # Get speaker embedding
             spk = self.spk_emb(spk)
 
-        # Get encoder_outputs `mu_x` and log-scaled token durations `logw`
-        mu_x, logw, x_mask = self.encoder(x, x_lengths, spk)
-
-        w = torch.exp(logw) * x_mask
-        w_ceil = torch.ceil(w) * length_scale
-        y_lengths = torch.clamp_min(torch.sum(w_ceil, [1, 2]), 1).long()
+        mu_y, y_mask, y_lengths, attn = self.align_prior(x, x_lengths, spk, length_scale, return_attn)
         y_max_length = int(y_lengths.max())
-        y_max_length_ = fix_len_compatibility(y_max_length)
-
-        # Using obtained durations `w` construct alignment map `attn`
-        y_mask = sequence_mask(y_lengths, y_max_length_).unsqueeze(1).to(x_mask.dtype)
-        attn_mask = x_mask.unsqueeze(-1) * y_mask.unsqueeze(2)
-        attn = generate_path(w_ceil.squeeze(1), attn_mask.squeeze(1)).unsqueeze(1)
-
-        # Align encoded text and get mu_y
-        mu_y = torch.matmul(attn.squeeze(1).transpose(1, 2), mu_x.transpose(1, 2))
-        mu_y = mu_y.transpose(1, 2)
         encoder_outputs = mu_y[:, :, :y_max_length]
 
         # Sample latent representation from terminal distribution N(mu_y, I)
         z = mu_y + torch.randn_like(mu_y, device=mu_y.device) / temperature
         # Generate sample by performing reverse dynamics
-        decoder_outputs = self.decoder(z, y_mask, mu_y, n_timesteps, stoc, spk)
+        decoder_outputs = self.decoder(z, y_mask, mu_y, n_timesteps, stoc, spk, solver, tol)
         decoder_outputs = decoder_outputs[:, :, :y_max_length]
 
-        return encoder_outputs, decoder_outputs, attn[:, :, :y_max_length]
+        if return_attn:
+            attn = attn[:, :, :y_max_length]
+        if return_lengths:
+            return encoder_outputs, decoder_outputs, attn, y_lengths
+        return encoder_outputs, decoder_outputs, attn
+
+    @torch.no_grad()
+    def forward_chunked(self, x, x_lengths, n_timesteps, chunk_size=128, overlap=16, temperature=1.0,
+                        stoc=False, spk=None, length_scale=1.0, solver='euler', tol=1e-2):
+        """
+        Generates mel-spectrogram of a single text window by window, so that memory of decoder
+        does not grow with text length. Yields tuples of:
+            1. decoder outputs for mel frames [start, end)
+            2. start frame of the window
+            3. end frame of the window
+        Neighbouring windows share `overlap` frames on both sides of each chunk boundary.
+            
+        Args:
+            chunk_size (int, optional): number of mel frames between window boundaries.
+            overlap (int, optional): number of context frames added to each side of a chunk.
+            Other arguments are the same as in `forward`.
+        """
+        assert x.shape[0] == 1, 'Chunked synthesis supports batch size 1 only.'
+        assert 0 <= overlap <= chunk_size // 2, 'Overlap should not exceed half of chunk size.'
+        x, x_lengths = self.relocate_input([x, x_lengths])
+
+        if self.n_spks > 1:
+            # Get speaker embedding
+            spk = self.spk_emb(spk)
+
+        mu_y, _, y_lengths, _ = self.align_prior(x, x_lengths, spk, length_scale, return_attn=False)
+        y_length = int(y_lengths[0])
+
+        # Terminal latent is shared by all windows, so that overlapping frames start from the same noise
+        z = mu_y + torch.randn_like(mu_y, device=mu_y.device) / temperature
+        for chunk_start in range(0, y_length, chunk_size):
+            start = max(0, chunk_start - overlap)
+            end = min(y_length, chunk_start + chunk_size + overlap)
+            length = end - start
+            length_ = fix_len_compatibility(length)
+            mu_window = torch.zeros(1, self.n_feats, length_, dtype=mu_y.dtype, device=mu_y.device)
+            z_window = torch.zeros_like(mu_window)
+            mu_window[:, :, :length] = mu_y[:, :, start:end]
+            z_window[:, :, :length] = z[:, :, start:end]
+            mask = sequence_mask(torch.LongTensor([length]).to(mu_y.device), length_).unsqueeze(1).to(mu_y.dtype)
+            decoder_outputs = self.decoder(z_window, mask, mu_window, n_timesteps, stoc, spk, solver, tol)
+            yield decoder_outputs[:, :, :length], start, end
 
     def compute_loss(self, x, x_lengths, y, y_lengths, spk=None, out_size=None):
         """
@@ -127,12 +196,14 @@ class GradTTS(BaseModule):
         attn_mask = x_mask.unsqueeze(-1) * y_mask.unsqueeze(2)
 
         # Use MAS to find most likely alignment `attn` between text and mel-spectrogram
-        with torch.no_grad(): 
+        # (always in full precision, log-likelihoods are too large for half precision types)
+        with torch.no_grad(), torch.autocast(device_type=mu_x.device.type, enabled=False):
+            mu_x_, y_ = mu_x.float(), y.float()
             const = -0.5 * math.log(2 * math.pi) * self.n_feats
-            factor = -0.5 * torch.ones(mu_x.shape, dtype=mu_x.dtype, device=mu_x.device)
-            y_square = torch.matmul(factor.transpose(1, 2), y ** 2)
-            y_mu_double = torch.matmul(2.0 * (factor * mu_x).transpose(1, 2), y)
-            mu_square = torch.sum(factor * (mu_x ** 2), 1).unsqueeze(-1)
+            factor = -0.5 * torch.ones(mu_x_.shape, dtype=mu_x_.dtype, device=mu_x_.device)
+            y_square = torch.matmul(factor.transpose(1, 2), y_ ** 2)
+            y_mu_double = torch.matmul(2.0 * (factor * mu_x_).transpose(1, 2), y_)
+            mu_square = torch.sum(factor * (mu_x_ ** 2), 1).unsqueeze(-1)
             log_prior = y_square - y_mu_double + mu_square + const
 
             attn = monotonic_align.maximum_path(log_prior, attn_mask.squeeze(1))
@@ -39,6 +39,34 @@ def generate_path(duration, mask):
     return path
 
 
+def expand_by_duration(x, duration, y_mask):
+    """
+    Repeats frames of `x` [b, c, t_x] according to `duration` [b, t_x].
+    Gives the same result as `generate_path(duration, mask)^T @ x`, but gathers
+    frames by index instead of materializing [b, t_x, t_y] alignment. Returns:
+        1. expanded tensor [b, c, t_y], masked with `y_mask` [b, 1, t_y]
+        2. index of the source frame for every output frame [b, t_y]
+    """
+    b, c, t_x = x.shape
+    t_y = y_mask.shape[-1]
+    cum_duration = torch.cumsum(duration, 1).contiguous()
+    frames = torch.arange(t_y, dtype=cum_duration.dtype, device=duration.device)
+    # Frame j belongs to the first token whose cumulative duration exceeds j
+    index = torch.searchsorted(cum_duration, frames.unsqueeze(0).expand(b, t_y).contiguous(), right=True)
+    index = index.clamp(max=t_x - 1)
+    y = torch.gather(x, 2, index.unsqueeze(1).expand(b, c, t_y)) * y_mask
+    return y, index
+
+
+def index_to_path(index, t_x, y_mask):
+    """
+    Builds alignment [b, t_x, t_y] from source frame index [b, t_y] returned by `expand_by_duration`.
+    """
+    tokens = torch.arange(t_x, dtype=index.dtype, device=index.device).view(1, -1, 1)
+    path = (index.unsqueeze(1) == tokens).to(y_mask.dtype)
+    return path * y_mask
+
+
 def duration_loss(logw, logw_, lengths):
     loss = torch.sum((logw - logw_)**2) / torch.sum(lengths)
     return loss
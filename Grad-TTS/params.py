@@ -13,6 +13,8 @@ from model.utils import fix_len_compatibility
 train_filelist_path = 'resources/filelists/ljspeech/train.txt'
 valid_filelist_path = 'resources/filelists/ljspeech/valid.txt'
 test_filelist_path = 'resources/filelists/ljspeech/test.txt'
+train_features_path = None  # directory written by `extract_features.py`, None to compute mels on the fly
+valid_features_path = None
 cmudict_path = 'resources/cmu_dictionary'
 add_blank = True
 n_feats = 80
@@ -47,7 +49,11 @@ log_dir = 'logs/new_exp'
 test_size = 4
 n_epochs = 10000
 batch_size = 16
+batch_frames = None  # if set, batches are formed by mel frames budget instead of `batch_size`
 learning_rate = 1e-4
 seed = 37
 save_every = 1
+amp_dtype = None  # 'bf16' or 'fp16' to train with automatic mixed precision, 'fp16' needs GPU
+grad_accumulation = 1  # number of batches per optimizer step
+log_every = 1  # number of optimizer steps between scalar log writes, each write syncs with device
 out_size = fix_len_compatibility(2*22050//256)
@@ -0,0 +1,65 @@
+# Copyright (C) 2021. Huawei Technologies Co., Ltd. All rights reserved.
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the MIT License.
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# MIT License for more details.
+
+import numpy as np
+
+import torch
+
+
+def to_int16(audio):
+    return (audio.clamp(-1, 1).cpu().numpy() * 32768).astype(np.int16)
+
+
+@torch.no_grad()
+def crossfade_windows(windows, vocoder, chunk_size, overlap, hop_length=256):
+    """
+    Vocodes mel-spectrogram windows and yields int16 audio chunks as soon as they are ready.
+    Audio of neighbouring windows is linearly cross-faded over their `2 * overlap` common frames.
+
+    Args:
+        windows (iterable): tuples of (mel window [1, n_feats, T], start frame, end frame)
+            as yielded by `GradTTS.forward_chunked`.
+        vocoder (callable): maps mel-spectrogram [1, n_feats, T] to audio [1, 1, T * hop_length].
+        chunk_size (int): number of mel frames between window boundaries.
+        overlap (int): number of context frames added to each side of a chunk.
+    """
+    tail = None
+    for i, (mel, start, end) in enumerate(windows):
+        audio = vocoder(mel)[0, 0]
+        if tail is not None:
+            fade = torch.linspace(0.0, 1.0, tail.shape[-1], dtype=audio.dtype, device=audio.device)
+            audio[:tail.shape[-1]] = tail * (1.0 - fade) + audio[:tail.shape[-1]] * fade
+        # Frames starting from the next window are held back to be cross-faded with it
+        next_start = min(end, max(0, (i + 1) * chunk_size - overlap))
+        split = (next_start - start) * hop_length
+        tail = audio[split:]
+        if split > 0:
+            yield to_int16(audio[:split])
+    if tail is not None and tail.shape[-1] > 0:
+        yield to_int16(tail)
+
+
+@torch.no_grad()
+def synthesize_stream(generator, vocoder, x, x_lengths, n_timesteps, chunk_size=128, overlap=16,
+                      hop_length=256, **kwargs):
+    """
+    Synthesizes a single text window by window with Grad-TTS and HiFi-GAN
+    and yields int16 audio chunks as soon as they are ready.
+
+    Args:
+        generator (GradTTS): acoustic model.
+        vocoder (torch.nn.Module): HiFi-GAN generator with `hop_length` upsampling factor.
+        x (torch.Tensor): text converted to a tensor with phoneme embedding ids, shape [1, T_x].
+        x_lengths (torch.Tensor): length of text.
+        n_timesteps (int): number of steps to use for reverse diffusion in decoder.
+        chunk_size (int, optional): number of mel frames between window boundaries.
+        overlap (int, optional): number of context frames added to each side of a chunk.
+        kwargs: other arguments of `GradTTS.forward_chunked` (temperature, spk, solver, etc.).
+    """
+    windows = generator.forward_chunked(x, x_lengths, n_timesteps, chunk_size, overlap, **kwargs)
+    yield from crossfade_windows(windows, vocoder, chunk_size, overlap, hop_length)
@@ -1,6 +1,7 @@
 """ from https://github.com/keithito/tacotron """
 
 import re
+import functools
 from text import cleaners
 from text.symbols import symbols
 
@@ -25,6 +26,9 @@ def text_to_sequence(text, cleaner_names=["english_cleaners"], dictionary=None):
     The text can optionally have ARPAbet sequences enclosed in curly braces embedded
     in it. For example, "Turn left on {HH AW1 S S T AH0 N} Street."
 
+    Results are memoized per (text, cleaners, dictionary), so repeated sentences skip
+    cleaning, number expansion and dictionary lookups.
+
     Args:
       text: string to convert to a sequence
       cleaner_names: names of the cleaner functions to run the text through
@@ -33,6 +37,23 @@ def text_to_sequence(text, cleaner_names=["english_cleaners"], dictionary=None):
     Returns:
       List of integers corresponding to the symbols in the text
     '''
+    return list(_cached_text_to_sequence(text, tuple(cleaner_names), dictionary))
+
+
+@functools.lru_cache(maxsize=2**14)
+def _cached_text_to_sequence(text, cleaner_names, dictionary):
+    return tuple(_text_to_sequence(text, cleaner_names, dictionary))
+
+
+@functools.lru_cache(maxsize=2**17)
+def _word_to_sequence(word, dictionary):
+    t = get_arpabet(word, dictionary)
+    if t.startswith("{"):
+        return tuple(_arpabet_to_sequence(t[1:-1]))
+    return tuple(_symbols_to_sequence(t))
+
+
+def _text_to_sequence(text, cleaner_names, dictionary):
     sequence = []
     space = _symbols_to_sequence(' ')
     # Check for curly braces and treat their contents as ARPAbet:
@@ -41,13 +62,8 @@ def text_to_sequence(text, cleaner_names=["english_cleaners"], dictionary=None):
         if not m:
             clean_text = _clean_text(text, cleaner_names)
             if dictionary is not None:
-                clean_text = [get_arpabet(w, dictionary) for w in clean_text.split(" ")]
-                for i in range(len(clean_text)):
-                    t = clean_text[i]
-                    if t.startswith("{"):
-                        sequence += _arpabet_to_sequence(t[1:-1])
-                    else:
-                        sequence += _symbols_to_sequence(t)
+                for w in clean_text.split(" "):
+                    sequence += _word_to_sequence(w, dictionary)
                     sequence += space
             else:
                 sequence += _symbols_to_sequence(clean_text)
@@ -1,6 +1,8 @@
 """ from https://github.com/keithito/tacotron """
 
+import os
 import re
+import pickle
 
 
 valid_symbols = [
@@ -19,8 +21,7 @@ _valid_symbol_set = set(valid_symbols)
 class CMUDict:
     def __init__(self, file_or_path, keep_ambiguous=True):
         if isinstance(file_or_path, str):
-            with open(file_or_path, encoding='latin-1') as f:
-                entries = _parse_cmudict(f)
+            entries = _load_cmudict(file_or_path)
         else:
             entries = _parse_cmudict(file_or_path)
         if not keep_ambiguous:
@@ -37,6 +38,24 @@ class CMUDict:
 _alt_re = re.compile(r'\([0-9]+\)')
 
 
+def _load_cmudict(path):
+    # Parsed entries are pickled next to the dictionary file and reused while it is up to date
+    cache_path = path + '.pkl'
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    with open(path, encoding='latin-1') as f:
+        cmudict = _parse_cmudict(f)
+    try:
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cmudict, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return cmudict
+
+
 def _parse_cmudict(file):
     cmudict = {}
     for line in file:
@@ -6,6 +6,7 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
 # MIT License for more details.
 
+import contextlib
 import numpy as np
 from tqdm import tqdm
 
@@ -15,13 +16,15 @@ from torch.utils.tensorboard import SummaryWriter
 
 import params
 from model import GradTTS
-from data import TextMelSpeakerDataset, TextMelSpeakerBatchCollate
-from utils import plot_tensor, save_plot
+from data import TextMelSpeakerDataset, TextMelSpeakerBatchCollate, FrameBucketBatchSampler
+from utils import plot_tensor, save_plot, flush_scalars
 from text.symbols import symbols
 
 
 train_filelist_path = params.train_filelist_path
 valid_filelist_path = params.valid_filelist_path
+train_features_path = params.train_features_path
+valid_features_path = params.valid_features_path
 cmudict_path = params.cmudict_path
 add_blank = params.add_blank
 n_spks = params.n_spks
@@ -30,9 +33,13 @@ spk_emb_dim = params.spk_emb_dim
 log_dir = params.log_dir
 n_epochs = params.n_epochs
 batch_size = params.batch_size
+batch_frames = params.batch_frames
 out_size = params.out_size
 learning_rate = params.learning_rate
 random_seed = params.seed
+amp_dtype = {'bf16': torch.bfloat16, 'fp16': torch.float16, None: None}[params.amp_dtype]
+grad_accumulation = params.grad_accumulation
+log_every = params.log_every
 
 nsymbols = len(symbols) + 1 if add_blank else len(symbols)
 n_enc_channels = params.n_enc_channels
@@ -58,7 +65,12 @@ beta_max = params.beta_max
 pe_scale = params.pe_scale
 
 
+SCALARS = ['training/duration_loss', 'training/prior_loss', 'training/diffusion_loss',
+           'training/encoder_grad_norm', 'training/decoder_grad_norm']
+
+
 if __name__ == "__main__":
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     torch.manual_seed(random_seed)
     np.random.seed(random_seed)
 
@@ -68,25 +80,35 @@ if __name__ == "__main__":
     print('Initializing data loaders...')
     train_dataset = TextMelSpeakerDataset(train_filelist_path, cmudict_path, add_blank,
                                           n_fft, n_feats, sample_rate, hop_length,
-                                          win_length, f_min, f_max)
+                                          win_length, f_min, f_max, train_features_path)
     batch_collate = TextMelSpeakerBatchCollate()
-    loader = DataLoader(dataset=train_dataset, batch_size=batch_size,
-                        collate_fn=batch_collate, drop_last=True,
-                        num_workers=8, shuffle=True)
+    if batch_frames is not None:
+        lengths = train_dataset.get_mel_lengths(cache_path=f'{log_dir}/train_lengths.json')
+        batch_sampler = FrameBucketBatchSampler(lengths, batch_frames, seed=random_seed)
+        loader = DataLoader(dataset=train_dataset, batch_sampler=batch_sampler,
+                            collate_fn=batch_collate, num_workers=8)
+    else:
+        loader = DataLoader(dataset=train_dataset, batch_size=batch_size,
+                            collate_fn=batch_collate, drop_last=True,
+                            num_workers=8, shuffle=True)
     test_dataset = TextMelSpeakerDataset(valid_filelist_path, cmudict_path, add_blank,
                                          n_fft, n_feats, sample_rate, hop_length,
-                                         win_length, f_min, f_max)
+                                         win_length, f_min, f_max, valid_features_path)
 
     print('Initializing model...')
     model = GradTTS(nsymbols, n_spks, spk_emb_dim, n_enc_channels,
                     filter_channels, filter_channels_dp, 
                     n_heads, n_enc_layers, enc_kernel, enc_dropout, window_size, 
-                    n_feats, dec_dim, beta_min, beta_max, pe_scale).cuda()
+                    n_feats, dec_dim, beta_min, beta_max, pe_scale).to(device)
     print('Number of encoder parameters = %.2fm' % (model.encoder.nparams/1e6))
     print('Number of decoder parameters = %.2fm' % (model.decoder.nparams/1e6))
 
     print('Initializing optimizer...')
     optimizer = torch.optim.Adam(params=model.parameters(), lr=learning_rate)
+    assert amp_dtype != torch.float16 or device.type == 'cuda', 'fp16 mixed precision needs GPU, use bf16 on CPU.'
+    # Loss scaling is needed only for fp16, bf16 has the same exponent range as fp32
+    scaler = torch.cuda.amp.GradScaler(enabled=amp_dtype == torch.float16)
+    autocast = torch.autocast(device.type, dtype=amp_dtype) if amp_dtype is not None else contextlib.nullcontext()
 
     print('Logging test batch...')
     test_batch = test_dataset.sample_test_batch(size=params.test_size)
@@ -99,14 +121,15 @@ if __name__ == "__main__":
 
     print('Start training...')
     iteration = 0
+    log_buffer = []
     for epoch in range(1, n_epochs + 1):
         model.eval()
         print('Synthesis...')
         with torch.no_grad():
             for item in test_batch:
-                x = item['x'].to(torch.long).unsqueeze(0).cuda()
-                x_lengths = torch.LongTensor([x.shape[-1]]).cuda()
-                spk = item['spk'].to(torch.long).cuda()
+                x = item['x'].to(torch.long).unsqueeze(0).to(device)
+                x_lengths = torch.LongTensor([x.shape[-1]]).to(device)
+                spk = item['spk'].to(torch.long).to(device)
                 i = int(spk.cpu())
                 
                 y_enc, y_dec, attn = model(x, x_lengths, n_timesteps=50, spk=spk)
@@ -127,46 +150,48 @@ if __name__ == "__main__":
                           f'{log_dir}/alignment_{i}.png')
         
         model.train()
-        dur_losses = []
-        prior_losses = []
-        diff_losses = []
-        with tqdm(loader, total=len(train_dataset)//batch_size) as progress_bar:
-            for batch in progress_bar:
-                model.zero_grad()
-                x, x_lengths = batch['x'].cuda(), batch['x_lengths'].cuda()
-                y, y_lengths = batch['y'].cuda(), batch['y_lengths'].cuda()
-                spk = batch['spk'].cuda()
-                dur_loss, prior_loss, diff_loss = model.compute_loss(x, x_lengths,
-                                                                     y, y_lengths,
-                                                                     spk=spk, out_size=out_size)
-                loss = sum([dur_loss, prior_loss, diff_loss])
-                loss.backward()
-
+        epoch_scalars = []
+        step_losses = 0.0
+        model.zero_grad()
+        with tqdm(loader, total=len(loader)) as progress_bar:
+            for batch_idx, batch in enumerate(progress_bar):
+                x, x_lengths = batch['x'].to(device), batch['x_lengths'].to(device)
+                y, y_lengths = batch['y'].to(device), batch['y_lengths'].to(device)
+                spk = batch['spk'].to(device)
+                with autocast:
+                    dur_loss, prior_loss, diff_loss = model.compute_loss(x, x_lengths,
+                                                                         y, y_lengths,
+                                                                         spk=spk, out_size=out_size)
+                    loss = sum([dur_loss, prior_loss, diff_loss])
+                scaler.scale(loss / grad_accumulation).backward()
+                step_losses += torch.stack([dur_loss, prior_loss, diff_loss]).detach().float() / grad_accumulation
+                if (batch_idx + 1) % grad_accumulation > 0:
+                    continue
+
+                scaler.unscale_(optimizer)
                 enc_grad_norm = torch.nn.utils.clip_grad_norm_(model.encoder.parameters(), 
                                                             max_norm=1)
                 dec_grad_norm = torch.nn.utils.clip_grad_norm_(model.decoder.parameters(), 
                                                             max_norm=1)
-                optimizer.step()
-
-                logger.add_scalar('training/duration_loss', dur_loss,
-                                global_step=iteration)
-                logger.add_scalar('training/prior_loss', prior_loss,
-                                global_step=iteration)
-                logger.add_scalar('training/diffusion_loss', diff_loss,
-                                global_step=iteration)
-                logger.add_scalar('training/encoder_grad_norm', enc_grad_norm,
-                                global_step=iteration)
-                logger.add_scalar('training/decoder_grad_norm', dec_grad_norm,
-                                global_step=iteration)
-                
-                msg = f'Epoch: {epoch}, iteration: {iteration} | dur_loss: {dur_loss.item()}, prior_loss: {prior_loss.item()}, diff_loss: {diff_loss.item()}'
-                progress_bar.set_description(msg)
-                
-                dur_losses.append(dur_loss.item())
-                prior_losses.append(prior_loss.item())
-                diff_losses.append(diff_loss.item())
+                scaler.step(optimizer)
+                scaler.update()
+                model.zero_grad()
+
+                # Scalars stay on device until flush, so that training does not wait for device every step
+                grad_norms = torch.stack([enc_grad_norm, dec_grad_norm]).float()
+                log_buffer.append((iteration, torch.cat([step_losses, grad_norms])))
+                step_losses = 0.0
                 iteration += 1
 
+                if len(log_buffer) >= log_every:
+                    epoch_scalars += flush_scalars(logger, log_buffer, SCALARS)
+                    dur_loss, prior_loss, diff_loss = epoch_scalars[-1][:3]
+                    msg = f'Epoch: {epoch}, iteration: {iteration - 1} | dur_loss: {dur_loss}, prior_loss: {prior_loss}, diff_loss: {diff_loss}'
+                    progress_bar.set_description(msg)
+
+        epoch_scalars += flush_scalars(logger, log_buffer, SCALARS)
+        dur_losses, prior_losses, diff_losses = [[row[i] for row in epoch_scalars] for i in range(3)]
+
         msg = 'Epoch %d: duration loss = %.3f ' % (epoch, np.mean(dur_losses))
         msg += '| prior loss = %.3f ' % np.mean(prior_losses)
         msg += '| diffusion loss = %.3f\n' % np.mean(diff_losses)
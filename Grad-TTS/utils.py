@@ -45,6 +45,21 @@ def load_checkpoint(logdir, model, num=None):
     return model
 
 
+def flush_scalars(logger, buffer, names):
+    """
+    Writes buffered (step, values) pairs of device tensors to tensorboard
+    with a single device-to-host copy and empties the buffer. Returns copied values.
+    """
+    if len(buffer) == 0:
+        return []
+    values = torch.stack([value for _, value in buffer]).cpu().tolist()
+    for (step, _), row in zip(buffer, values):
+        for name, value in zip(names, row):
+            logger.add_scalar(name, value, global_step=step)
+    buffer.clear()
+    return values
+
+
 def save_figure_to_numpy(fig):
     data = np.fromstring(fig.canvas.tostring_rgb(), dtype=np.uint8, sep='')
     data = data.reshape(fig.canvas.get_width_height()[::-1] + (3,))
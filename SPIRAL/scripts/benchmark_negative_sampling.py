@@ -0,0 +1,91 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# USAGE: python scripts/benchmark_negative_sampling.py --batch_sizes=16,64,256 --n_negatives=100
+# Compares the per-utterance loop formerly used by ST2VecEncoder.sample_negatives_flat with the vectorized
+# sample_flat_negative_idxs, and checks that every negative comes from the same utterance and is not the positive.
+import argparse
+import time
+
+import torch
+
+from spiral_nemo.collections.asr.models.st2vec.st2vec_model import sample_flat_negative_idxs
+
+
+def loop_negative_idxs(nums, n_negatives, device):
+    neg_idxs_l = []
+    idx_start = 0
+    for num_i in nums:
+        tszs_i = torch.arange(num_i).unsqueeze(-1).expand(-1, n_negatives).flatten()
+        neg_idxs_i = torch.randint(low=0, high=num_i - 1, size=(n_negatives * num_i,))
+        neg_idxs_i[neg_idxs_i >= tszs_i] += 1
+        neg_idxs_i += idx_start
+        idx_start += num_i
+        neg_idxs_l.append(neg_idxs_i)
+    return torch.cat(neg_idxs_l).to(device)
+
+
+def vectorized_negative_idxs(lens, num_frames, n_negatives, device):
+    # in pre-training the lengths are already on the device and the number of frames is known from the features
+    return sample_flat_negative_idxs(lens.to(device), num_frames, n_negatives)
+
+
+def check(neg_idxs, lens, n_negatives):
+    lens = lens.to(neg_idxs.device)
+    utt_idxs = torch.repeat_interleave(torch.arange(len(lens), device=lens.device), lens)
+    frames = torch.arange(len(utt_idxs), device=lens.device).repeat_interleave(n_negatives)
+    assert neg_idxs.shape == frames.shape
+    assert torch.equal(utt_idxs[neg_idxs], utt_idxs[frames]), 'negative from another utterance'
+    assert not (neg_idxs == frames).any(), 'positive sampled as negative'
+
+
+def timeit(fn, repeats, device):
+    fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark negative sampling of SPIRAL pre-training')
+    parser.add_argument('--batch_sizes', type=str, default='16,64,256')
+    parser.add_argument('--n_negatives', type=int, default=100)
+    parser.add_argument('--min_frames', type=int, default=25, help='shortest utterance in encoder frames')
+    parser.add_argument('--max_frames', type=int, default=250, help='longest utterance in encoder frames')
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    print(' batch | frames | loop, ms | vectorized, ms | speedup')
+    for batch_size in [int(v) for v in args.batch_sizes.split(',')]:
+        lens = torch.randint(args.min_frames, args.max_frames + 1, size=(batch_size,))
+        nums = lens.tolist()
+        check(vectorized_negative_idxs(lens, sum(nums), args.n_negatives, device), lens, args.n_negatives)
+        check(loop_negative_idxs(nums, args.n_negatives, device), lens, args.n_negatives)
+
+        loop_ms = timeit(lambda: loop_negative_idxs(nums, args.n_negatives, device), args.repeats, device)
+        lens_device = lens.to(device)
+        vec_ms = timeit(lambda: vectorized_negative_idxs(lens_device, sum(nums), args.n_negatives, device),
+                        args.repeats, device)
+        print(f'{batch_size:6d} | {sum(nums):6d} | {loop_ms:8.2f} | {vec_ms:14.2f} | {loop_ms / vec_ms:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# USAGE: python scripts/benchmark_serving.py --model_path=<model.nemo> --manifest=<manifest.json>
+#        --rate=50 --max_batch_frames=480000,1920000 --max_wait_ms=5,20
+# Sends requests with Poisson arrivals to MicroBatchServer and reports latency percentiles and
+# throughput for every combination of batching settings.
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+import torch
+
+from spiral_nemo.collections.asr.parts.segment import AudioSegment
+from spiral_nemo.collections.asr.parts.serving import MicroBatchServer
+
+
+def load_model(model_type, model_path):
+    if model_type == 'rnnt_finetune':
+        from spiral_nemo.collections.asr.models.spec2vec.rnnt_finetune import RNNTFinetuneModel as model_cls
+    else:
+        from spiral_nemo.collections.asr.models.spec2vec.ctc_finetune import CTCFinetuneModel as model_cls
+    model = model_cls.restore_from(model_path, map_location='cuda' if torch.cuda.is_available() else 'cpu')
+    return model.eval()
+
+
+def load_audio(manifest, num_files, sample_rate):
+    audio = []
+    with open(manifest, 'r', encoding='utf-8') as f:
+        for line in f:
+            if len(audio) >= num_files:
+                break
+            entry = json.loads(line)
+            audio.append(AudioSegment.from_file(entry['audio_filepath'], target_sr=sample_rate).samples)
+    return audio
+
+
+async def run_load(model, audio, rate, num_requests, max_batch_frames, max_wait_ms, seed):
+    rng = random.Random(seed)
+    latencies = []
+
+    async def request(samples):
+        start = time.monotonic()
+        await server.transcribe(samples)
+        latencies.append(time.monotonic() - start)
+
+    async with MicroBatchServer(model, max_batch_frames=max_batch_frames, max_wait_ms=max_wait_ms) as server:
+        start = time.monotonic()
+        tasks = []
+        for _ in range(num_requests):
+            tasks.append(asyncio.ensure_future(request(rng.choice(audio))))
+            await asyncio.sleep(rng.expovariate(rate))
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+    return np.array(latencies) * 1000, num_requests / elapsed, server.num_requests / max(server.num_batches, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark micro-batching inference server')
+    parser.add_argument('--model_path', type=str, required=True, help='path to a .nemo model')
+    parser.add_argument('--model_type', type=str, default='ctc_finetune', choices=['ctc_finetune', 'rnnt_finetune'])
+    parser.add_argument('--manifest', type=str, required=True, help='manifest with audio files to send')
+    parser.add_argument('--num_files', type=int, default=200, help='number of audio files to load')
+    parser.add_argument('--rate', type=float, default=20.0, help='mean number of requests per second')
+    parser.add_argument('--num_requests', type=int, default=500)
+    parser.add_argument('--max_batch_frames', type=str, default='480000,1920000',
+                        help='comma separated values of max padded audio samples per batch')
+    parser.add_argument('--max_wait_ms', type=str, default='5,20,50', help='comma separated values of max wait')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    model = load_model(args.model_type, args.model_path)
+    audio = load_audio(args.manifest, args.num_files, model._inference_sample_rate)
+    # warm up
+    model.transcribe_audio(audio[:4], batch_size=4)
+
+    print(' max_frames | wait, ms | p50, ms | p95, ms | p99, ms |  utt/s | mean batch')
+    for max_batch_frames in [int(v) for v in args.max_batch_frames.split(',')]:
+        for max_wait_ms in [float(v) for v in args.max_wait_ms.split(',')]:
+            latencies, throughput, mean_batch = asyncio.get_event_loop().run_until_complete(
+                run_load(model, audio, args.rate, args.num_requests, max_batch_frames, max_wait_ms, args.seed))
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            print(f'{max_batch_frames:11d} | {max_wait_ms:8.1f} | {p50:7.1f} | {p95:7.1f} | {p99:7.1f} | '
+                  f'{throughput:6.1f} | {mean_batch:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
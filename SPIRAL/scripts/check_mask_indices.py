@@ -0,0 +1,138 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# USAGE: python scripts/check_mask_indices.py --trials=2000 --mask_prob=0.5 --mask_length=10
+# Samples masks with the numpy compute_mask_indices and with compute_mask_indices_torch for the same padded batch,
+# and for an unpadded batch of channels, and compares their statistics: masked elements per utterance, masked
+# probability of every position, number of masked spans and the spread of the number of masked elements within a
+# batch. Also times both versions, including the host-to-device copy of the numpy mask.
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from spiral_nemo.collections.asr.modules.wav2vec_modules import compute_mask_indices, compute_mask_indices_torch
+
+
+def make_padding_mask(lens, max_len, device):
+    return torch.arange(max_len, device=device).unsqueeze(0) >= torch.tensor(lens, device=device).unsqueeze(1)
+
+
+def numpy_mask(shape, padding_mask, args, device):
+    padding_mask = None if padding_mask is None else padding_mask.cpu()
+    mask, mask_num = compute_mask_indices(shape, padding_mask, args.mask_prob, args.mask_length,
+                                          min_masks=args.min_masks, shrink_to_batch_min=args.shrink_to_batch_min)
+    return torch.from_numpy(mask).to(device), torch.tensor(mask_num, device=device)
+
+
+def torch_mask(shape, padding_mask, args, device):
+    return compute_mask_indices_torch(shape, padding_mask, args.mask_prob, args.mask_length, min_masks=args.min_masks,
+                                      shrink_to_batch_min=args.shrink_to_batch_min, device=device)
+
+
+def num_spans(mask):
+    # number of runs of masked elements
+    starts = mask.clone()
+    starts[:, 1:] &= ~mask[:, :-1]
+    return starts.sum(dim=1)
+
+
+def collect_stats(fn, shape, padding_mask, args, device):
+    masked, mask_nums, spans = [], [], []
+    position_prob = torch.zeros(shape, device=device)
+    for _ in range(args.trials):
+        mask, mask_num = fn(shape, padding_mask, args, device)
+        assert padding_mask is None or not (mask & padding_mask.to(device)).any(), 'padding masked'
+        masked.append(mask.sum(dim=1).float())
+        mask_nums.append(mask_num.float())
+        spans.append(num_spans(mask).float())
+        position_prob += mask.float()
+    mask_nums = torch.stack(mask_nums)
+    # spread of the number of masked elements within a batch, before shrinking to the batch minimum
+    spread = (mask_nums.max(dim=1)[0] - mask_nums.min(dim=1)[0]).mean().view(1)
+    return (torch.stack(masked).mean(0), mask_nums.mean(0), torch.stack(spans).mean(0), spread,
+            position_prob / args.trials)
+
+
+def timeit(fn, shape, padding_mask, args, device):
+    fn(shape, padding_mask, args, device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        fn(shape, padding_mask, args, device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / args.repeats * 1000
+
+
+def compare(shape, padding_mask, lens, args, device):
+    np_stats = collect_stats(numpy_mask, shape, padding_mask, args, torch.device('cpu'))
+    pt_stats = collect_stats(torch_mask, shape, padding_mask, args, device)
+    pt_stats = [s.cpu() for s in pt_stats]
+
+    ok = True
+    print('   len | masked np | masked torch | mask_num np | mask_num torch | spans np | spans torch')
+    for i, length in enumerate(lens):
+        print(f'{length:6d} | {np_stats[0][i]:9.2f} | {pt_stats[0][i]:12.2f} | {np_stats[1][i]:11.2f} | '
+              f'{pt_stats[1][i]:14.2f} | {np_stats[2][i]:8.2f} | {pt_stats[2][i]:11.2f}')
+    print(f'spread of mask_num in a batch: np {np_stats[3].item():.2f}, torch {pt_stats[3].item():.2f}')
+    for name, np_stat, pt_stat in zip(['masked', 'mask_num', 'spans', 'mask_num spread'], np_stats[:4], pt_stats[:4]):
+        rel_diff = ((np_stat - pt_stat).abs() / np_stat.clamp(min=1.0)).max().item()
+        if rel_diff > args.tolerance:
+            ok = False
+            print(f'{name}: relative difference {rel_diff:.3f} exceeds {args.tolerance}')
+    position_diff = (np_stats[4] - pt_stats[4]).abs().max().item()
+    # binomial standard error of a position probability is at most 0.5 / sqrt(trials)
+    position_tolerance = 5 * 0.5 / np.sqrt(args.trials)
+    print(f'max difference of position masking probability: {position_diff:.4f} (tolerance {position_tolerance:.4f})')
+    return ok and position_diff <= position_tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare numpy and torch sampling of SPIRAL mask spans')
+    parser.add_argument('--lens', type=str, default='400,371,250,120,64,23', help='comma separated utterance lengths')
+    parser.add_argument('--channels', type=int, default=80, help='number of channels of the unpadded batch')
+    parser.add_argument('--mask_prob', type=float, default=0.5)
+    parser.add_argument('--mask_length', type=int, default=10)
+    parser.add_argument('--min_masks', type=int, default=2)
+    parser.add_argument('--no_shrink', dest='shrink_to_batch_min', action='store_false')
+    parser.add_argument('--trials', type=int, default=2000)
+    parser.add_argument('--repeats', type=int, default=100)
+    parser.add_argument('--tolerance', type=float, default=0.05, help='max relative difference of mean statistics')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    lens = [int(v) for v in args.lens.split(',')]
+    shape = (len(lens), max(lens))
+    padding_mask = make_padding_mask(lens, shape[1], device)
+
+    print('padded time steps')
+    ok = compare(shape, padding_mask, lens, args, device)
+    # channel masks are computed without a padding mask
+    print('\nunpadded channels')
+    ok = compare((len(lens), args.channels), None, [args.channels] * len(lens), args, device) and ok
+
+    np_ms = timeit(numpy_mask, shape, padding_mask, args, device)
+    pt_ms = timeit(torch_mask, shape, padding_mask, args, device)
+    print(f'numpy: {np_ms:.3f} ms, torch: {pt_ms:.3f} ms per batch')
+    print('OK' if ok else 'FAILED')
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,7 @@ from torch.utils.data import ChainDataset
 from nemo.collections.asr.parts.preprocessing.features import WaveformFeaturizer
 from nemo.collections.common import tokenizers
 from nemo.collections.common.parts.preprocessing import collections, parsers
+from spiral_nemo.collections.asr.parts.collections import CompiledASRAudioText
 from nemo.core.classes import Dataset, IterableDataset
 from nemo.core.neural_types import *
 from nemo.core.neural_types.elements import ProbsType
@@ -46,53 +47,50 @@ __all__ = [
 ]
 
 
-def _speech_collate_fn(batch, pad_id):
+def _collate_padded(tensors, lengths, pad_value=0, pad_to_multiple=1, pin_memory=False):
+    """Copies 1d tensors into one preallocated [B, T] tensor, T being the longest length rounded up to
+    a multiple of pad_to_multiple.
+    """
+    max_len = max(lengths)
+    if pad_to_multiple > 1:
+        max_len = int(math.ceil(max_len / pad_to_multiple)) * pad_to_multiple
+    # pinned memory allocated in a worker is copied to shared memory on its way to the main process
+    pin_memory = pin_memory and torch.cuda.is_available() and torch.utils.data.get_worker_info() is None
+    padded = torch.full((len(tensors), max_len), pad_value, dtype=tensors[0].dtype, pin_memory=pin_memory)
+    for i, (tensor, length) in enumerate(zip(tensors, lengths)):
+        padded[i, :length] = tensor[:length]
+    return padded
+
+
+def _speech_collate_fn(batch, pad_id, pad_to_multiple=1, pin_memory=False):
     """collate batch of audio sig, audio len, tokens, tokens len
     Args:
         batch (Optional[FloatTensor], Optional[LongTensor], LongTensor,
                LongTensor):  A tuple of tuples of signal, signal lengths,
                encoded tokens, and encoded tokens length.  This collate func
                assumes the signals are 1d torch tensors (i.e. mono audio).
+        pad_id: token used to pad transcripts.
+        pad_to_multiple: audio is padded to a multiple of this number of samples.
+        pin_memory: allocate the batch in pinned memory, when collating in the main process.
     """
     packed_batch = list(zip(*batch))
     if len(packed_batch) == 5:
-        _, audio_lengths, _, tokens_lengths, sample_ids = packed_batch
+        audio_signal, audio_lengths, tokens, tokens_lengths, sample_ids = packed_batch
     elif len(packed_batch) == 4:
         sample_ids = None
-        _, audio_lengths, _, tokens_lengths = packed_batch
+        audio_signal, audio_lengths, tokens, tokens_lengths = packed_batch
     else:
         raise ValueError("Expects 4 or 5 tensors in the batch!")
-    max_audio_len = 0
-    has_audio = audio_lengths[0] is not None
-    if has_audio:
-        max_audio_len = max(audio_lengths).item()
-    max_tokens_len = max(tokens_lengths).item()
-
-    audio_signal, tokens = [], []
-    for b in batch:
-        if len(b) == 5:
-            sig, sig_len, tokens_i, tokens_i_len, _ = b
-        else:
-            sig, sig_len, tokens_i, tokens_i_len = b
-        if has_audio:
-            sig_len = sig_len.item()
-            if sig_len < max_audio_len:
-                pad = (0, max_audio_len - sig_len)
-                sig = torch.nn.functional.pad(sig, pad)
-            audio_signal.append(sig)
-        tokens_i_len = tokens_i_len.item()
-        if tokens_i_len < max_tokens_len:
-            pad = (0, max_tokens_len - tokens_i_len)
-            tokens_i = torch.nn.functional.pad(tokens_i, pad, value=pad_id)
-        tokens.append(tokens_i)
 
+    has_audio = audio_lengths[0] is not None
     if has_audio:
-        audio_signal = torch.stack(audio_signal)
         audio_lengths = torch.stack(audio_lengths)
+        audio_signal = _collate_padded(audio_signal, audio_lengths.tolist(), pad_to_multiple=pad_to_multiple,
+                                       pin_memory=pin_memory)
     else:
         audio_signal, audio_lengths = None, None
-    tokens = torch.stack(tokens)
     tokens_lengths = torch.stack(tokens_lengths)
+    tokens = _collate_padded(tokens, tokens_lengths.tolist(), pad_value=pad_id, pin_memory=pin_memory)
     if sample_ids is None:
         return audio_signal, audio_lengths, tokens, tokens_lengths
     else:
@@ -117,6 +115,8 @@ class ASRManifestProcessor:
         bos_id: Id of beginning of sequence symbol to append if not None.
         eos_id: Id of end of sequence symbol to append if not None.
         pad_id: Id of pad symbol. Defaults to 0.
+        manifest_cache_dir: If set, manifests are compiled to memory-mapped arrays in this directory,
+            see `CompiledASRAudioText`.
     """
 
     def __init__(
@@ -130,17 +130,29 @@ class ASRManifestProcessor:
         eos_id: Optional[int] = None,
         pad_id: int = 0,
         index_by_file_id: bool = False,
+        manifest_cache_dir: Optional[str] = None,
     ):
         self.parser = parser
 
-        self.collection = collections.ASRAudioText(
-            manifests_files=manifest_filepath,
-            parser=parser,
-            min_duration=min_duration,
-            max_duration=max_duration,
-            max_number=max_utts,
-            index_by_file_id=index_by_file_id,
-        )
+        if manifest_cache_dir is not None:
+            self.collection = CompiledASRAudioText(
+                manifests_files=manifest_filepath,
+                parser=parser,
+                cache_dir=manifest_cache_dir,
+                min_duration=min_duration,
+                max_duration=max_duration,
+                max_number=max_utts,
+                index_by_file_id=index_by_file_id,
+            )
+        else:
+            self.collection = collections.ASRAudioText(
+                manifests_files=manifest_filepath,
+                parser=parser,
+                min_duration=min_duration,
+                max_duration=max_duration,
+                max_number=max_utts,
+                index_by_file_id=index_by_file_id,
+            )
 
         self.eos_id = eos_id
         self.bos_id = bos_id
@@ -239,6 +251,9 @@ class _AudioTextDataset(Dataset):
         eos_id: Id of end of sequence symbol to append if not None
         pad_id: Id of pad symbol. Defaults to 0
         return_sample_id (bool): whether to return the sample_id as a part of each sample
+        pad_to_multiple (int): pad the audio of a batch to a multiple of this number of samples
+        pin_memory (bool): collate batches in pinned memory when loading in the main process
+        manifest_cache_dir (str): directory of compiled, memory-mapped manifests, if set
     """
 
     @property
@@ -268,6 +283,9 @@ class _AudioTextDataset(Dataset):
         eos_id: Optional[int] = None,
         pad_id: int = 0,
         return_sample_id: bool = False,
+        pad_to_multiple: int = 1,
+        pin_memory: bool = False,
+        manifest_cache_dir: Optional[str] = None,
     ):
         if type(manifest_filepath) == str:
             manifest_filepath = manifest_filepath.split(",")
@@ -281,10 +299,13 @@ class _AudioTextDataset(Dataset):
             bos_id=bos_id,
             eos_id=eos_id,
             pad_id=pad_id,
+            manifest_cache_dir=manifest_cache_dir,
         )
         self.featurizer = WaveformFeaturizer(sample_rate=sample_rate, int_values=int_values, augmentor=augmentor)
         self.trim = trim
         self.return_sample_id = return_sample_id
+        self.pad_to_multiple = pad_to_multiple
+        self.pin_memory = pin_memory
 
     def get_manifest_sample(self, sample_id):
         return self.manifest_processor.collection[sample_id]
@@ -314,7 +335,8 @@ class _AudioTextDataset(Dataset):
         return len(self.manifest_processor.collection)
 
     def _collate_fn(self, batch):
-        return _speech_collate_fn(batch, pad_id=self.manifest_processor.pad_id)
+        return _speech_collate_fn(batch, pad_id=self.manifest_processor.pad_id, pad_to_multiple=self.pad_to_multiple,
+                                  pin_memory=self.pin_memory)
 
 
 class AudioToCharDataset(_AudioTextDataset):
@@ -346,6 +368,9 @@ class AudioToCharDataset(_AudioTextDataset):
         bos_id: Id of beginning of sequence symbol to append if not None
         eos_id: Id of end of sequence symbol to append if not None
         return_sample_id (bool): whether to return the sample_id as a part of each sample
+        pad_to_multiple (int): pad the audio of a batch to a multiple of this number of samples
+        pin_memory (bool): collate batches in pinned memory when loading in the main process
+        manifest_cache_dir (str): directory of compiled, memory-mapped manifests, if set
     """
 
     @property
@@ -379,6 +404,9 @@ class AudioToCharDataset(_AudioTextDataset):
         pad_id: int = 0,
         parser: Union[str, Callable] = 'en',
         return_sample_id: bool = False,
+        pad_to_multiple: int = 1,
+        pin_memory: bool = False,
+        manifest_cache_dir: Optional[str] = None,
     ):
         self.labels = labels
 
@@ -400,6 +428,9 @@ class AudioToCharDataset(_AudioTextDataset):
             eos_id=eos_id,
             pad_id=pad_id,
             return_sample_id=return_sample_id,
+            pad_to_multiple=pad_to_multiple,
+            pin_memory=pin_memory,
+            manifest_cache_dir=manifest_cache_dir,
         )
 
 
@@ -902,6 +933,9 @@ class AudioToBPEDataset(_AudioTextDataset):
         use_start_end_token: Boolean which dictates whether to add [BOS] and [EOS]
             tokens to beginning and ending of speech respectively.
         return_sample_id (bool): whether to return the sample_id as a part of each sample
+        pad_to_multiple (int): pad the audio of a batch to a multiple of this number of samples
+        pin_memory (bool): collate batches in pinned memory when loading in the main process
+        manifest_cache_dir (str): directory of compiled, memory-mapped manifests, if set
     """
 
     @property
@@ -929,6 +963,9 @@ class AudioToBPEDataset(_AudioTextDataset):
         trim: bool = False,
         use_start_end_token: bool = True,
         return_sample_id: bool = False,
+        pad_to_multiple: int = 1,
+        pin_memory: bool = False,
+        manifest_cache_dir: Optional[str] = None,
     ):
         if use_start_end_token and hasattr(tokenizer, 'bos_token'):
             bos_id = tokenizer.bos_id
@@ -971,6 +1008,9 @@ class AudioToBPEDataset(_AudioTextDataset):
             pad_id=pad_id,
             trim=trim,
             return_sample_id=return_sample_id,
+            pad_to_multiple=pad_to_multiple,
+            pin_memory=pin_memory,
+            manifest_cache_dir=manifest_cache_dir,
         )
 
 
@@ -1593,22 +1633,37 @@ class AudioDataset(Dataset):
         max_utts: int = 0,
         trim: bool = False,
         data_dir: str = '',
-        return_both: bool = False
+        return_both: bool = False,
+        pad_to_multiple: int = 1,
+        pin_memory: bool = False,
+        manifest_cache_dir: Optional[str] = None,
     ):
         print('intializing dataset!')
-        self.collection = collections.ASRAudioText(
-            manifests_files=manifest_filepath.split(','),
-            parser=None,
-            min_duration=min_duration,
-            max_duration=max_duration,
-            max_number=max_utts,
-        )
+        if manifest_cache_dir is not None:
+            self.collection = CompiledASRAudioText(
+                manifests_files=manifest_filepath.split(','),
+                parser=None,
+                cache_dir=manifest_cache_dir,
+                min_duration=min_duration,
+                max_duration=max_duration,
+                max_number=max_utts,
+            )
+        else:
+            self.collection = collections.ASRAudioText(
+                manifests_files=manifest_filepath.split(','),
+                parser=None,
+                min_duration=min_duration,
+                max_duration=max_duration,
+                max_number=max_utts,
+            )
 
         self.return_both = return_both
         self.featurizer = WaveformFeaturizer(sample_rate=sample_rate, int_values=int_values, augmentor=augmentor)
         self.trim = trim
         self.crop_size = crop_size
         self.data_dir = data_dir.strip()
+        self.pad_to_multiple = pad_to_multiple
+        self.pin_memory = pin_memory
 
     def __getitem__(self, index):
         sample = self.collection[index]
@@ -1638,69 +1693,45 @@ class AudioDataset(Dataset):
 
     def _collate_fn(self, batch):
         if self.return_both:
-            return _both_speech_only_collate_fn(batch)
+            return _both_speech_only_collate_fn(batch, pad_to_multiple=self.pad_to_multiple, pin_memory=self.pin_memory)
         else:
-            return _speech_only_collate_fn(batch)
+            return _speech_only_collate_fn(batch, pad_to_multiple=self.pad_to_multiple, pin_memory=self.pin_memory)
 
 
-def _speech_only_collate_fn(batch):
-    """collate batch of audio sig, audio len, tokens, tokens len
+def _speech_only_collate_fn(batch, pad_to_multiple=1, pin_memory=False):
+    """collate batch of audio sig, audio len
     Args:
-        batch (Optional[FloatTensor], Optional[LongTensor], LongTensor,
-               LongTensor):  A tuple of tuples of signal, signal lengths,
-               encoded tokens, and encoded tokens length.  This collate func
-               assumes the signals are 1d torch tensors (i.e. mono audio).
+        batch (FloatTensor, LongTensor):  A tuple of tuples of signal and signal lengths.
+            This collate func assumes the signals are 1d torch tensors (i.e. mono audio).
+        pad_to_multiple: audio is padded to a multiple of this number of samples.
+        pin_memory: allocate the batch in pinned memory, when collating in the main process.
     """
-    _, audio_lengths = zip(*batch)
+    audio_signal, audio_lengths = zip(*batch)
     assert audio_lengths[0] is not None
-    max_audio_len = max(audio_lengths).item()
-
-    audio_signal = []
-    for sig, sig_len in batch:
-        sig_len = sig_len.item()
-        if sig_len < max_audio_len:
-            pad = (0, max_audio_len - sig_len)
-            sig = torch.nn.functional.pad(sig, pad)
-        audio_signal.append(sig)
-
-    audio_signal = torch.stack(audio_signal)
     audio_lengths = torch.stack(audio_lengths)
+    audio_signal = _collate_padded(audio_signal, audio_lengths.tolist(), pad_to_multiple=pad_to_multiple,
+                                   pin_memory=pin_memory)
 
     return audio_signal, audio_lengths
 
 
-def _both_speech_only_collate_fn(batch):
-    """collate batch of audio sig, audio len, tokens, tokens len
+def _both_speech_only_collate_fn(batch, pad_to_multiple=1, pin_memory=False):
+    """collate batch of audio sig, audio len, perturbed audio sig, perturbed audio len
     Args:
-        batch (Optional[FloatTensor], Optional[LongTensor], LongTensor,
-               LongTensor):  A tuple of tuples of signal, signal lengths,
-               encoded tokens, and encoded tokens length.  This collate func
-               assumes the signals are 1d torch tensors (i.e. mono audio).
+        batch (FloatTensor, LongTensor, FloatTensor, LongTensor):  A tuple of tuples of signal, signal lengths,
+            perturbed signal and perturbed signal lengths.  This collate func assumes the signals are 1d torch
+            tensors (i.e. mono audio).
+        pad_to_multiple: audio is padded to a multiple of this number of samples.
+        pin_memory: allocate the batch in pinned memory, when collating in the main process.
     """
-    _, audio_lengths, _, perturbed_lengths = zip(*batch)
+    audio_signal, audio_lengths, perturbed_signal, perturbed_lengths = zip(*batch)
     assert audio_lengths[0] is not None
-    max_audio_len = max(audio_lengths).item()
-    max_perturbed_len = max(perturbed_lengths).item()
-
-    audio_signal = []
-    perturbed_signal = []
-    for sig, sig_len, p_sig, p_sig_len in batch:
-        sig_len = sig_len.item()
-        if sig_len < max_audio_len:
-            pad = (0, max_audio_len - sig_len)
-            sig = torch.nn.functional.pad(sig, pad)
-        audio_signal.append(sig)
-
-        p_sig_len = p_sig_len.item()
-        if p_sig_len < max_perturbed_len:
-            pad = (0, max_perturbed_len - p_sig_len)
-            p_sig = torch.nn.functional.pad(p_sig, pad)
-        perturbed_signal.append(p_sig)
-
-    audio_signal = torch.stack(audio_signal)
     audio_lengths = torch.stack(audio_lengths)
+    audio_signal = _collate_padded(audio_signal, audio_lengths.tolist(), pad_to_multiple=pad_to_multiple,
+                                   pin_memory=pin_memory)
 
-    perturbed_signal = torch.stack(perturbed_signal)
     perturbed_lengths = torch.stack(perturbed_lengths)
+    perturbed_signal = _collate_padded(perturbed_signal, perturbed_lengths.tolist(), pad_to_multiple=pad_to_multiple,
+                                       pin_memory=pin_memory)
 
     return audio_signal, audio_lengths, perturbed_signal, perturbed_lengths
@@ -31,6 +31,7 @@ import torch
 from omegaconf import DictConfig
 
 from spiral_nemo.collections.asr.data import audio_to_text
+from spiral_nemo.collections.asr.data.bucketing_sampler import DurationBucketingBatchSampler
 
 
 def get_char_dataset(config: dict, augmentor: Optional['AudioAugmentor'] = None) -> audio_to_text.AudioToCharDataset:
@@ -68,7 +69,10 @@ def get_char_dataset(config: dict, augmentor: Optional['AudioAugmentor'] = None)
         parser_add_end_space=config.get('parser_add_end_space', False),
         add_misc=config.get('add_misc', False),
         data_dir=config.get('data_dir', ''),
-        dup_factor=config.get('dup_factor', 1)
+        dup_factor=config.get('dup_factor', 1),
+        pad_to_multiple=config.get('pad_to_multiple', 1),
+        pin_memory=config.get('pin_memory', False),
+        manifest_cache_dir=config.get('manifest_cache_dir', None),
     )
     return dataset
 
@@ -91,7 +95,10 @@ def get_audio_dataset(config: dict, augmentor: Optional['AudioAugmentor'] = None
         max_utts=config.get('max_utts', 0),
         trim=config.get('trim_silence', False),
         data_dir=config.get('data_dir', ''),
-        return_both=return_both
+        return_both=return_both,
+        pad_to_multiple=config.get('pad_to_multiple', 1),
+        pin_memory=config.get('pin_memory', False),
+        manifest_cache_dir=config.get('manifest_cache_dir', None),
     )
     return dataset
 
@@ -133,10 +140,59 @@ def get_bpe_dataset(
         dup_factor=config.get('dup_factor', 1),
         sampling_nbest_size=config['subword_sampling_nbest_size'],
         sampling_alpha=config['subword_sampling_alpha'],
+        pad_to_multiple=config.get('pad_to_multiple', 1),
+        pin_memory=config.get('pin_memory', False),
+        manifest_cache_dir=config.get('manifest_cache_dir', None),
     )
     return dataset
 
 
+def get_duration_batch_sampler(
+    config: dict, dataset, global_rank: int = 0, world_size: int = 1
+) -> Optional[DurationBucketingBatchSampler]:
+    """
+    Instantiates a DurationBucketingBatchSampler over the manifest durations of `dataset` if the config sets
+    a budget of padded audio per batch, `batch_duration` in seconds or `batch_frames` in samples.
+
+    Args:
+        config: Config of the dataset.
+        dataset: AudioToCharDataset, AudioToBPEDataset or AudioDataset.
+        global_rank: Global rank of this device.
+        world_size: Global world size in the training method.
+
+    Returns:
+        An instance of DurationBucketingBatchSampler, or None if no budget is set.
+    """
+    batch_duration = config.get('batch_duration', None)
+    if config.get('batch_frames', None) is not None:
+        if batch_duration is not None:
+            raise ValueError('set only one of batch_duration and batch_frames')
+        batch_duration = config['batch_frames'] / config['sample_rate']
+    if batch_duration is None:
+        return None
+
+    collection = dataset.collection if hasattr(dataset, 'collection') else dataset.manifest_processor.collection
+    if hasattr(collection, 'durations'):
+        # compiled manifests
+        durations = collection.durations
+    else:
+        durations = [sample.duration for sample in collection]
+    if any(duration is None for duration in durations):
+        raise ValueError('bucketing by duration needs the duration of every manifest entry')
+
+    return DurationBucketingBatchSampler(
+        durations=durations,
+        batch_duration=batch_duration,
+        num_buckets=config.get('num_buckets', 30),
+        max_batch_size=config.get('max_batch_size', None),
+        shuffle=config.get('shuffle', False),
+        drop_last=config.get('drop_last', False),
+        num_replicas=world_size,
+        rank=global_rank,
+        seed=config.get('bucketing_seed', 0),
+    )
+
+
 def get_tarred_char_dataset(
     config: dict, shuffle_n: int, global_rank: int, world_size: int, augmentor: Optional['AudioAugmentor'] = None
 ) -> audio_to_text.TarredAudioToCharDataset:
@@ -0,0 +1,123 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import List, Optional
+
+import numpy as np
+from torch.utils.data import Sampler
+
+__all__ = ['DurationBucketingBatchSampler']
+
+
+class DurationBucketingBatchSampler(Sampler):
+    """Batch sampler which groups utterances of similar duration into batches under a budget of padded seconds.
+
+    Utterances are sorted by duration and split into `num_buckets` buckets of equal size. Every epoch, utterances
+    are shuffled within their bucket, packed into batches whose size times the longest duration in the batch stays
+    within `batch_duration`, and the batches of all buckets are shuffled together. All ranks build the same batches
+    from the same seed and take every `num_replicas`-th one, so they get the same number of batches.
+
+    The epoch advances every time the sampler is iterated, use `set_epoch` to set it explicitly.
+
+    Args:
+        durations: duration of every utterance of the dataset, in seconds.
+        batch_duration: budget of padded audio seconds per batch. A longer utterance makes a batch of its own.
+        num_buckets: number of duration buckets.
+        max_batch_size: optional upper bound on the number of utterances in a batch.
+        shuffle: shuffle utterances and batches, otherwise batches are in order of duration.
+        drop_last: drop the last batches which would not be shared by all ranks, otherwise repeat the first ones.
+        num_replicas: number of distributed ranks.
+        rank: rank of this process.
+        seed: random seed, which must be the same on all ranks.
+    """
+
+    def __init__(
+        self,
+        durations: List[float],
+        batch_duration: float,
+        num_buckets: int = 30,
+        max_batch_size: Optional[int] = None,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        num_replicas: int = 1,
+        rank: int = 0,
+        seed: int = 0,
+    ):
+        if batch_duration <= 0:
+            raise ValueError(f'batch_duration must be positive, got {batch_duration}')
+        if not 0 <= rank < num_replicas:
+            raise ValueError(f'rank {rank} is out of range for {num_replicas} replicas')
+        self.durations = np.asarray(durations, dtype=np.float32)
+        self.batch_duration = batch_duration
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        order = np.argsort(self.durations, kind='stable')
+        self.buckets = [bucket for bucket in np.array_split(order, min(num_buckets, max(len(order), 1)))
+                        if len(bucket) > 0]
+        self._batches_epoch = None
+        self._batches = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _pack(self, bucket):
+        batches = []
+        batch, max_duration = [], 0.0
+        for idx in bucket.tolist():
+            duration = max(max_duration, float(self.durations[idx]))
+            full = self.max_batch_size is not None and len(batch) >= self.max_batch_size
+            if batch and (full or duration * (len(batch) + 1) > self.batch_duration):
+                batches.append(batch)
+                batch, duration = [], float(self.durations[idx])
+            batch.append(idx)
+            max_duration = duration
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _rank_batches(self, epoch):
+        if self._batches_epoch != epoch:
+            rng = np.random.RandomState(self.seed + epoch)
+            batches = []
+            for bucket in self.buckets:
+                if self.shuffle:
+                    bucket = rng.permutation(bucket)
+                batches.extend(self._pack(bucket))
+            if self.shuffle:
+                batches = [batches[i] for i in rng.permutation(len(batches))]
+
+            if len(batches) % self.num_replicas != 0:
+                if self.drop_last:
+                    batches = batches[:len(batches) - len(batches) % self.num_replicas]
+                else:
+                    num_extra = self.num_replicas - len(batches) % self.num_replicas
+                    batches += [batches[i % len(batches)] for i in range(num_extra)]
+            self._batches = batches[self.rank::self.num_replicas]
+            self._batches_epoch = epoch
+        return self._batches
+
+    def __iter__(self):
+        batches = self._rank_batches(self.epoch)
+        self.epoch += 1
+        return iter(batches)
+
+    def __len__(self):
+        return len(self._rank_batches(self.epoch))
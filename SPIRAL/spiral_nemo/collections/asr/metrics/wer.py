@@ -29,7 +29,7 @@ from pytorch_lightning.metrics import Metric
 from spiral_nemo.collections.asr.parts.rnnt_utils import Hypothesis
 from spiral_nemo.utils import logging
 
-__all__ = ['word_error_rate', 'WER']
+__all__ = ['word_error_rate', 'ctc_greedy_collapse', 'WER']
 
 
 def word_error_rate(hypotheses: List[str], references: List[str], use_cer=False) -> float:
@@ -68,6 +68,33 @@ def word_error_rate(hypotheses: List[str], references: List[str], use_cer=False)
     return wer
 
 
+def ctc_greedy_collapse(predictions: torch.Tensor, predictions_len: torch.Tensor, blank_id: int) -> List[List[int]]:
+    """
+    Collapses repeated labels and removes blanks from greedy CTC predictions of a whole batch.
+    All masking is done on the device of `predictions`, only the remaining token ids are moved to CPU.
+    Args:
+      predictions: A torch.Tensor of shape [Batch, Time] of integer label indices
+      predictions_len: Optional tensor of length `Batch` with lengths of the sequences in `predictions`
+      blank_id: index of the CTC blank label
+    Returns:
+      list of decoded token id lists, one per sample
+    """
+    predictions = predictions.long()
+    keep = predictions != blank_id
+    keep[:, 1:] &= predictions[:, 1:] != predictions[:, :-1]
+    if predictions_len is not None:
+        frames = torch.arange(predictions.shape[1], device=predictions.device)
+        keep &= frames.unsqueeze(0) < predictions_len.to(predictions.device).unsqueeze(1)
+    tokens = predictions[keep].tolist()
+    lengths = keep.sum(dim=1).tolist()
+    decoded = []
+    start = 0
+    for length in lengths:
+        decoded.append(tokens[start:start + length])
+        start += length
+    return decoded
+
+
 class WER(Metric):
     """
     This metric computes numerator and denominator for Overall Word Error Rate (WER) between prediction and reference texts.
@@ -151,26 +178,18 @@ class WER(Metric):
             or a list of Hypothesis objects containing additional information.
         """
         hypotheses = []
-        # Drop predictions to CPU
-        prediction_cpu_tensor = predictions.long().cpu()
-        # iterate over batch
-        for ind in range(prediction_cpu_tensor.shape[self.batch_dim_index]):
-            prediction = prediction_cpu_tensor[ind].detach().numpy().tolist()
-            if predictions_len is not None:
-                prediction = prediction[: predictions_len[ind]]
-            # CTC decoding procedure
-            decoded_prediction = []
-            previous = self.blank_id
-            for p in prediction:
-                if (p != previous or previous == self.blank_id) and p != self.blank_id:
-                    decoded_prediction.append(p)
-                previous = p
-
+        decoded_predictions = ctc_greedy_collapse(predictions, predictions_len, self.blank_id)
+        if return_hypotheses:
+            prediction_cpu_tensor = predictions.long().cpu()
+        for ind, decoded_prediction in enumerate(decoded_predictions):
             text = self.decode_tokens_to_str(decoded_prediction)
 
             if not return_hypotheses:
                 hypothesis = text
             else:
+                prediction = prediction_cpu_tensor[ind].numpy().tolist()
+                if predictions_len is not None:
+                    prediction = prediction[: predictions_len[ind]]
                 hypothesis = Hypothesis(
                     y_sequence=None,
                     score=-1.0,
@@ -25,6 +25,7 @@ import editdistance
 import torch
 from pytorch_lightning.metrics import Metric
 
+from spiral_nemo.collections.asr.metrics.wer import ctc_greedy_collapse
 from spiral_nemo.collections.asr.parts.rnnt_utils import Hypothesis
 from spiral_nemo.collections.common.tokenizers.tokenizer_spec import TokenizerSpec
 from spiral_nemo.utils import logging
@@ -110,26 +111,18 @@ class WERBPE(Metric):
             or a list of Hypothesis objects containing additional information.
         """
         hypotheses = []
-        # Drop predictions to CPU
-        prediction_cpu_tensor = predictions.long().cpu()
-        # iterate over batch
-        for ind in range(prediction_cpu_tensor.shape[self.batch_dim_index]):
-            prediction = prediction_cpu_tensor[ind].detach().numpy().tolist()
-            if predictions_len is not None:
-                prediction = prediction[: predictions_len[ind]]
-            # CTC decoding procedure
-            decoded_prediction = []
-            previous = self.blank_id
-            for p in prediction:
-                if (p != previous or previous == self.blank_id) and p != self.blank_id:
-                    decoded_prediction.append(p)
-                previous = p
-
+        decoded_predictions = ctc_greedy_collapse(predictions, predictions_len, self.blank_id)
+        if return_hypotheses:
+            prediction_cpu_tensor = predictions.long().cpu()
+        for ind, decoded_prediction in enumerate(decoded_predictions):
             text = self.decode_tokens_to_str(decoded_prediction)
 
             if not return_hypotheses:
                 hypothesis = text
             else:
+                prediction = prediction_cpu_tensor[ind].numpy().tolist()
+                if predictions_len is not None:
+                    prediction = prediction[: predictions_len[ind]]
                 hypothesis = Hypothesis(
                     y_sequence=None,  # logprob info added by transcribe method
                     score=-1.0,
@@ -98,6 +98,17 @@ class DatasetConfig(nemo.core.classes.dataset.DatasetConfig):
     add_misc: bool = False
     subword_sampling_nbest_size: Optional[int] = None
     subword_sampling_alpha: Optional[float] = None
+    # pad the audio of each batch to a multiple of this number of samples
+    pad_to_multiple: int = 1
+    # batches of utterances of similar durations under a budget of padded audio, in seconds or samples,
+    # instead of batch_size (see DurationBucketingBatchSampler)
+    batch_duration: Optional[float] = None
+    batch_frames: Optional[int] = None
+    num_buckets: int = 30
+    max_batch_size: Optional[int] = None
+    bucketing_seed: int = 0
+    # compile manifests to memory-mapped arrays cached in this directory (see CompiledASRAudioText)
+    manifest_cache_dir: Optional[str] = None
 
 
 @dataclass
@@ -111,6 +122,17 @@ class AudioDatasetConfig(nemo.core.classes.dataset.DatasetConfig):
     max_duration: Optional[float] = None
     min_duration: Optional[float] = None
     crop_size: Optional[int] = None
+    # pad the audio of each batch to a multiple of this number of samples
+    pad_to_multiple: int = 1
+    # batches of utterances of similar durations under a budget of padded audio, in seconds or samples,
+    # instead of batch_size (see DurationBucketingBatchSampler)
+    batch_duration: Optional[float] = None
+    batch_frames: Optional[int] = None
+    num_buckets: int = 30
+    max_batch_size: Optional[int] = None
+    bucketing_seed: int = 0
+    # compile manifests to memory-mapped arrays cached in this directory (see CompiledASRAudioText)
+    manifest_cache_dir: Optional[str] = None
     prefetch_factor: Optional[int] = 2
     persistent_workers: Optional[bool] = False
 
@@ -35,6 +35,7 @@
 #
 import contextlib
 import copy
+import io
 import itertools
 import json
 import os
@@ -42,6 +43,7 @@ import tempfile
 from math import ceil
 from typing import Dict, List, Optional, Union
 
+import numpy as np
 import torch
 from omegaconf import DictConfig, OmegaConf, open_dict, ListConfig
 from pytorch_lightning import Trainer
@@ -49,13 +51,57 @@ from tqdm.auto import tqdm
 
 from spiral_nemo.collections.asr.data import audio_to_text_dataset
 from spiral_nemo.collections.asr.losses.ctc import CTCLoss
-from nemo.collections.asr.metrics.wer import WER
-from nemo.collections.asr.metrics.wer_bpe import WERBPE
+from spiral_nemo.collections.asr.metrics.wer import WER
+from spiral_nemo.collections.asr.metrics.wer_bpe import WERBPE
 from spiral_nemo.collections.asr.models.asr_model import ASRModel
+from spiral_nemo.collections.asr.parts.batch_perturb import BatchAudioAugmentor
+from spiral_nemo.collections.asr.parts.batching import length_sorted_batches, pad_signals
+from spiral_nemo.collections.asr.parts.convolution_layers import ConvNormAct
+from spiral_nemo.collections.asr.parts.ctc_beam_search import CTCBeamSearchDecoder
+from spiral_nemo.collections.asr.parts.logprob_store import LogprobStoreWriter
 from spiral_nemo.collections.asr.parts.perturb import process_augmentations, RandomNoisePerturbation, AudioAugmentor
+from spiral_nemo.collections.asr.parts.segment import AudioSegment
+from spiral_nemo.collections.asr.parts.st2vec_streaming import CTCStreamingTranscriber
 from spiral_nemo.utils import logging
 
 
+class _WindowLogprobsMerger:
+    """
+    Merges frame log probabilities of overlapping windows of a file, added in time order, into one sequence.
+    Over the overlap, log probabilities of both windows are linearly cross-faded and renormalized.
+
+    Args:
+        num_frames: number of frames of the file.
+        overlap_frames: number of frames shared by neighbouring windows.
+    """
+
+    def __init__(self, num_frames, overlap_frames):
+        self.num_frames = num_frames
+        self.overlap_frames = overlap_frames
+        self.total = None
+        self.weight = torch.zeros(num_frames, 1)
+        self.end = 0
+
+    def add(self, lp, offset, first, last):
+        """Adds log probabilities [T, V] of the window starting at frame `offset` of the file."""
+        if self.total is None:
+            self.total = torch.zeros(self.num_frames, lp.shape[1])
+        length = min(lp.shape[0], self.num_frames - offset)
+        w = torch.ones(length, 1)
+        fade = min(self.overlap_frames, length)
+        ramp = (torch.arange(fade, dtype=torch.float) + 0.5).unsqueeze(1) / max(fade, 1)
+        if not first:
+            w[:fade] = ramp
+        if not last:
+            w[length - fade:] = torch.min(w[length - fade:], ramp.flip(0))
+        self.total[offset:offset + length] += w * lp[:length]
+        self.weight[offset:offset + length] += w
+        self.end = max(self.end, offset + length)
+
+    def merged(self):
+        return torch.log_softmax(self.total[:self.end] / self.weight[:self.end].clamp(min=1e-6), dim=-1)
+
+
 class CTCFinetuneModel(ASRModel):
     def __init__(self, cfg: DictConfig, trainer: Trainer = None):
         # Get global rank and total number of GPU workers for IterableDataset partitioning, if applicable
@@ -83,6 +129,8 @@ class CTCFinetuneModel(ASRModel):
             with open_dict(cfg):
                 cfg.decoder.vocabulary = ListConfig(list(vocabulary.values()))
         self.add_end_space = cfg.add_end_space
+        # set up with the training data
+        self.batch_augmentor = None
 
         super().__init__(cfg=cfg, trainer=trainer)
 
@@ -133,10 +181,12 @@ class CTCFinetuneModel(ASRModel):
 
     @torch.no_grad()
     def transcribe(
-        self, paths2audio_files: List[str], batch_size: int = 4, logprobs=False, return_hypotheses: bool = False
+        self, paths2audio_files: List[str], batch_size: int = 4, logprobs=False, return_hypotheses: bool = False,
+        beam_decoder: Optional[CTCBeamSearchDecoder] = None,
     ) -> List[str]:
         """
-        Uses greedy decoding to transcribe audio files. Use this method for debugging and prototyping.
+        Uses greedy decoding (or beam search if `beam_decoder` is given) to transcribe audio files.
+        Use this method for debugging and prototyping.
 
         Args:
             paths2audio_files: (a list) of paths to audio files. \
@@ -147,6 +197,8 @@ class CTCFinetuneModel(ASRModel):
             logprobs: (bool) pass True to get log probabilities instead of transcripts.
             return_hypotheses: (bool) Either return hypotheses or text
                 With hypotheses can do some postprocessing like getting timestamp or rescoring
+            beam_decoder: (CTCBeamSearchDecoder) CTC prefix beam search decoder, optionally with n-gram LM fusion,
+                see `make_beam_decoder`. Utterances of a batch are decoded on CPU, in parallel if the decoder has workers.
 
         Returns:
             A list of transcriptions (or raw log probabilities if logprobs is True) in the same order as paths2audio_files
@@ -162,65 +214,261 @@ class CTCFinetuneModel(ASRModel):
 
         # We will store transcriptions here
         hypotheses = []
-        # Model's mode and device
-        mode = self.training
         device = next(self.parameters()).device
-        dither_value = self.preprocessor.featurizer.dither
-        pad_to_value = self.preprocessor.featurizer.pad_to
 
-        try:
-            self.preprocessor.featurizer.dither = 0.0
-            self.preprocessor.featurizer.pad_to = 0
-            # Switch model to evaluation mode
-            self.eval()
-            # Freeze the encoder and decoder modules
-            self.encoder.freeze()
-            self.decoder.freeze()
+        with self._inference_mode():
             logging_level = logging.get_verbosity()
             logging.set_verbosity(logging.WARNING)
-            # Work in tmp directory - will store manifest file there
-            with tempfile.TemporaryDirectory() as tmpdir:
-                with open(os.path.join(tmpdir, 'manifest.json'), 'w') as fp:
-                    for audio_file in paths2audio_files:
-                        entry = {'audio_filepath': audio_file, 'duration': 100000, 'text': 'nothing'}
-                        fp.write(json.dumps(entry) + '\n')
-
-                config = {'paths2audio_files': paths2audio_files, 'batch_size': batch_size, 'temp_dir': tmpdir}
-
-                temporary_datalayer = self._setup_transcribe_dataloader(config)
-                for test_batch in tqdm(temporary_datalayer, desc="Transcribing"):
-                    logits, logits_len, greedy_predictions = self.forward(
-                        input_signal=test_batch[0].to(device), input_signal_length=test_batch[1].to(device)
-                    )
-                    if logprobs:
-                        # dump log probs per file
-                        for idx in range(logits.shape[0]):
-                            hypotheses.append(logits[idx][: logits_len[idx]])
-                    else:
-                        current_hypotheses = self._wer.ctc_decoder_predictions_tensor(
-                            greedy_predictions, predictions_len=logits_len, return_hypotheses=return_hypotheses,
+            try:
+                # Work in tmp directory - will store manifest file there
+                with tempfile.TemporaryDirectory() as tmpdir:
+                    with open(os.path.join(tmpdir, 'manifest.json'), 'w') as fp:
+                        for audio_file in paths2audio_files:
+                            entry = {'audio_filepath': audio_file, 'duration': 100000, 'text': 'nothing'}
+                            fp.write(json.dumps(entry) + '\n')
+
+                    config = {'paths2audio_files': paths2audio_files, 'batch_size': batch_size, 'temp_dir': tmpdir}
+
+                    temporary_datalayer = self._setup_transcribe_dataloader(config)
+                    for test_batch in tqdm(temporary_datalayer, desc="Transcribing"):
+                        hypotheses += self._transcribe_batch(
+                            test_batch[0].to(device), test_batch[1].to(device), logprobs=logprobs,
+                            return_hypotheses=return_hypotheses, beam_decoder=beam_decoder,
                         )
+                        del test_batch
+            finally:
+                logging.set_verbosity(logging_level)
+        return hypotheses
+
+    @torch.no_grad()
+    def transcribe_audio(
+        self,
+        audio: List[Union[np.ndarray, torch.Tensor, bytes]],
+        batch_size: int = 4,
+        sample_rate: Optional[int] = None,
+        logprobs: bool = False,
+        return_hypotheses: bool = False,
+        beam_decoder: Optional[CTCBeamSearchDecoder] = None,
+    ) -> List[str]:
+        """
+        Transcribes audio held in memory, without writing a manifest or building a dataloader.
+        Utterances are sorted by length into batches to minimize padding.
+
+        Args:
+            audio: (a list) of 1-D numpy arrays or torch tensors of samples, or bytes of encoded audio files.
+            batch_size: (int) batch size to use during inference.
+            sample_rate: (int) sample rate of the arrays/tensors, if it differs from the model's sample rate.
+            logprobs: (bool) pass True to get log probabilities instead of transcripts.
+            return_hypotheses: (bool) Either return hypotheses or text
+            beam_decoder: (CTCBeamSearchDecoder) decoder to use instead of greedy decoding.
+
+        Returns:
+            A list of transcriptions (or log probabilities if logprobs is True) in the same order as audio
+        """
+        signals = [self._audio_to_tensor(a, sample_rate) for a in audio]
+        results = [None] * len(signals)
+        device = next(self.parameters()).device
+        with self._inference_mode():
+            for batch_idx in length_sorted_batches([len(signal) for signal in signals], batch_size):
+                signal, signal_len = pad_signals([signals[i] for i in batch_idx])
+                batch_results = self._transcribe_batch(
+                    signal.to(device), signal_len.to(device), logprobs=logprobs,
+                    return_hypotheses=return_hypotheses, beam_decoder=beam_decoder,
+                )
+                for i, result in zip(batch_idx, batch_results):
+                    results[i] = result
+        return results
 
-                        if return_hypotheses:
-                            # dump log probs per file
-                            for idx in range(logits.shape[0]):
-                                current_hypotheses[idx].y_sequence = logits[idx][: logits_len[idx]]
+    def _transcribe_batch(self, signal, signal_len, logprobs=False, return_hypotheses=False, beam_decoder=None):
+        """Returns per-utterance transcriptions, hypotheses or log probabilities of a padded batch of audio."""
+        if return_hypotheses and logprobs:
+            raise ValueError(
+                "Either `return_hypotheses` or `logprobs` can be True at any given time."
+                "Returned hypotheses will contain the logprobs."
+            )
+        logits, logits_len, greedy_predictions, _ = self.forward(
+            input_signal=signal, input_signal_length=signal_len, global_step=None
+        )
+        if logprobs:
+            # dump log probs per file
+            return [logits[idx][: logits_len[idx]] for idx in range(logits.shape[0])]
+
+        if beam_decoder is not None:
+            logits_cpu = logits.float().cpu().numpy()
+            hypotheses = beam_decoder.decode_batch(
+                [logits_cpu[idx, : logits_len[idx]] for idx in range(logits.shape[0])],
+                return_hypotheses=return_hypotheses,
+            )
+        else:
+            hypotheses = self._wer.ctc_decoder_predictions_tensor(
+                greedy_predictions, predictions_len=logits_len, return_hypotheses=return_hypotheses,
+            )
 
-                        hypotheses += current_hypotheses
+        if return_hypotheses:
+            # dump log probs per file
+            for idx in range(logits.shape[0]):
+                hypotheses[idx].y_sequence = logits[idx][: logits_len[idx]]
+        return hypotheses
+
+    def _inference_featurizer(self):
+        return self.encoder.wav2spec.featurizer
+
+    @property
+    def _inference_sample_rate(self):
+        return self.encoder.wav2spec._sample_rate
 
-                    del greedy_predictions
-                    del logits
-                    del test_batch
+    @contextlib.contextmanager
+    def _inference_mode(self):
+        """Switches the model to evaluation mode and disables dither and padding of features, restores them on exit."""
+        mode = self.training
+        featurizer = self._inference_featurizer()
+        dither_value = featurizer.dither
+        pad_to_value = featurizer.pad_to
+        try:
+            featurizer.dither = 0.0
+            featurizer.pad_to = 0
+            self.eval()
+            yield
         finally:
             # set mode back to its original value
             self.train(mode=mode)
-            self.preprocessor.featurizer.dither = dither_value
-            self.preprocessor.featurizer.pad_to = pad_to_value
-            if mode is True:
-                self.encoder.unfreeze()
-                self.decoder.unfreeze()
-            logging.set_verbosity(logging_level)
-        return hypotheses
+            featurizer.dither = dither_value
+            featurizer.pad_to = pad_to_value
+
+    def _audio_to_tensor(self, audio, sample_rate=None):
+        target_sr = self._inference_sample_rate
+        if isinstance(audio, (bytes, bytearray)):
+            segment = AudioSegment.from_file(io.BytesIO(audio), target_sr=target_sr)
+        else:
+            if isinstance(audio, torch.Tensor):
+                audio = audio.detach().cpu().numpy()
+            segment = AudioSegment(audio, sample_rate or target_sr, target_sr=target_sr)
+        return torch.from_numpy(segment.samples)
+
+    @torch.no_grad()
+    def transcribe_long(
+        self,
+        paths2audio_files: List[str],
+        window_sec: float = 20.0,
+        overlap_sec: float = 2.0,
+        batch_size: int = 8,
+        logprobs: bool = False,
+        beam_decoder: Optional[CTCBeamSearchDecoder] = None,
+    ) -> List[str]:
+        """
+        Transcribes audio files of any length with a fixed memory ceiling.
+        Files are sliced into windows of `window_sec` seconds, neighbouring windows share `overlap_sec` seconds.
+        Files are processed one at a time: their windows are batched together, and frame log probabilities of
+        overlapping windows are cross-faded as they are computed, so each file is decoded as a whole.
+
+        Args:
+            paths2audio_files: (a list) of paths to audio files.
+            window_sec: (float) length of a window in seconds, bounds the memory used by self-attention.
+            overlap_sec: (float) minimum length of audio shared by neighbouring windows in seconds.
+            batch_size: (int) number of windows to encode at once.
+            logprobs: (bool) pass True to get merged log probabilities instead of transcripts.
+            beam_decoder: (CTCBeamSearchDecoder) decoder to use instead of greedy decoding.
+
+        Returns:
+            A list of transcriptions (or log probabilities if logprobs is True) in the same order as paths2audio_files
+        """
+        assert 0 <= overlap_sec < window_sec / 2
+        sample_rate = self._inference_sample_rate
+        stride, upsample_rate = self._log_probs_stride()
+        window = int(window_sec * sample_rate)
+        # windows start at multiples of the stride, so that their frames are aligned with the frames of the file
+        step = (window - int(overlap_sec * sample_rate)) // stride * stride
+        assert step > 0, 'window_sec - overlap_sec must be longer than the stride of the encoder'
+        overlap = window - step
+        overlap_frames = overlap // stride * upsample_rate
+
+        device = next(self.parameters()).device
+        results = []
+        with self._inference_mode():
+            for audio_file in tqdm(paths2audio_files, desc="Transcribing"):
+                samples = AudioSegment.from_file(audio_file, target_sr=sample_rate).samples
+                if len(samples) == 0:
+                    if logprobs:
+                        results.append(torch.zeros(0, self.decoder.num_classes_with_blank))
+                    else:
+                        results.append('')
+                    continue
+
+                starts = list(range(0, max(len(samples) - overlap, 1), step))
+                merger = _WindowLogprobsMerger(-(-len(samples) // stride) * upsample_rate, overlap_frames)
+                for batch_start in range(0, len(starts), batch_size):
+                    batch_starts = starts[batch_start:batch_start + batch_size]
+                    signal, signal_len = pad_signals([torch.from_numpy(samples[start:start + window])
+                                                      for start in batch_starts])
+                    log_probs, encoded_len, _, _ = self.forward(
+                        input_signal=signal.to(device), input_signal_length=signal_len.to(device), global_step=None
+                    )
+                    log_probs = log_probs.float().cpu()
+                    for j, start in enumerate(batch_starts):
+                        merger.add(log_probs[j, :encoded_len[j]], offset=start // stride * upsample_rate,
+                                   first=start == 0, last=start == starts[-1])
+                file_logprobs = merger.merged()
+
+                if logprobs:
+                    results.append(file_logprobs)
+                elif beam_decoder is not None:
+                    results.append(beam_decoder.decode(file_logprobs.numpy()))
+                else:
+                    predictions = file_logprobs.argmax(dim=-1).unsqueeze(0)
+                    results.append(self._wer.ctc_decoder_predictions_tensor(predictions)[0])
+        return results
+
+    def _log_probs_stride(self):
+        """
+        Returns the number of audio samples per encoder frame, i.e. the hop of the preprocessor times the strides
+        of all subsampling convolutions, and the number of log probability frames per encoder frame.
+        """
+        stride = self._inference_featurizer().hop_length
+        feature_encoder = self.encoder.feature_encoder
+        modules = list(feature_encoder.conv2d_block or []) + list(feature_encoder.block_modules)
+        modules += list(self.decoder.conv_layers)
+        for module in modules:
+            if isinstance(module, ConvNormAct):
+                stride *= module.subsample_factor
+        upsample_rate = 1 if self.decoder.proj_upsampling is None else self.decoder.proj_upsampling.upsample_rate
+        return stride, upsample_rate
+
+    def make_beam_decoder(self, **kwargs) -> CTCBeamSearchDecoder:
+        """
+        Creates a CTC prefix beam search decoder for the vocabulary of this model, to be passed to `transcribe`.
+
+        Args:
+            kwargs: arguments of :class:`CTCBeamSearchDecoder`, e.g. `beam_size`, `token_top_k`, `lm_path`,
+                `lm_weight`, `word_bonus` and `num_workers`.
+        """
+        if self.use_bpe:
+            vocabulary = self.tokenizer.ids_to_tokens(list(range(self.tokenizer.vocab_size)))
+        else:
+            vocabulary = self.decoder.vocabulary
+        return CTCBeamSearchDecoder(vocabulary=vocabulary, blank_id=self.decoder.blank_idx, **kwargs)
+
+    def streaming_transcriber(
+        self,
+        hop_sec: float = 0.16,
+        look_back_sec: Optional[float] = 10.0,
+        look_ahead_sec: float = 0.32,
+        conv_look_ahead: bool = True,
+        keep_log_probs: bool = False,
+    ) -> CTCStreamingTranscriber:
+        """
+        Creates a stateful transcriber of a live audio stream, which encodes every hop of audio only once
+        using cached convolution context and attention keys/values, and returns partial transcriptions.
+
+        Args:
+            hop_sec: (float) amount of audio encoded at once in seconds, the main latency/throughput trade-off.
+            look_back_sec: (float) attention history of transformer layers in seconds, None keeps all of it.
+            look_ahead_sec: (float) future context of transformer frames in seconds, adds to the latency.
+            conv_look_ahead: (bool) wait for the right context of convolutions, which makes them exact.
+            keep_log_probs: (bool) keep log probabilities of all frames, needed to finish with a beam decoder.
+        """
+        return CTCStreamingTranscriber(self, hop_sec=hop_sec, look_back_sec=look_back_sec,
+                                       look_ahead_sec=look_ahead_sec, conv_look_ahead=conv_look_ahead,
+                                       keep_log_probs=keep_log_probs)
 
     def change_vocabulary(self, new_vocabulary: List[str]):
         """
@@ -260,11 +508,13 @@ class CTCFinetuneModel(ASRModel):
             )
             self._wer = WER(
                 vocabulary=self.decoder.vocabulary,
+                blank_id=self.decoder.blank_idx,
                 batch_dim_index=0,
                 use_cer=self._cfg.get('use_cer', False),
                 ctc_decode=True,
                 dist_sync_on_step=True,
                 log_prediction=self._cfg.get("log_prediction", False),
+                strip_end_space=self.add_end_space,
             )
 
             # Update config
@@ -295,6 +545,21 @@ class CTCFinetuneModel(ASRModel):
         else:
             dataset = audio_to_text_dataset.get_char_dataset(config=config, augmentor=augmentor)
 
+        batch_sampler = audio_to_text_dataset.get_duration_batch_sampler(
+            config=config, dataset=dataset, global_rank=self.global_rank, world_size=self.world_size
+        )
+        if batch_sampler is not None:
+            if self.world_size > 1 and getattr(self._trainer, 'replace_sampler_ddp', False):
+                raise ValueError('batches by duration are split between ranks by their sampler, '
+                                 'set trainer.replace_sampler_ddp=false')
+            return torch.utils.data.DataLoader(
+                dataset=dataset,
+                batch_sampler=batch_sampler,
+                collate_fn=dataset.collate_fn,
+                num_workers=config.get('num_workers', 0),
+                pin_memory=config.get('pin_memory', False),
+            )
+
         return torch.utils.data.DataLoader(
             dataset=dataset,
             batch_size=config['batch_size'],
@@ -327,6 +592,9 @@ class CTCFinetuneModel(ASRModel):
         self._update_dataset_config(dataset_name='train', config=train_data_config)
 
         self._train_dl = self._setup_dataloader_from_config(config=train_data_config, noise_perturb_config=self._cfg['noise_perturb'])
+        batch_perturb_config = self._cfg.get('batch_perturb')
+        if batch_perturb_config is not None:
+            self.batch_augmentor = BatchAudioAugmentor(**batch_perturb_config)
 
         # Need to set this because if using an IterableDataset, the length of the dataloader is the total number
         # of samples rather than the number of batches, and this messes up the tqdm progress bar.
@@ -425,6 +693,8 @@ class CTCFinetuneModel(ASRModel):
 
     def training_step(self, batch, batch_nb):
         signal, signal_len, transcript, transcript_len = batch
+        if self.batch_augmentor is not None:
+            signal, signal_len = self.batch_augmentor(signal, signal_len)
 
         log_probs, encoded_len, predictions, _ = self(input_signal=signal, input_signal_length=signal_len,
                                                    global_step=self.trainer.global_step)
@@ -437,7 +707,8 @@ class CTCFinetuneModel(ASRModel):
 
         return {'loss': loss_value, 'log': tensorboard_logs}
 
-    def validation_step(self, batch, batch_idx, dataloader_idx=0, decode_results=None):
+    def validation_step(self, batch, batch_idx, dataloader_idx=0, decode_results=None, outputs_mode=None,
+                        stage='validation'):
         signal, signal_len, transcript, transcript_len = batch
         log_probs, encoded_len, predictions, logits = self(input_signal=signal, input_signal_length=signal_len, global_step=None)
 
@@ -448,19 +719,97 @@ class CTCFinetuneModel(ASRModel):
             predictions=predictions, targets=transcript, target_lengths=transcript_len, predictions_lengths=encoded_len,
             log_prediction=batch_idx < 3, decode_results=decode_results)
         wer, wer_num, wer_denom = self._wer.compute()
-        return {
+        logs = {
             'val_loss': loss_value,
             'val_wer_num': wer_num,
             'val_wer_denom': wer_denom,
             'val_wer': wer,
-            'val_logprob': log_probs.cpu().numpy(),
-            'val_logprob_len': encoded_len.cpu().numpy(),
-            'val_logits': logits.cpu().numpy(),
         }
+        if outputs_mode is None:
+            outputs_mode = self._cfg.get('val_outputs_mode', 'keep')
+        logs.update(self._frame_outputs(outputs_mode, log_probs, encoded_len, logits,
+                                        stage=stage, dataloader_idx=dataloader_idx))
+        return logs
+
+    def _frame_outputs(self, mode, log_probs, encoded_len, logits, stage, dataloader_idx):
+        """
+        Frame-level outputs of a validation/test batch, depending on `mode`:
+            keep: padded logprobs, logits and lengths as numpy arrays, held until the end of the epoch.
+            drop: nothing.
+            reduce: per-batch sums of frame confidence (max logprob), entropy and blank frames.
+            shard: logprobs and logits are appended to an on-disk store per dataloader (see `LogprobStore`),
+                only the number of written frames is kept.
+        """
+        if mode == 'keep':
+            return {
+                'val_logprob': log_probs.cpu().numpy(),
+                'val_logprob_len': encoded_len.cpu().numpy(),
+                'val_logits': logits.cpu().numpy(),
+            }
+        if mode == 'drop':
+            return {}
+        if mode == 'reduce':
+            with torch.no_grad():
+                frame_mask = torch.arange(log_probs.shape[1], device=log_probs.device)[None, :] < encoded_len[:, None]
+                max_logprob, best = log_probs.max(dim=-1)
+                entropy = -(log_probs.exp() * log_probs).sum(dim=-1)
+                return {
+                    'val_num_frames': frame_mask.sum(),
+                    'val_confidence_sum': max_logprob.masked_fill(~frame_mask, 0.0).sum(),
+                    'val_entropy_sum': entropy.masked_fill(~frame_mask, 0.0).sum(),
+                    'val_blank_frames': ((best == self.decoder.blank_idx) & frame_mask).sum(),
+                }
+        if mode == 'shard':
+            writer = self._get_outputs_writer(stage, dataloader_idx)
+            lengths = encoded_len.cpu().numpy()
+            writer.add(lengths, logprob=log_probs.float().cpu().numpy(), logits=logits.float().cpu().numpy())
+            return {'val_num_frames': encoded_len.sum()}
+        raise ValueError(f'Unknown validation outputs mode: {mode}')
+
+    def _get_outputs_writer(self, stage, dataloader_idx):
+        if not hasattr(self, '_outputs_writers'):
+            self._outputs_writers = {}
+        key = (stage, dataloader_idx)
+        if key not in self._outputs_writers:
+            outputs_dir = self._cfg.get('val_outputs_dir', None)
+            if outputs_dir is None:
+                raise ValueError('`val_outputs_dir` has to be set to shard validation outputs')
+            store_dir = os.path.join(outputs_dir, stage, f'dl{dataloader_idx}', f'rank{self.global_rank}')
+            self._outputs_writers[key] = LogprobStoreWriter(store_dir,
+                                                            dtype=self._cfg.get('val_outputs_dtype', 'float32'))
+        return self._outputs_writers[key]
+
+    def _close_outputs_writer(self, stage, dataloader_idx):
+        writer = getattr(self, '_outputs_writers', {}).pop((stage, dataloader_idx), None)
+        if writer is not None:
+            writer.close()
+            logging.info(f'Wrote {stage} outputs of dataloader {dataloader_idx} to {writer.store_dir}')
+
+    @staticmethod
+    def _reduced_frame_logs(outputs, prefix):
+        if prefix + '_confidence_sum' not in outputs[0]:
+            return {}
+
+        def total(key):
+            return torch.stack([x[prefix + key] for x in outputs]).sum()
+
+        num_frames = total('_num_frames').clamp(min=1)
+        return {
+            prefix + '_frame_confidence': total('_confidence_sum') / num_frames,
+            prefix + '_frame_entropy': total('_entropy_sum') / num_frames,
+            prefix + '_blank_ratio': total('_blank_frames').float() / num_frames,
+        }
+
+    def multi_validation_epoch_end(self, outputs, dataloader_idx: int = 0):
+        self._close_outputs_writer('validation', dataloader_idx)
+        logs = super().multi_validation_epoch_end(outputs, dataloader_idx=dataloader_idx)
+        logs['log'].update(self._reduced_frame_logs(outputs, 'val'))
+        return logs
 
     def test_step(self, batch, batch_idx, dataloader_idx=0):
         decode_results = {}
-        logs = self.validation_step(batch, batch_idx, dataloader_idx=dataloader_idx, decode_results=decode_results)
+        logs = self.validation_step(batch, batch_idx, dataloader_idx=dataloader_idx, decode_results=decode_results,
+                                    outputs_mode=self._cfg.get('test_outputs_mode', 'keep'), stage='test')
         test_logs = {
             'test_loss': logs['val_loss'],
             'test_wer_num': logs['val_wer_num'],
@@ -468,10 +817,10 @@ class CTCFinetuneModel(ASRModel):
             'test_wer': logs['val_wer'],
             'test_references': decode_results['references'],
             'test_hypotheses': decode_results['hypotheses'],
-            'test_logprob': logs['val_logprob'],
-            'test_logprob_len': logs['val_logprob_len'],
-            'test_logits': logs['val_logits'],
         }
+        for k, v in logs.items():
+            if k.startswith('val_') and k not in ('val_loss', 'val_wer_num', 'val_wer_denom', 'val_wer'):
+                test_logs['test_' + k[len('val_'):]] = v
         return test_logs
 
     def test_dataloader(self):
@@ -497,7 +846,7 @@ class CTCFinetuneModel(ASRModel):
         assert not self.use_bpe
         dl_config = {
             'manifest_filepath': os.path.join(config['temp_dir'], 'manifest.json'),
-            'sample_rate': self.preprocessor._sample_rate,
+            'sample_rate': self.encoder.wav2spec._sample_rate,
             'labels': self.decoder.vocabulary,
             'batch_size': min(config['batch_size'], len(config['paths2audio_files'])),
             'trim_silence': True,
@@ -548,8 +897,11 @@ class CTCFinetuneModel(ASRModel):
         tensorboard_logs = {'test_loss': val_loss_mean, 'test_wer': wer_num / wer_denom}
         references = itertools.chain.from_iterable([x['test_references'] for x in outputs])
         hypotheses = itertools.chain.from_iterable([x['test_hypotheses'] for x in outputs])
-        test_logprob = [x['test_logprob'] for x in outputs]
-        test_logprob_len = [x['test_logprob_len'] for x in outputs]
-        test_logits = [x['test_logits'] for x in outputs]
-        return {'test_loss': val_loss_mean, 'log': tensorboard_logs, 'decode_results': (references, hypotheses),
-                'test_logprob': test_logprob, 'test_logprob_len': test_logprob_len, 'test_logits': test_logits}
+        self._close_outputs_writer('test', dataloader_idx)
+        tensorboard_logs.update(self._reduced_frame_logs(outputs, 'test'))
+        results = {'test_loss': val_loss_mean, 'log': tensorboard_logs, 'decode_results': (references, hypotheses)}
+        if 'test_logprob' in outputs[0]:
+            results['test_logprob'] = [x['test_logprob'] for x in outputs]
+            results['test_logprob_len'] = [x['test_logprob_len'] for x in outputs]
+            results['test_logits'] = [x['test_logits'] for x in outputs]
+        return results
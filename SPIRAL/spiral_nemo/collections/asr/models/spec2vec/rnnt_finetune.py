@@ -42,6 +42,7 @@ import tempfile
 from math import ceil
 from typing import Dict, List, Optional, Union
 
+import numpy as np
 import torch
 from omegaconf import DictConfig, OmegaConf, open_dict, ListConfig
 from pytorch_lightning import Trainer
@@ -368,6 +369,53 @@ class RNNTFinetuneModel(CTCFinetuneModel):
                 self.joint.unfreeze()
         return hypotheses, all_hypotheses
 
+    @torch.no_grad()
+    def transcribe_audio(
+        self,
+        audio: List[Union[np.ndarray, torch.Tensor, bytes]],
+        batch_size: int = 4,
+        sample_rate: Optional[int] = None,
+        return_hypotheses: bool = False,
+    ) -> List[str]:
+        """
+        Transcribes audio held in memory, without writing a manifest or building a dataloader.
+        Utterances are sorted by length into batches to minimize padding.
+
+        Args:
+            audio: (a list) of 1-D numpy arrays or torch tensors of samples, or bytes of encoded audio files.
+            batch_size: (int) batch size to use during inference.
+            sample_rate: (int) sample rate of the arrays/tensors, if it differs from the model's sample rate.
+            return_hypotheses: (bool) Either return hypotheses or text
+
+        Returns:
+            A list of best transcriptions in the same order as audio.
+        """
+        return super().transcribe_audio(
+            audio, batch_size=batch_size, sample_rate=sample_rate, return_hypotheses=return_hypotheses
+        )
+
+    def _transcribe_batch(self, signal, signal_len, logprobs=False, return_hypotheses=False, beam_decoder=None):
+        if logprobs or beam_decoder is not None:
+            raise ValueError('RNNT models only return transcriptions or hypotheses of their own decoding.')
+        encoded, encoded_len = self.forward(input_signal=signal, input_signal_length=signal_len)
+        best_hyp, _ = self.decoding.rnnt_decoder_predictions_tensor(
+            encoded, encoded_len, return_hypotheses=return_hypotheses,
+        )
+        return best_hyp
+
+    def transcribe_long(self, *args, **kwargs):
+        raise NotImplementedError('Long audio transcription merges CTC log probabilities, RNNT models do not support it.')
+
+    def streaming_transcriber(self, *args, **kwargs):
+        raise NotImplementedError('Streaming transcription decodes CTC log probabilities, RNNT models do not support it.')
+
+    def _inference_featurizer(self):
+        return self.preprocessor.featurizer
+
+    @property
+    def _inference_sample_rate(self):
+        return self.preprocessor._sample_rate
+
     def change_vocabulary(self, new_vocabulary: List[str], decoding_cfg: Optional[DictConfig] = None):
         """
         Changes vocabulary used during RNNT decoding process. Use this method when fine-tuning a pre-trained model.
@@ -108,6 +108,29 @@ class NoisePerturbConfig:
     cache_noise: bool = False
 
 
+@dataclass
+class BatchPerturbConfig:
+    # batched augmentation of collated training audio on the model device, see parts/batch_perturb.py
+    sample_rate: int = 16000
+    gain_prob: float = 0.0
+    min_gain_db: float = -10.0
+    max_gain_db: float = 10.0
+    speed_prob: float = 0.0
+    min_speed_rate: float = 0.9
+    max_speed_rate: float = 1.1
+    num_speed_rates: int = 5
+    rir_prob: float = 0.0
+    rir_manifest_path: Optional[List[str]] = None
+    max_rir_sec: float = 1.0
+    noise_prob: float = 0.0
+    noise_manifest_path: Optional[List[str]] = None
+    noise_data_dir: str = ''
+    min_snr_db: float = 10.0
+    max_snr_db: float = 50.0
+    max_noise_gain_db: float = 300.0
+    max_noise_bank_sec: Optional[float] = 3600.0
+
+
 @dataclass
 class Spec2VecCTCFinetuneModelConfig(ModelConfig):
     pretrain_chkpt_path: Optional[str] = MISSING
@@ -123,6 +146,14 @@ class Spec2VecCTCFinetuneModelConfig(ModelConfig):
     freeze_finetune_updates: int = 0
 
     noise_perturb: Optional[NoisePerturbConfig] = None
+    batch_perturb: Optional[BatchPerturbConfig] = None
+
+    # Frame-level logprobs/logits of validation and test batches: 'keep' (in RAM until the epoch end), 'drop',
+    # 'reduce' (log frame confidence/entropy/blank ratio only) or 'shard' (write to a store under val_outputs_dir)
+    val_outputs_mode: str = 'keep'
+    test_outputs_mode: str = 'keep'
+    val_outputs_dir: Optional[str] = None
+    val_outputs_dtype: str = 'float32'
 
     # Dataset configs
     train_ds: DatasetConfig = MISSING
@@ -18,7 +18,7 @@ from dataclasses import field, dataclass
 from omegaconf import MISSING
 
 from spiral_nemo.collections.asr.models.spec2vec.spec2vec_config import FeatureEncoderConfig, ProjectorConfig, \
-    NoisePerturbConfig
+    NoisePerturbConfig, BatchPerturbConfig
 from spiral_nemo.collections.asr.models.wav2vec.wav2vec_config import LossConfig, Wav2VecTransformerConfig, \
     Wav2VecMaskingConfig, QuantizerConfig
 from nemo.collections.asr.modules.audio_preprocessing import AudioToMelSpectrogramPreprocessorConfig
@@ -56,6 +56,10 @@ class ST2VecEncoderConfig:
     target_momentum_final: Optional[float] = None
     target_momentum_steps: Optional[int] = None
     target_momentum_type: Optional[str] = None
+    # update the target networks every N steps with the momentum compounded over N steps
+    target_update_every: int = 1
+    # also average floating point buffers of the target networks, e.g. BatchNorm running statistics
+    target_ema_buffers: bool = False
     projector: Optional[ProjectorConfig] = None
     predictor: Optional[ProjectorConfig] = None
 
@@ -105,6 +109,8 @@ class ST2VecPretrainModelConfig(ModelConfig):
     st2vec_encoder: Any = MISSING
 
     noise_perturb: Optional[NoisePerturbConfig] = None
+    # alternative to noise_perturb, the perturbed copy of a batch is made on the device (speed_prob must be 0)
+    batch_perturb: Optional[BatchPerturbConfig] = None
 
     loss_type: str = 'wav2vec'
     logit_temp: float = field(default=0.1, metadata={'help': 'Temperature to divide logits by'})
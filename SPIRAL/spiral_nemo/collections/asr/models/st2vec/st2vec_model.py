@@ -47,21 +47,14 @@ from omegaconf import DictConfig
 from torch import nn
 
 from spiral_nemo.collections.asr.models.st2vec.st2vec_config import ShiftPerturbConfig
-from spiral_nemo.collections.asr.modules.wav2vec_modules import compute_mask_indices, GumbelVectorQuantizer
+from spiral_nemo.collections.asr.models.wav2vec.wav2vec_config import Wav2VecMaskType
+from spiral_nemo.collections.asr.modules.wav2vec_modules import compute_mask_indices, compute_mask_indices_torch, \
+    GumbelVectorQuantizer
 from spiral_nemo.collections.asr.parts.spec2vec import Projector
 from spiral_nemo.collections.asr.parts.spectr_augment import GAUSSIAN_MASK
 from nemo.core.classes.common import Serialization
 
 
-def buffered_arange(max):
-    if not hasattr(buffered_arange, "buf"):
-        buffered_arange.buf = torch.LongTensor()
-    if max > buffered_arange.buf.numel():
-        buffered_arange.buf.resize_(max)
-        torch.arange(max, out=buffered_arange.buf)
-    return buffered_arange.buf[:max]
-
-
 class ST2VecEncoder(nn.Module):
     def __init__(self, cfg: DictConfig):
         super().__init__()
@@ -104,6 +97,8 @@ class ST2VecEncoder(nn.Module):
         self.target_compute_perturb = cfg.target_compute_perturb
 
         self.target_update_step = 0
+        self.target_update_every = cfg.get('target_update_every', 1)
+        self.target_ema_buffers = cfg.get('target_ema_buffers', False)
         if cfg.target_momentum > 0:
             self.target_feature_encoder = Serialization.from_config_dict(cfg.feature_encoder)
             self.target_feature_encoder.load_state_dict(self.feature_encoder.state_dict())
@@ -185,9 +180,13 @@ class ST2VecEncoder(nn.Module):
             if self.momentum_schedule is not None:
                 assert global_step is not None
                 target_momentum = self.momentum_schedule(global_step)
-                if global_step > self.target_update_step:
-                    ema_update(self.target_feature_encoder, self.feature_encoder, target_momentum)
-                    ema_update(self.target_projector, self.projector, target_momentum)
+                if global_step >= self.target_update_step + self.target_update_every:
+                    # the momentum is compounded over the steps since the last update, but not over a gap left by
+                    # resuming training
+                    num_steps = min(global_step - self.target_update_step, self.target_update_every)
+                    ema_update((self.target_feature_encoder, self.target_projector),
+                               (self.feature_encoder, self.projector), target_momentum ** num_steps,
+                               buffers=self.target_ema_buffers)
                     self.target_update_step = global_step
                 target_feature_encoder = self.target_feature_encoder
                 target_projector = self.target_projector
@@ -259,6 +258,8 @@ class ST2VecEncoder(nn.Module):
 
         assert pred_features.shape[1] == unmasked_features.shape[1]
         assert torch.equal(feature_lens, unmasked_feature_lens)
+        # negatives are sampled from the other frames of the same utterance
+        assert (feature_lens > 1).all(), 'every utterance needs more than one feature frame'
 
         padding_mask = create_padding_mask(feature_lens, pred_features.shape[1])
         features_mask = ~padding_mask
@@ -279,7 +280,7 @@ class ST2VecEncoder(nn.Module):
         else:
             prob_ppl_loss, cur_temp, prob_ppl = None, None, None
 
-        sampled_negatives, _ = self.sample_negatives_flat(unmasked_features, feature_lens.tolist())
+        sampled_negatives, _ = self.sample_negatives_flat(unmasked_features, feature_lens)
 
         return pred_features, unmasked_features, sampled_negatives, padding_mask, prob_ppl_loss, cur_temp, prob_ppl
 
@@ -343,22 +344,23 @@ class ST2VecEncoder(nn.Module):
             assert high > 1, f"{bsz, tsz, fsz}"
 
             if self.n_negatives > 0:
-                tszs = buffered_arange(num).unsqueeze(-1).expand(-1, self.n_negatives).flatten()
+                tszs = torch.arange(num, device=y.device).unsqueeze(-1).expand(-1, self.n_negatives).flatten()
 
-                neg_idxs = torch.randint(low=0, high=high - 1, size=(bsz, self.n_negatives * num))
+                neg_idxs = torch.randint(low=0, high=high - 1, size=(bsz, self.n_negatives * num), device=y.device)
                 neg_idxs[neg_idxs >= tszs] += 1
 
             if self.cross_sample_negatives > 0:
-                tszs = buffered_arange(num).unsqueeze(-1).expand(-1, self.cross_sample_negatives).flatten()
+                tszs = torch.arange(num, device=y.device).unsqueeze(-1)
+                tszs = tszs.expand(-1, self.cross_sample_negatives).flatten()
 
                 cross_neg_idxs = torch.randint(
-                    low=0, high=cross_high - 1, size=(bsz, self.cross_sample_negatives * num),
+                    low=0, high=cross_high - 1, size=(bsz, self.cross_sample_negatives * num), device=y.device
                 )
                 cross_neg_idxs[cross_neg_idxs >= tszs] += 1
 
         if self.n_negatives > 0:
-            for i in range(1, bsz):
-                neg_idxs[i] += i * high
+            # offset of each utterance in the flattened batch
+            neg_idxs = neg_idxs + torch.arange(bsz, device=y.device).unsqueeze(-1) * high
         else:
             neg_idxs = cross_neg_idxs
 
@@ -377,39 +379,51 @@ class ST2VecEncoder(nn.Module):
             return y.new(0)
 
         bsz, tsz, fsz = y.shape
-        assert bsz == 1 and tsz == sum(nums)  # fake batch dim
+        assert bsz == 1  # fake batch dim
         y = y.view(-1, fsz)  # BTC => (BxT)C
 
-        # cross_high = tsz * bsz
-
-        neg_idxs_l = []
-        idx_start = 0
+        assert self.n_negatives > 0
+        assert self.cross_sample_negatives == 0
         with torch.no_grad():
-            for i, num_i in enumerate(nums):
-                assert num_i > 1, f"{bsz, tsz, fsz}"
+            lens = torch.as_tensor(nums, dtype=torch.long, device=y.device)
+            neg_idxs = sample_flat_negative_idxs(lens, tsz, self.n_negatives)
 
-                assert self.n_negatives > 0
-                tszs_i = buffered_arange(num_i).unsqueeze(-1).expand(-1, self.n_negatives).flatten()
+        negs = y[neg_idxs]
+        negs = negs.view(bsz, tsz, self.n_negatives + self.cross_sample_negatives, fsz).permute(
+            2, 0, 1, 3
+        )  # to NxBxTxC
+        return negs, neg_idxs
 
-                high_i = num_i
-                neg_idxs_i = torch.randint(low=0, high=high_i - 1, size=(self.n_negatives * num_i,))
-                neg_idxs_i[neg_idxs_i >= tszs_i] += 1
 
-                neg_idxs_i += idx_start
-                idx_start += num_i
+def sample_flat_negative_idxs(lens, num_frames, n_negatives):
+    """
+    Draws `n_negatives` indices for every frame of utterances concatenated along time, uniformly from the other
+    frames of the same utterance, in one shot on the device of `lens` and without synchronizing with it.
 
-                neg_idxs_l.append(neg_idxs_i)
+    Args:
+        lens: lengths of the utterances, summing up to `num_frames`.
+        num_frames: total number of frames.
+        n_negatives: number of negatives per frame.
 
-                assert self.cross_sample_negatives == 0
+    Returns:
+        indices of shape [num_frames * n_negatives], negatives of each frame are contiguous.
+    """
+    starts = torch.cumsum(lens, dim=0) - lens
+    # utterance index of every frame
+    boundaries = torch.zeros(num_frames, dtype=torch.long, device=lens.device)
+    boundaries.index_add_(0, starts[1:], torch.ones_like(starts[1:]))
+    utt_idxs = torch.cumsum(boundaries, dim=0)
 
-        neg_idxs = torch.cat(neg_idxs_l)
-        assert neg_idxs.ndim == 1
+    frame_starts = starts[utt_idxs].unsqueeze(-1)
+    positions = torch.arange(num_frames, device=lens.device).unsqueeze(-1) - frame_starts
+    # one frame less to choose from, the positive is skipped below; utterances must have more than one frame
+    high = (lens[utt_idxs] - 1).clamp(min=1).unsqueeze(-1)
 
-        negs = y[neg_idxs]
-        negs = negs.view(bsz, sum(nums), self.n_negatives + self.cross_sample_negatives, fsz).permute(
-            2, 0, 1, 3
-        )  # to NxBxTxC
-        return negs, neg_idxs
+    neg_idxs = (torch.rand(num_frames, n_negatives, device=lens.device) * high).long()
+    neg_idxs = torch.min(neg_idxs, high - 1)
+    neg_idxs += (neg_idxs >= positions).long()
+    neg_idxs += frame_starts
+    return neg_idxs.flatten()
 
 
 def create_padding_mask(audio_lengths, max_len):
@@ -520,26 +534,44 @@ def create_shift_padding_mask(lengths, max_len, shift_num_units):
     return padding_mask
 
 
+def _torch_maskable(mask_type, no_overlap):
+    # compute_mask_indices_torch only samples static, possibly overlapping spans
+    return mask_type.value == Wav2VecMaskType.static.value and not no_overlap
+
+
 def apply_mask(mask_cfg, x, padding_mask, mask_emb, mask_positions=None):
     B, T, C = x.shape
     if mask_cfg.mask_prob > 0:
-        mask_indices, mask_num = compute_mask_indices(
-            (B, T),
-            padding_mask,
-            mask_cfg.mask_prob,
-            mask_cfg.mask_length,
-            mask_cfg.mask_type,
-            mask_cfg.mask_other,
-            min_masks=2,
-            no_overlap=mask_cfg.no_mask_overlap,
-            min_space=mask_cfg.mask_min_space,
-            shrink_to_batch_min=mask_cfg.mask_shrink_to_batch_min,
-            mask_positions=mask_positions
-        )
-        mask_indices = torch.from_numpy(mask_indices).to(x.device)
+        if mask_positions is None and _torch_maskable(mask_cfg.mask_type, mask_cfg.no_mask_overlap):
+            mask_indices, mask_num = compute_mask_indices_torch(
+                (B, T),
+                padding_mask,
+                mask_cfg.mask_prob,
+                mask_cfg.mask_length,
+                min_masks=2,
+                shrink_to_batch_min=mask_cfg.mask_shrink_to_batch_min,
+                device=x.device,
+            )
+        else:
+            mask_indices, mask_num = compute_mask_indices(
+                (B, T),
+                padding_mask,
+                mask_cfg.mask_prob,
+                mask_cfg.mask_length,
+                mask_cfg.mask_type,
+                mask_cfg.mask_other,
+                min_masks=2,
+                no_overlap=mask_cfg.no_mask_overlap,
+                min_space=mask_cfg.mask_min_space,
+                shrink_to_batch_min=mask_cfg.mask_shrink_to_batch_min,
+                mask_positions=mask_positions
+            )
+            mask_indices = torch.from_numpy(mask_indices).to(x.device)
+        # masked_fill_/where instead of boolean indexing, which synchronizes with the host
         if isinstance(mask_emb, torch.Tensor):
-            mask_emb = mask_emb.type_as(x)
-        x[mask_indices] = mask_emb
+            x.copy_(torch.where(mask_indices.unsqueeze(-1), mask_emb.type_as(x), x))
+        else:
+            x.masked_fill_(mask_indices.unsqueeze(-1), mask_emb)
         assert len(mask_num) == B
     else:
         mask_indices = None
@@ -547,27 +579,54 @@ def apply_mask(mask_cfg, x, padding_mask, mask_emb, mask_positions=None):
 
     if mask_cfg.mask_channel_prob > 0:
         # assert mask_cfg.mask_shrink_to_batch_min
-        mask_channel_indices, _ = compute_mask_indices(
-            (B, C),
-            None,
-            mask_cfg.mask_channel_prob,
-            mask_cfg.mask_channel_length,
-            mask_cfg.mask_channel_type,
-            mask_cfg.mask_channel_other,
-            no_overlap=mask_cfg.no_mask_channel_overlap,
-            min_space=mask_cfg.mask_channel_min_space,
-            shrink_to_batch_min=mask_cfg.mask_channel_shrink_to_batch_min,
-        )
-        mask_channel_indices = torch.from_numpy(mask_channel_indices).to(x.device).unsqueeze(1).expand(-1, T, -1)
-        x[mask_channel_indices] = 0
+        if _torch_maskable(mask_cfg.mask_channel_type, mask_cfg.no_mask_channel_overlap):
+            mask_channel_indices, _ = compute_mask_indices_torch(
+                (B, C),
+                None,
+                mask_cfg.mask_channel_prob,
+                mask_cfg.mask_channel_length,
+                shrink_to_batch_min=mask_cfg.mask_channel_shrink_to_batch_min,
+                device=x.device,
+            )
+        else:
+            mask_channel_indices, _ = compute_mask_indices(
+                (B, C),
+                None,
+                mask_cfg.mask_channel_prob,
+                mask_cfg.mask_channel_length,
+                mask_cfg.mask_channel_type,
+                mask_cfg.mask_channel_other,
+                no_overlap=mask_cfg.no_mask_channel_overlap,
+                min_space=mask_cfg.mask_channel_min_space,
+                shrink_to_batch_min=mask_cfg.mask_channel_shrink_to_batch_min,
+            )
+            mask_channel_indices = torch.from_numpy(mask_channel_indices).to(x.device)
+        x.masked_fill_(mask_channel_indices.unsqueeze(1), 0)
 
     return x, mask_indices, mask_num
 
 
-def ema_update(ema_module, new_module, m):
+def ema_update(ema_module, new_module, m, buffers=False):
+    """
+    Updates `ema_module` (a module or a sequence of modules) to the exponential moving average with momentum `m` of
+    `new_module`, with one fused multi-tensor mul_ and add_ for all parameters. If `buffers` is True, floating point
+    buffers, e.g. BatchNorm running statistics, are averaged the same way.
+    """
+    if isinstance(ema_module, nn.Module):
+        ema_module, new_module = [ema_module], [new_module]
+    ema_tensors, new_tensors = [], []
+    for ema_module_i, new_module_i in zip(ema_module, new_module):
+        ema_tensors.extend(ema_module_i.parameters())
+        new_tensors.extend(new_module_i.parameters())
+        if buffers:
+            for ema_buf, new_buf in zip(ema_module_i.buffers(), new_module_i.buffers()):
+                # integer buffers such as num_batches_tracked are left as they are
+                if ema_buf.is_floating_point():
+                    ema_tensors.append(ema_buf)
+                    new_tensors.append(new_buf)
     with torch.no_grad():
-        for param_q, param_k in zip(new_module.parameters(), ema_module.parameters()):
-            param_k.data.mul_(m).add_((1 - m) * param_q.detach().data)
+        torch._foreach_mul_(ema_tensors, m)
+        torch._foreach_add_(ema_tensors, [t.detach() for t in new_tensors], alpha=1 - m)
 
 
 @contextlib.contextmanager
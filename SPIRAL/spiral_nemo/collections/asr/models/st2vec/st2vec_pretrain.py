@@ -51,6 +51,7 @@ from spiral_nemo.collections.asr.data import audio_to_text_dataset
 from spiral_nemo.collections.asr.losses.similarityloss import NegativeCosineSimilarityLoss
 from spiral_nemo.collections.asr.losses.wav2vecloss import Wav2VecLoss
 from spiral_nemo.collections.asr.models.st2vec.st2vec_model import ST2VecEncoder
+from spiral_nemo.collections.asr.parts.batch_perturb import BatchAudioAugmentor
 from spiral_nemo.collections.asr.parts.perturb import RandomNoisePerturbation#, AudioAugmentor
 from nemo.collections.asr.parts.preprocessing.perturb import AudioAugmentor
 
@@ -78,6 +79,8 @@ class ST2VecPretrainModel(ModelPT):
         #     self.hparams['global_rank'] = (trainer.node_rank * trainer.num_gpus) + trainer.local_rank
         #     self.hparams['world_size'] = trainer.num_nodes * trainer.num_gpus
         #     self.hparams['local_rank'] = trainer.local_rank
+        # set up with the training data
+        self.batch_augmentor = None
 
         super().__init__(cfg=cfg, trainer=trainer)
 
@@ -105,6 +108,9 @@ class ST2VecPretrainModel(ModelPT):
         self._prev_log_step = -1
 
     def training_step(self, batch, batch_idx):
+        if self.batch_augmentor is not None and len(batch) == 2:
+            # perturbed copy of the clean batch
+            batch = (*batch, *self.batch_augmentor(*batch))
         loss, contrastive_loss, prob_ppl_loss, cur_temp, prob_ppl, _ = self._step(batch)
 
         if self.global_step > self._prev_log_step:
@@ -175,6 +181,13 @@ class ST2VecPretrainModel(ModelPT):
         self._update_dataset_config(dataset_name='train', config=train_data_config)
 
         self._train_dl = self._setup_dataloader_from_config(config=train_data_config, noise_perturb_config=self._cfg['noise_perturb'])
+        batch_perturb_config = self._cfg.get('batch_perturb')
+        if batch_perturb_config is not None:
+            if self._cfg['noise_perturb'] is not None:
+                raise ValueError('noise_perturb and batch_perturb both produce the perturbed audio, set only one')
+            if batch_perturb_config.get('speed_prob', 0.0) > 0:
+                raise ValueError('clean and perturbed audio must have the same lengths, set batch_perturb.speed_prob=0')
+            self.batch_augmentor = BatchAudioAugmentor(**batch_perturb_config)
 
         # Need to set this because if using an IterableDataset, the length of the dataloader is the total number
         # of samples rather than the number of batches, and this messes up the tqdm progress bar.
@@ -224,6 +237,27 @@ class ST2VecPretrainModel(ModelPT):
             return None
 
         dataset = audio_to_text_dataset.get_audio_dataset(config=config, augmentor=augmentor, return_both=return_both)
+
+        global_rank, world_size = 0, 1
+        if self._trainer is not None:
+            global_rank = (self._trainer.node_rank * self._trainer.num_gpus) + self._trainer.local_rank
+            world_size = self._trainer.num_nodes * self._trainer.num_gpus
+        batch_sampler = audio_to_text_dataset.get_duration_batch_sampler(
+            config=config, dataset=dataset, global_rank=global_rank, world_size=world_size
+        )
+        if batch_sampler is not None:
+            if world_size > 1 and getattr(self._trainer, 'replace_sampler_ddp', False):
+                raise ValueError('batches by duration are split between ranks by their sampler, '
+                                 'set trainer.replace_sampler_ddp=false')
+            return torch.utils.data.DataLoader(
+                dataset=dataset,
+                batch_sampler=batch_sampler,
+                collate_fn=dataset.collate_fn,
+                num_workers=config.get('num_workers', 0),
+                pin_memory=False,
+                prefetch_factor=config.get('prefetch_factor', 2),
+            )
+
         return torch.utils.data.DataLoader(
             dataset=dataset,
             batch_size=config['batch_size'],
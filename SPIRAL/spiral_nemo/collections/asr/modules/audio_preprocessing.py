@@ -30,8 +30,7 @@ import torch
 from packaging import version
 
 from nemo.collections.asr.parts.features import FilterbankFeatures
-# from spiral_nemo.collections.asr.parts.spectr_augment import SpecAugment, SpecCutout
-from nemo.collections.asr.parts.submodules.spectr_augment import SpecAugment, SpecCutout
+from spiral_nemo.collections.asr.parts.spectr_augment import SpecAugment, SpecCutout
 from nemo.core.classes import NeuralModule, typecheck
 from spiral_nemo.core.neural_types import (
     AudioSignal,
@@ -324,3 +324,64 @@ def compute_mask_indices(
             mask_positions.append(mask_idc)
 
     return mask, mask_num
+
+
+def compute_mask_indices_torch(
+    shape: Tuple[int, int],
+    padding_mask: Optional[torch.Tensor],
+    mask_prob: float,
+    mask_length: int,
+    min_masks: int = 0,
+    shrink_to_batch_min: bool = True,
+    device: Optional[torch.device] = None,
+):
+    """
+    Torch version of compute_mask_indices for static, possibly overlapping spans, which samples the spans of all
+    utterances at once on `device` without synchronizing with the host.
+    Span starts of an utterance are drawn without replacement as in the numpy version, so masks of both versions
+    follow the same distribution.
+    Args:
+        shape: the the shape for which to compute masks, (batch size, timesteps)
+        padding_mask: optional padding mask of the same size as shape, which will prevent masking padded elements
+        mask_prob: see compute_mask_indices
+        mask_length: length of each masked span
+        min_masks: minimum number of masked spans
+        shrink_to_batch_min: randomly unmask elements so that every utterance has as many masked elements as the
+            utterance with the fewest
+    Returns:
+        boolean mask of the given shape on `device`, and the number of masked elements of each utterance before
+        shrinking to the batch minimum.
+    """
+    bsz, all_sz = shape
+    if padding_mask is not None:
+        device = padding_mask.device
+        sz = all_sz - padding_mask.long().sum(dim=1)
+    else:
+        sz = torch.full((bsz,), all_sz, dtype=torch.long, device=device)
+    positions = torch.arange(all_sz, device=device)
+
+    # add a random number for probabilistic rounding, without padding the numpy version draws one for the batch
+    rounding = torch.rand(bsz if padding_mask is not None else 1, device=device).expand(bsz)
+    num_mask = (mask_prob * sz.float() / float(mask_length) + rounding).long()
+    num_mask = num_mask.clamp(min=min_masks)
+    # starts are drawn from [0, high), shrunk for short utterances as in the numpy version
+    high = torch.where(sz - mask_length <= num_mask, num_mask + 1, sz - mask_length)
+
+    # the num_mask positions with the smallest random keys are a uniform sample without replacement
+    keys = torch.rand(bsz, all_sz, device=device).masked_fill_(positions >= high.unsqueeze(1), 2.0)
+    kth_key = keys.sort(dim=1)[0].gather(1, (num_mask - 1).clamp(min=0, max=all_sz - 1).unsqueeze(1))
+    starts = (keys <= kth_key) & (num_mask > 0).unsqueeze(1)
+
+    # an element is masked if a span starts at most mask_length - 1 elements before it
+    num_starts = starts.long().cumsum(dim=1)
+    mask = (num_starts - F.pad(num_starts, (mask_length, 0))[:, :all_sz]) > 0
+    mask &= positions < sz.unsqueeze(1)
+    mask_num = mask.long().sum(dim=1)
+
+    if shrink_to_batch_min:
+        min_num = mask_num.min()
+        keys = torch.rand(bsz, all_sz, device=device).masked_fill_(~mask, 2.0)
+        kth_key = keys.sort(dim=1)[0].gather(1, (min_num - 1).clamp(min=0).expand(bsz, 1))
+        mask &= (keys <= kth_key) & (min_num > 0)
+
+    return mask, mask_num
@@ -0,0 +1,227 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import math
+import os
+import random
+from typing import List, Optional
+
+import numpy as np
+import pandas
+import torch
+import torch.fft
+
+from spiral_nemo.collections.asr.parts.segment import AudioSegment
+from spiral_nemo.utils import logging
+
+__all__ = ['BatchAudioAugmentor']
+
+
+def _load_noise_bank(manifest_path: List[str], data_dir: str, sample_rate: int, max_bank_sec: Optional[float]):
+    # same csv manifests as RandomNoisePerturbation, noise shorter than 1 second is skipped
+    manifest = pandas.concat([pandas.read_csv(fp, encoding='utf-8') for fp in manifest_path])
+    wav_header_size = 44
+    manifest = manifest[manifest['wav_filesize'] > (1 * sample_rate * 2 + wav_header_size)]
+    files = manifest['wav_filename'].tolist()
+    random.shuffle(files)
+
+    max_samples = None if max_bank_sec is None else int(max_bank_sec * sample_rate)
+    noises = []
+    num_samples = 0
+    for fp in files:
+        samples = AudioSegment.from_file(os.path.join(data_dir, fp), target_sr=sample_rate).samples
+        noises.append(samples)
+        num_samples += len(samples)
+        if max_samples is not None and num_samples >= max_samples:
+            break
+    bank = torch.from_numpy(np.concatenate(noises)[:max_samples].astype(np.float32))
+    logging.info(f'Loaded noise bank of {len(noises)} files, {bank.numel() / sample_rate / 3600:.2f}h')
+    return bank
+
+
+def _load_rirs(manifest_path: List[str], sample_rate: int, max_rir_sec: float):
+    # same json manifests and normalization as ImpulsePerturbation with shift_impulse=True
+    max_len = int(max_rir_sec * sample_rate)
+    rirs = []
+    for fp in manifest_path:
+        with open(fp, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                samples = AudioSegment.from_file(entry['audio_filepath'], target_sr=sample_rate).samples
+                impulse = (samples - samples.min()) / (samples.max() - samples.min())
+                impulse = impulse[np.argmax(np.abs(impulse)):][:max_len]
+                rirs.append(torch.from_numpy(impulse.astype(np.float32)))
+    rir_len = max(len(rir) for rir in rirs)
+    bank = torch.zeros(len(rirs), rir_len)
+    for i, rir in enumerate(rirs):
+        bank[i, :len(rir)] = rir
+    logging.info(f'Loaded {len(rirs)} room impulse responses')
+    return bank
+
+
+def _fft_resample(x, num):
+    # resamples the last dimension to `num` samples, like scipy.signal.resample
+    spec = torch.fft.rfft(x, dim=-1)
+    num_bins = min(spec.size(-1), num // 2 + 1)
+    out = spec.new_zeros(x.size(0), num // 2 + 1)
+    out[:, :num_bins] = spec[:, :num_bins]
+    return torch.fft.irfft(out, n=num, dim=-1) * (num / x.size(-1))
+
+
+def _rms_db(x, mask, lengths):
+    power = (x.pow(2) * mask).sum(dim=1) / lengths.clamp(min=1)
+    return 10 * torch.log10(power.clamp(min=1e-10))
+
+
+class BatchAudioAugmentor:
+    """Augments a padded batch of waveforms on its device, after collation.
+
+    A batched alternative to the per-sample perturbations of `perturb.py` run in dataloader workers: speed
+    perturbation by FFT resampling, random gain, FFT convolution with a room impulse response, and additive noise
+    at a random SNR cropped from a preloaded noise bank, in this order. Each is applied to a sample with its own
+    probability and random parameters. Only speed perturbation changes lengths, the returned lengths account for it.
+
+    Args:
+        sample_rate: sample rate of the audio and of the loaded noise and RIRs.
+        gain_prob: probability of a random gain in [min_gain_db, max_gain_db].
+        speed_prob: probability of a speed rate from `num_speed_rates` values in [min_speed_rate, max_speed_rate].
+        rir_prob: probability of reverberation with a RIR of `rir_manifest_path` json manifests,
+            truncated to `max_rir_sec`.
+        noise_prob: probability of adding noise of `noise_manifest_path` csv manifests (as in `NoisePerturbConfig`)
+            at a SNR in [min_snr_db, max_snr_db]. At most `max_noise_bank_sec` of noise is
+            kept on the device, None loads the whole noise set.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        gain_prob: float = 0.0,
+        min_gain_db: float = -10.0,
+        max_gain_db: float = 10.0,
+        speed_prob: float = 0.0,
+        min_speed_rate: float = 0.9,
+        max_speed_rate: float = 1.1,
+        num_speed_rates: int = 5,
+        rir_prob: float = 0.0,
+        rir_manifest_path: Optional[List[str]] = None,
+        max_rir_sec: float = 1.0,
+        noise_prob: float = 0.0,
+        noise_manifest_path: Optional[List[str]] = None,
+        noise_data_dir: str = '',
+        min_snr_db: float = 10.0,
+        max_snr_db: float = 50.0,
+        max_noise_gain_db: float = 300.0,
+        max_noise_bank_sec: Optional[float] = 3600.0,
+    ):
+        if speed_prob > 0 and num_speed_rates <= 0:
+            raise ValueError('batched speed perturbation needs a positive number of discrete rates')
+        self.gain_prob = gain_prob
+        self.min_gain_db = min_gain_db
+        self.max_gain_db = max_gain_db
+        self.speed_prob = speed_prob
+        self.speed_rates = np.linspace(min_speed_rate, max_speed_rate, num_speed_rates, endpoint=True).tolist()
+        self.rir_prob = rir_prob
+        self.noise_prob = noise_prob
+        self.min_snr_db = min_snr_db
+        self.max_snr_db = max_snr_db
+        self.max_noise_gain_db = max_noise_gain_db
+
+        self.rirs = _load_rirs(rir_manifest_path, sample_rate, max_rir_sec) if rir_prob > 0 else None
+        if noise_prob > 0:
+            self.noise_bank = _load_noise_bank(noise_manifest_path, noise_data_dir, sample_rate, max_noise_bank_sec)
+        else:
+            self.noise_bank = None
+
+    @torch.no_grad()
+    def __call__(self, signal: torch.Tensor, lengths: torch.Tensor):
+        """
+        Args:
+            signal: padded audio [B, T].
+            lengths: number of valid samples of each utterance [B].
+
+        Returns:
+            augmented audio [B, T'] and its lengths.
+        """
+        if self.speed_prob > 0:
+            signal, lengths = self._speed(signal, lengths)
+        mask = (torch.arange(signal.size(1), device=signal.device) < lengths.unsqueeze(1)).to(signal.dtype)
+        if self.gain_prob > 0:
+            signal = self._gain(signal)
+        if self.rir_prob > 0:
+            signal = self._reverb(signal, mask)
+        if self.noise_prob > 0:
+            signal = self._add_noise(signal, mask, lengths)
+        return signal, lengths
+
+    def _apply(self, prob, batch_size, device):
+        return torch.rand(batch_size, device=device) < prob
+
+    def _speed(self, signal, lengths):
+        batch_size, num_samples = signal.shape
+        # rates are drawn on the host, utterances with the same rate are resampled together
+        rate_idxs = torch.randint(len(self.speed_rates), size=(batch_size,))
+        rate_idxs[torch.rand(batch_size) >= self.speed_prob] = -1
+        rates = [1.0 if i < 0 else self.speed_rates[i] for i in rate_idxs.tolist()]
+
+        out_len = max(int(math.ceil(num_samples * rate)) for rate in set(rates))
+        out = signal.new_zeros(batch_size, out_len)
+        for rate in set(rates):
+            idxs = torch.tensor([i for i, r in enumerate(rates) if r == rate], device=signal.device)
+            if rate == 1.0:
+                out[idxs, :num_samples] = signal[idxs]
+            else:
+                new_len = int(math.ceil(num_samples * rate))
+                out[idxs, :new_len] = _fft_resample(signal[idxs].float(), new_len).to(signal.dtype)
+
+        rates = torch.tensor(rates, device=lengths.device)
+        lengths = torch.ceil(lengths.float() * rates).long()
+        mask = torch.arange(out_len, device=signal.device) < lengths.unsqueeze(1)
+        return out * mask.to(out.dtype), lengths
+
+    def _gain(self, signal):
+        batch_size = signal.size(0)
+        gain_range = self.max_gain_db - self.min_gain_db
+        gain_db = self.min_gain_db + torch.rand(batch_size, device=signal.device) * gain_range
+        gain_db = gain_db * self._apply(self.gain_prob, batch_size, signal.device)
+        return signal * (10.0 ** (gain_db / 20.0)).unsqueeze(1).to(signal.dtype)
+
+    def _reverb(self, signal, mask):
+        batch_size, num_samples = signal.shape
+        self.rirs = self.rirs.to(signal.device)
+        rirs = self.rirs[torch.randint(self.rirs.size(0), size=(batch_size,), device=signal.device)]
+        n_fft = 2 ** int(math.ceil(math.log2(num_samples + rirs.size(1) - 1)))
+        spec = torch.fft.rfft(signal.float(), n=n_fft, dim=-1) * torch.fft.rfft(rirs, n=n_fft, dim=-1)
+        # full convolution truncated to the input length, the impulse peak is at its start
+        reverbed = torch.fft.irfft(spec, n=n_fft, dim=-1)[:, :num_samples].to(signal.dtype) * mask
+        apply = self._apply(self.rir_prob, batch_size, signal.device).unsqueeze(1)
+        return torch.where(apply, reverbed, signal)
+
+    def _add_noise(self, signal, mask, lengths):
+        batch_size, num_samples = signal.shape
+        device = signal.device
+        self.noise_bank = self.noise_bank.to(device)
+        bank_len = self.noise_bank.numel()
+
+        # random crops of the bank, wrapping around if it is shorter than the batch
+        starts = (torch.rand(batch_size, device=device) * max(bank_len - num_samples, 1)).long()
+        idxs = (starts.unsqueeze(1) + torch.arange(num_samples, device=device)) % bank_len
+        noise = self.noise_bank[idxs].to(signal.dtype) * mask
+
+        snr_db = self.min_snr_db + torch.rand(batch_size, device=device) * (self.max_snr_db - self.min_snr_db)
+        noise_gain_db = (_rms_db(signal, mask, lengths) - _rms_db(noise, mask, lengths) - snr_db)
+        noise_gain_db = noise_gain_db.clamp(max=self.max_noise_gain_db)
+        noise_gain = 10.0 ** (noise_gain_db / 20.0) * self._apply(self.noise_prob, batch_size, device)
+        return signal + noise * noise_gain.unsqueeze(1).to(signal.dtype)
@@ -0,0 +1,36 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from typing import List
+
+import torch
+
+__all__ = ['length_sorted_batches', 'pad_signals']
+
+
+def length_sorted_batches(lengths: List[int], batch_size: int) -> List[List[int]]:
+    """Groups indices of utterances into batches of similar length, longest first."""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    return [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+
+
+def pad_signals(signals: List[torch.Tensor]):
+    """Zero-pads 1-D signals into a [B, T] batch, returns the batch and the lengths."""
+    signal_len = torch.tensor([len(signal) for signal in signals], dtype=torch.long)
+    signal = torch.zeros(len(signals), int(signal_len.max()) if len(signals) > 0 else 0,
+                         dtype=signals[0].dtype if len(signals) > 0 else torch.float)
+    for i, s in enumerate(signals):
+        signal[i, :len(s)] = s
+    return signal, signal_len
@@ -20,11 +20,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import array
 import collections
+import hashlib
 import json
 import os
+import pickle
+import shutil
+import tempfile
 from typing import Any, Dict, List, Optional, Union
 
+import numpy as np
 import pandas as pd
 
 from spiral_nemo.collections.asr.parts import manifest, parsers
@@ -237,6 +243,260 @@ class ASRAudioText(AudioText):
         super().__init__(ids, audio_files, durations, texts, offsets, speakers, orig_srs, *args, **kwargs)
 
 
+def _parser_fingerprint(parser) -> Optional[str]:
+    """Fingerprint of a parser to key compiled token ids, or None if the parser cannot be pickled."""
+    if parser is None:
+        return 'none'
+    try:
+        return hashlib.sha1(pickle.dumps(parser)).hexdigest()
+    except Exception:
+        return None
+
+
+class _StringColumn:
+    """Strings stored as one utf-8 blob and offsets into it, optional strings have an extra null mask."""
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray, nulls: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __getitem__(self, i: int) -> Optional[str]:
+        if self.nulls[i]:
+            return None
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+
+class CompiledASRAudioText:
+    """Columnar, memory-mapped counterpart of `ASRAudioText`.
+
+    Manifests are compiled once into numpy arrays in `cache_dir`, in a directory named by a hash of the manifest
+    files (path, size and modification time) and of the parser: durations, offsets, speakers and original
+    sample rates as fixed size columns, audio paths and texts as utf-8 blobs with offsets, and token ids as a flat
+    int32 buffer with offsets. Later loads memory-map the arrays, so dataloader workers share their pages instead
+    of each holding a copy of millions of Python objects. Entries are built on access and have the same fields as
+    those of `ASRAudioText`.
+
+    Token ids are compiled only if the parser can be pickled to fingerprint it, otherwise (e.g. with subword
+    sampling tokenizers) texts are parsed on access.
+
+    Args:
+        manifests_files: Either single string file or list of such - manifests to yield items from.
+        parser: Instance of `CharParser` to convert string to tokens, or None to skip texts.
+        cache_dir: Directory for compiled manifests, defaults to `.manifest_cache` next to the first manifest.
+        min_duration: Minimum duration to keep entry with (default: None).
+        max_duration: Maximum duration to keep entry with (default: None).
+        max_number: Maximum number of samples to collect.
+        do_sort_by_duration: True if sort samples list by duration. Not compatible with index_by_file_id.
+        index_by_file_id: If True, provides a mapping from filename base (ID) to index in data.
+        dup_factor: Number of times each entry is repeated.
+        parse_online: Parse texts on access even if token ids could be compiled.
+    """
+
+    OUTPUT_TYPE = AudioText.OUTPUT_TYPE
+    _VERSION = 1
+
+    def __init__(
+        self,
+        manifests_files: Union[str, List[str]],
+        parser: Optional[parsers.CharParser],
+        cache_dir: Optional[str] = None,
+        min_duration: Optional[float] = None,
+        max_duration: Optional[float] = None,
+        max_number: Optional[int] = None,
+        do_sort_by_duration: bool = False,
+        index_by_file_id: bool = False,
+        dup_factor: int = 1,
+        parse_online: bool = False,
+    ):
+        if isinstance(manifests_files, str):
+            manifests_files = [manifests_files]
+        manifests_files = [os.path.abspath(os.path.expanduser(fp)) for fp in manifests_files]
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(manifests_files[0]), '.manifest_cache')
+
+        self.parser = parser
+        parser_key = None if parse_online else _parser_fingerprint(parser)
+        self.parse_online = parser is not None and parser_key is None
+
+        compiled_dir = os.path.join(cache_dir, self._cache_key(manifests_files, parser_key))
+        if not os.path.exists(os.path.join(compiled_dir, 'durations.npy')):
+            self._compile(manifests_files, parser if parser_key is not None else None, compiled_dir)
+        self._load(compiled_dir)
+
+        # filters are applied to the columns, the entries are selected by an index into them
+        keep = np.ones(len(self._durations), dtype=bool)
+        if min_duration is not None:
+            keep &= self._durations >= min_duration
+        if max_duration is not None:
+            keep &= self._durations <= max_duration
+        if self._token_offsets is not None:
+            # texts which failed to parse
+            keep &= self._token_lens >= 0
+        index = np.nonzero(keep)[0]
+        if max_number:
+            index = index[:max_number]
+
+        total_duration = float(self._durations[index].sum(dtype=np.float64))
+        filtered_duration = float(self._durations.sum(dtype=np.float64)) - total_duration
+        logging.info("Dataset loaded with %d files totalling %.2f hours", len(index), total_duration / 3600)
+        logging.info(
+            "%d files were filtered totalling %.2f hours", len(self._durations) - len(index), filtered_duration / 3600
+        )
+
+        if do_sort_by_duration:
+            if index_by_file_id:
+                logging.warning("Tried to sort dataset by duration, but cannot since index_by_file_id is set.")
+            else:
+                index = index[np.argsort(self._durations[index], kind='stable')]
+        if dup_factor > 1:
+            assert not index_by_file_id
+            index = np.repeat(index, dup_factor)
+            logging.info("Dataset duplicated %d times", dup_factor)
+        self._index = index
+        self._mapping = None
+
+    @classmethod
+    def _cache_key(cls, manifests_files: List[str], parser_key: Optional[str]) -> str:
+        key = hashlib.sha1()
+        key.update(f'v{cls._VERSION} parser={parser_key}'.encode('utf-8'))
+        for fp in manifests_files:
+            stat = os.stat(fp)
+            key.update(f'|{fp}|{stat.st_size}|{stat.st_mtime_ns}'.encode('utf-8'))
+        return key.hexdigest()
+
+    @staticmethod
+    def _compile(manifests_files: List[str], parser, compiled_dir: str):
+        logging.info("Compiling manifests %s to %s", manifests_files, compiled_dir)
+        ids, durations, offsets, speakers, orig_srs = (
+            array.array('q'), array.array('f'), array.array('d'), array.array('q'), array.array('q')
+        )
+        strings = {name: (bytearray(), array.array('q', [0]), array.array('b')) for name in ['audio_files', 'texts']}
+        tokens, token_offsets, token_lens = array.array('i'), array.array('q', [0]), array.array('q')
+
+        def add_string(name, value):
+            blob, string_offsets, nulls = strings[name]
+            if value is not None:
+                blob.extend(value.encode('utf-8'))
+            string_offsets.append(len(blob))
+            nulls.append(value is None)
+
+        for item in manifest.item_iter(manifests_files):
+            ids.append(item['id'])
+            durations.append(item['duration'])
+            offsets.append(np.nan if item['offset'] is None else item['offset'])
+            if item['speaker'] is not None and not isinstance(item['speaker'], int):
+                raise ValueError(f"Compiled manifests support integer speaker ids only, got {item['speaker']}")
+            speakers.append(-1 if item['speaker'] is None else item['speaker'])
+            orig_srs.append(-1 if item['orig_sr'] is None else item['orig_sr'])
+            add_string('audio_files', item['audio_file'])
+            add_string('texts', item['text'])
+            if parser is not None:
+                text_tokens = parser(item['text'])
+                if text_tokens is not None:
+                    tokens.extend(text_tokens)
+                token_lens.append(-1 if text_tokens is None else len(text_tokens))
+                token_offsets.append(len(tokens))
+
+        columns = dict(
+            ids=np.frombuffer(ids, dtype=np.int64),
+            durations=np.frombuffer(durations, dtype=np.float32),
+            offsets=np.frombuffer(offsets, dtype=np.float64),
+            speakers=np.frombuffer(speakers, dtype=np.int64),
+            orig_srs=np.frombuffer(orig_srs, dtype=np.int64),
+        )
+        for name, (blob, string_offsets, nulls) in strings.items():
+            columns[f'{name}_blob'] = np.frombuffer(bytes(blob), dtype=np.uint8)
+            columns[f'{name}_offsets'] = np.frombuffer(string_offsets, dtype=np.int64)
+            columns[f'{name}_nulls'] = np.frombuffer(nulls, dtype=np.int8).astype(bool)
+        if parser is not None:
+            columns['tokens'] = np.frombuffer(tokens, dtype=np.int32)
+            columns['token_offsets'] = np.frombuffer(token_offsets, dtype=np.int64)
+            columns['token_lens'] = np.frombuffer(token_lens, dtype=np.int64)
+
+        # written to a temporary directory and renamed, so that concurrent ranks never load a partial cache
+        parent_dir = os.path.dirname(compiled_dir)
+        os.makedirs(parent_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent_dir)
+        for name in columns:
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), columns[name])
+        try:
+            os.rename(tmp_dir, compiled_dir)
+        except OSError:
+            # compiled by another process meanwhile
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _load(self, compiled_dir: str):
+        def load(name):
+            path = os.path.join(compiled_dir, f'{name}.npy')
+            try:
+                return np.load(path, mmap_mode='r')
+            except ValueError:
+                # empty arrays, e.g. texts of manifests without transcripts, cannot be memory-mapped
+                return np.load(path)
+
+        self._ids = load('ids')
+        self._durations = load('durations')
+        self._offsets = load('offsets')
+        self._speakers = load('speakers')
+        self._orig_srs = load('orig_srs')
+        self._audio_files, self._texts = [
+            _StringColumn(load(f'{name}_blob'), load(f'{name}_offsets'), load(f'{name}_nulls'))
+            for name in ['audio_files', 'texts']
+        ]
+        if os.path.exists(os.path.join(compiled_dir, 'tokens.npy')):
+            self._tokens = load('tokens')
+            self._token_offsets = load('token_offsets')
+            self._token_lens = load('token_lens')
+        else:
+            self._tokens, self._token_offsets, self._token_lens = None, None, None
+
+    @property
+    def durations(self) -> np.ndarray:
+        """Durations of the entries, in seconds."""
+        return np.asarray(self._durations[self._index])
+
+    @property
+    def mapping(self) -> Dict[str, int]:
+        """Mapping from filename base (ID) to index in data, built on first use."""
+        if self._mapping is None:
+            self._mapping = {}
+            for i, j in enumerate(self._index.tolist()):
+                file_id, _ = os.path.splitext(os.path.basename(self._audio_files[j]))
+                self._mapping[file_id] = i
+        return self._mapping
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        j = int(self._index[i])
+        text = self._texts[j]
+        if self._token_offsets is not None:
+            text_tokens = self._tokens[self._token_offsets[j]:self._token_offsets[j + 1]].tolist()
+        elif self.parse_online:
+            text_tokens = self.parser(text)
+        else:
+            text_tokens = None
+        offset = float(self._offsets[j])
+        speaker = int(self._speakers[j])
+        orig_sr = int(self._orig_srs[j])
+        return self.OUTPUT_TYPE(
+            int(self._ids[j]),
+            self._audio_files[j],
+            float(self._durations[j]),
+            text_tokens,
+            None if np.isnan(offset) else offset,
+            text,
+            None if speaker < 0 else speaker,
+            None if orig_sr < 0 else orig_sr,
+        )
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class SpeechLabel(_Collection):
     """List of audio-label correspondence with preprocessing."""
 
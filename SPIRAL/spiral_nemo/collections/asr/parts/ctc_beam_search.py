@@ -0,0 +1,317 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import gzip
+import math
+import multiprocessing
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from spiral_nemo.collections.asr.parts.rnnt_utils import Hypothesis
+from spiral_nemo.utils import logging
+
+__all__ = ['NGramLM', 'CTCBeamSearchDecoder']
+
+LOG_10 = math.log(10.0)
+NEG_INF = -float('inf')
+
+
+def _logsumexp(a: float, b: float) -> float:
+    if a == NEG_INF:
+        return b
+    if b == NEG_INF:
+        return a
+    if a > b:
+        return a + math.log1p(math.exp(b - a))
+    return b + math.log1p(math.exp(a - b))
+
+
+class NGramLM:
+    """Back-off n-gram language model read from an ARPA file (plain or gzipped).
+
+    Scores are natural-log probabilities; the LM state is the tuple of the last `order - 1` words.
+    The scores of the `cache_size` most recently queried (state, word) pairs are cached.
+    """
+
+    def __init__(self, arpa_path: str, unk: str = '<unk>', cache_size: int = 1000000):
+        self.order = 0
+        self.probs: Dict[Tuple[str, ...], float] = {}
+        self.backoffs: Dict[Tuple[str, ...], float] = {}
+        self._load(arpa_path)
+        self.unk_logprob = self.probs.get((unk,), -100.0 * LOG_10)
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[Tuple[Tuple[str, ...], str], float]' = OrderedDict()
+
+    def _load(self, arpa_path):
+        opener = gzip.open if arpa_path.endswith('.gz') else open
+        n = 0
+        with opener(arpa_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('ngram ') or line in ('\\data\\', '\\end\\'):
+                    continue
+                if line.startswith('\\') and line.endswith('-grams:'):
+                    n = int(line[1:-len('-grams:')])
+                    self.order = max(self.order, n)
+                    continue
+                if n == 0:
+                    continue
+                fields = line.split('\t')
+                if len(fields) == 1:
+                    fields = line.split()
+                    fields = [fields[0], ' '.join(fields[1:n + 1])] + fields[n + 1:]
+                words = tuple(fields[1].split())
+                self.probs[words] = float(fields[0]) * LOG_10
+                if len(fields) > 2:
+                    self.backoffs[words] = float(fields[2]) * LOG_10
+        logging.info(f'Loaded {self.order}-gram LM with {len(self.probs)} n-grams from {arpa_path}')
+
+    def start_state(self) -> Tuple[str, ...]:
+        return ('<s>',)
+
+    def score(self, state: Tuple[str, ...], word: str) -> Tuple[float, Tuple[str, ...]]:
+        """Returns log P(word | state) and the next state."""
+        key = (state, word)
+        logprob = self._cache.get(key)
+        if logprob is None:
+            logprob = self._backoff_score(state, word)
+            self._cache[key] = logprob
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        next_state = (state + (word,))[-(self.order - 1):] if self.order > 1 else ()
+        return logprob, next_state
+
+    def _backoff_score(self, context, word):
+        backoff = 0.0
+        for i in range(len(context) + 1):
+            ngram = context[i:] + (word,)
+            if ngram in self.probs:
+                return backoff + self.probs[ngram]
+            backoff += self.backoffs.get(context[i:], 0.0)
+        return backoff + self.unk_logprob
+
+
+class _PrefixLMState:
+    __slots__ = ['lm_state', 'partial_word', 'score']
+
+    def __init__(self, lm_state, partial_word, score):
+        self.lm_state = lm_state
+        self.partial_word = partial_word
+        self.score = score
+
+
+_worker_decoder = None
+
+
+def _init_worker(decoder):
+    global _worker_decoder
+    _worker_decoder = decoder
+
+
+def _decode_in_worker(args):
+    logprobs, return_beams = args
+    return _worker_decoder.decode(logprobs, return_beams=return_beams)
+
+
+class CTCBeamSearchDecoder:
+    """CTC prefix beam search with optional n-gram LM shallow fusion on the word level.
+
+    Words are delimited by `word_delimiter` tokens for character vocabularies, or start with the
+    sentencepiece `▁` marker for subword vocabularies. Each completed word adds
+    `lm_weight * log P_lm(word | history) + word_bonus` to the score of the prefix.
+
+    Args:
+        vocabulary: list of token strings, without the blank.
+        blank_id: index of the CTC blank label.
+        beam_size: number of prefixes kept after each frame.
+        beam_prune_logp: prefixes scoring more than this below the best one are dropped.
+        token_top_k: only the k most likely tokens of each frame are expanded.
+        token_min_logp: tokens with lower frame log probability are not expanded.
+        blank_skip_logp: frames whose blank log probability is above this value are not expanded
+            and only extend prefixes with a blank. Set to 0 to expand every frame.
+        lm_path: path to an ARPA (optionally gzipped) n-gram LM. No LM fusion if None.
+        lm_weight: weight of LM log probabilities.
+        word_bonus: score added for every completed word, counters the LM's preference for short outputs.
+        word_delimiter: token which separates words in character vocabularies.
+        num_workers: number of processes to decode utterances of a batch in parallel. 0 decodes in-process.
+    """
+
+    def __init__(
+        self,
+        vocabulary: List[str],
+        blank_id: int,
+        beam_size: int = 16,
+        beam_prune_logp: float = 10.0,
+        token_top_k: int = 16,
+        token_min_logp: float = -10.0,
+        blank_skip_logp: float = 0.0,
+        lm_path: Optional[str] = None,
+        lm_weight: float = 0.5,
+        word_bonus: float = 1.0,
+        word_delimiter: str = ' ',
+        num_workers: int = 0,
+    ):
+        self.vocabulary = list(vocabulary)
+        self.blank_id = blank_id
+        self.beam_size = beam_size
+        self.beam_prune_logp = beam_prune_logp
+        self.token_top_k = token_top_k
+        self.token_min_logp = token_min_logp
+        self.blank_skip_logp = blank_skip_logp
+        self.lm = NGramLM(lm_path) if lm_path is not None else None
+        self.lm_weight = lm_weight
+        self.word_bonus = word_bonus
+        self.word_delimiter = word_delimiter
+        self.num_workers = num_workers
+        self.subword = word_delimiter not in self.vocabulary
+        self._pool = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def _word_score(self, lm_state, word):
+        if self.lm is None:
+            return self.word_bonus, lm_state
+        logprob, lm_state = self.lm.score(lm_state, word)
+        return self.lm_weight * logprob + self.word_bonus, lm_state
+
+    def _extend(self, prev: _PrefixLMState, token: int) -> _PrefixLMState:
+        piece = self.vocabulary[token]
+        if self.subword:
+            if piece.startswith('▁') and prev.partial_word:
+                word_score, lm_state = self._word_score(prev.lm_state, prev.partial_word)
+                return _PrefixLMState(lm_state, piece[1:], prev.score + word_score)
+            return _PrefixLMState(prev.lm_state, prev.partial_word + piece.lstrip('▁'), prev.score)
+        if piece == self.word_delimiter:
+            if not prev.partial_word:
+                return prev
+            word_score, lm_state = self._word_score(prev.lm_state, prev.partial_word)
+            return _PrefixLMState(lm_state, '', prev.score + word_score)
+        return _PrefixLMState(prev.lm_state, prev.partial_word + piece, prev.score)
+
+    def _final_score(self, state: _PrefixLMState) -> float:
+        score = state.score
+        lm_state = state.lm_state
+        if state.partial_word:
+            word_score, lm_state = self._word_score(lm_state, state.partial_word)
+            score += word_score
+        if self.lm is not None:
+            score += self.lm_weight * self.lm.score(lm_state, '</s>')[0]
+        return score
+
+    def _to_text(self, prefix: Tuple[int, ...]) -> str:
+        text = ''.join(self.vocabulary[token] for token in prefix)
+        if self.subword:
+            text = text.replace('▁', ' ').strip()
+        return text
+
+    def decode(self, logprobs: np.ndarray, return_beams: bool = False):
+        """
+        Decodes frame log probabilities of a single utterance.
+
+        Args:
+            logprobs: array of shape [Time, Vocabulary + 1] of log probabilities, without padding frames.
+            return_beams: return all final beams as (text, score) pairs, best first, instead of the best text.
+        """
+        logprobs = np.asarray(logprobs, dtype=np.float32)
+        lm_start = self.lm.start_state() if self.lm is not None else ()
+        lm_states = {(): _PrefixLMState(lm_start, '', 0.0)}
+        # prefix -> [log P(prefix ending in blank), log P(prefix ending in non-blank)]
+        beams = {(): [0.0, NEG_INF]}
+
+        top_k = min(self.token_top_k, logprobs.shape[1])
+        for frame in logprobs:
+            if frame[self.blank_id] > self.blank_skip_logp:
+                # treat the frame as blank-only
+                p = float(frame[self.blank_id])
+                beams = {prefix: [_logsumexp(p_b, p_nb) + p, NEG_INF] for prefix, (p_b, p_nb) in beams.items()}
+                continue
+            tokens = np.argpartition(-frame, top_k - 1)[:top_k]
+            tokens = [int(c) for c in tokens if frame[c] >= self.token_min_logp] or [int(frame.argmax())]
+
+            next_beams = {}
+            for prefix, (p_b, p_nb) in beams.items():
+                p_total = _logsumexp(p_b, p_nb)
+                last = prefix[-1] if prefix else None
+                for c in tokens:
+                    p = float(frame[c])
+                    if c == self.blank_id:
+                        entry = next_beams.setdefault(prefix, [NEG_INF, NEG_INF])
+                        entry[0] = _logsumexp(entry[0], p_total + p)
+                        continue
+                    new_prefix = prefix + (c,)
+                    if new_prefix not in lm_states:
+                        lm_states[new_prefix] = self._extend(lm_states[prefix], c)
+                    entry = next_beams.setdefault(new_prefix, [NEG_INF, NEG_INF])
+                    if c == last:
+                        # repeated token is only a new token after a blank, otherwise it extends the same prefix
+                        entry[1] = _logsumexp(entry[1], p_b + p)
+                        same = next_beams.setdefault(prefix, [NEG_INF, NEG_INF])
+                        same[1] = _logsumexp(same[1], p_nb + p)
+                    else:
+                        entry[1] = _logsumexp(entry[1], p_total + p)
+
+            scored = sorted(
+                ((_logsumexp(*probs) + lm_states[prefix].score, prefix) for prefix, probs in next_beams.items()),
+                reverse=True,
+            )
+            best = scored[0][0]
+            beams = {
+                prefix: next_beams[prefix]
+                for score, prefix in scored[: self.beam_size]
+                if score >= best - self.beam_prune_logp
+            }
+            lm_states = {prefix: lm_states[prefix] for prefix in beams}
+
+        final = sorted(
+            ((_logsumexp(*probs) + self._final_score(lm_states[prefix]), prefix) for prefix, probs in beams.items()),
+            reverse=True,
+        )
+        if return_beams:
+            return [(self._to_text(prefix), score) for score, prefix in final]
+        return self._to_text(final[0][1])
+
+    def decode_batch(self, logprobs: List[np.ndarray], return_beams: bool = False, return_hypotheses: bool = False):
+        """
+        Decodes a list of utterances, in parallel processes if `num_workers` > 0.
+
+        Args:
+            logprobs: list of arrays of shape [Time, Vocabulary + 1], one per utterance.
+            return_beams: return all final beams of each utterance as (text, score) pairs.
+            return_hypotheses: return Hypothesis objects with the best text and its score.
+        """
+        args = [(lp, return_beams or return_hypotheses) for lp in logprobs]
+        if self.num_workers > 0 and len(args) > 1:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.num_workers, initializer=_init_worker, initargs=(self,))
+            results = self._pool.map(_decode_in_worker, args, chunksize=max(1, len(args) // (4 * self.num_workers)))
+        else:
+            results = [self.decode(lp, return_beams=rb) for lp, rb in args]
+
+        if return_hypotheses:
+            return [Hypothesis(score=beams[0][1], y_sequence=None, text=beams[0][0]) for beams in results]
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,94 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+from typing import Optional
+
+import numpy as np
+
+
+class LogprobStoreWriter:
+    """Appends frame-level model outputs of utterances to flat binary files.
+
+    Each array name (e.g. `logprob`, `logits`) is written to `<store_dir>/<name>.bin` as rows of
+    `[num_frames, vocab_size]` values of all utterances concatenated in the order they were added.
+    Utterance lengths are written to `lengths.npy` and array shapes to `meta.json` on `close`,
+    so the store can be memory-mapped by :class:`LogprobStore` without loading it into RAM.
+    """
+
+    def __init__(self, store_dir: str, dtype: str = 'float32'):
+        self.store_dir = store_dir
+        self.dtype = np.dtype(dtype)
+        os.makedirs(store_dir, exist_ok=True)
+        self._files = {}
+        self._dims = {}
+        self._lengths = []
+
+    def add(self, lengths, **arrays):
+        """Writes a batch of padded arrays of shape [B, T, V], keeping the first `lengths[i]` frames of each."""
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if not self._files:
+            for name, array in arrays.items():
+                self._files[name] = open(os.path.join(self.store_dir, name + '.bin'), 'wb')
+                self._dims[name] = array.shape[-1]
+        assert set(arrays) == set(self._files), 'same arrays are expected in every batch'
+
+        # frames of all utterances without padding, in one write per array
+        frame_mask = np.arange(max(lengths.max(initial=0), 1))[None, :] < lengths[:, None]
+        for name, array in arrays.items():
+            assert array.shape[-1] == self._dims[name]
+            frames = array[:, :frame_mask.shape[1]][frame_mask[:, :array.shape[1]]]
+            self._files[name].write(np.ascontiguousarray(frames, dtype=self.dtype).tobytes())
+        self._lengths.append(lengths)
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        lengths = np.concatenate(self._lengths) if self._lengths else np.zeros(0, dtype=np.int64)
+        np.save(os.path.join(self.store_dir, 'lengths.npy'), lengths)
+        with open(os.path.join(self.store_dir, 'meta.json'), 'w') as f:
+            json.dump({'dtype': self.dtype.name, 'dims': self._dims, 'num_utterances': len(lengths),
+                       'num_frames': int(lengths.sum())}, f)
+        self._files = {}
+
+
+class LogprobStore:
+    """Read-only view of a store written by :class:`LogprobStoreWriter`.
+
+    Arrays are memory-mapped, so `store.get('logprob', i)` reads only the frames of utterance `i`.
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.lengths = np.load(os.path.join(store_dir, 'lengths.npy'))
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)])
+        self._arrays = {}
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def array(self, name: str) -> Optional[np.ndarray]:
+        if name not in self.meta['dims']:
+            return None
+        if name not in self._arrays:
+            self._arrays[name] = np.memmap(os.path.join(self.store_dir, name + '.bin'), dtype=self.meta['dtype'],
+                                           mode='r', shape=(self.meta['num_frames'], self.meta['dims'][name]))
+        return self._arrays[name]
+
+    def get(self, name: str, index: int) -> np.ndarray:
+        return self.array(name)[self.offsets[index]:self.offsets[index + 1]]
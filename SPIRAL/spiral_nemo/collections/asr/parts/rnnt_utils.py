@@ -48,6 +48,12 @@ class Hypothesis:
     lm_state: (Unused) A dictionary state cache used by an external Language Model.
 
     lm_scores: (Unused) Score of the external Language Model.
+
+    text: (Optional) Decoded text of the hypothesis.
+
+    alignments: (Optional) Frame-level token ids the hypothesis was decoded from.
+
+    length: Number of frames the hypothesis was decoded from.
     """
 
     score: float
@@ -56,6 +62,9 @@ class Hypothesis:
     y: List[torch.tensor] = None
     lm_state: Union[Dict[str, Any], List[Any]] = None
     lm_scores: torch.Tensor = None
+    text: Optional[str] = None
+    alignments: Optional[List[int]] = None
+    length: Union[int, torch.Tensor] = 0
 
 
 @dataclass
@@ -0,0 +1,181 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import torch
+
+from spiral_nemo.utils import logging
+
+__all__ = ['MicroBatchServer']
+
+
+class _Request:
+    __slots__ = ['signal', 'future', 'arrival']
+
+    def __init__(self, signal, future, arrival):
+        self.signal = signal
+        self.future = future
+        self.arrival = arrival
+
+
+class MicroBatchServer:
+    """In-process asyncio server which groups concurrent transcription requests into micro-batches.
+
+    A batch is closed when adding the next request would exceed `max_batch_frames` padded audio samples or
+    `max_batch_size` requests, or when its oldest request has waited `max_wait_ms`. Batches run one at a time
+    in a dedicated inference thread through `model.transcribe_audio`, while the next batch is being collected.
+
+    Usage::
+
+        async with MicroBatchServer(model, max_batch_frames=16000 * 120, max_wait_ms=20) as server:
+            text = await server.transcribe(samples)
+
+    Args:
+        model: `CTCFinetuneModel` or `RNNTFinetuneModel`.
+        max_batch_frames: upper bound on batch size times the longest audio in the batch, in samples.
+        max_batch_size: upper bound on the number of requests in a batch.
+        max_wait_ms: longest time a request waits for other requests to join its batch.
+        sample_rate: sample rate of arrays/tensors passed to `transcribe`, if it differs from the model's.
+        transcribe_kwargs: other arguments of `model.transcribe_audio`, e.g. `beam_decoder`.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_frames: int = 16000 * 120,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 10.0,
+        sample_rate: Optional[int] = None,
+        transcribe_kwargs: Optional[Dict[str, Any]] = None,
+    ):
+        self.model = model
+        self.max_batch_frames = max_batch_frames
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.sample_rate = sample_rate
+        self.transcribe_kwargs = transcribe_kwargs or {}
+        self.num_batches = 0
+        self.num_requests = 0
+        self._executor = None
+        self._queue = None
+        self._batch_task = None
+        self._slot = None
+        self._pending = None
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='asr-inference')
+        self._queue = asyncio.Queue()
+        self._slot = asyncio.Semaphore(1)
+        self._batch_task = asyncio.ensure_future(self._batch_loop())
+
+    async def stop(self):
+        """Serves all queued requests and stops the batching loop and the inference thread."""
+        await self._queue.put(None)
+        await self._batch_task
+        # wait for the last batch to finish
+        await self._slot.acquire()
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def transcribe(self, audio):
+        """
+        Transcribes a single utterance: a 1-D numpy array or torch tensor of samples, or bytes of an audio file.
+        Returns the result of `model.transcribe_audio` for it.
+        """
+        loop = asyncio.get_event_loop()
+        # decoding and resampling are done off the event loop
+        signal = await loop.run_in_executor(None, self.model._audio_to_tensor, audio, self.sample_rate)
+        future = loop.create_future()
+        await self._queue.put(_Request(signal, future, time.monotonic()))
+        return await future
+
+    async def _next_request(self, timeout=None):
+        if self._pending is not None:
+            request, self._pending = self._pending, None
+            return request
+        if timeout is None:
+            return await self._queue.get()
+        if timeout <= 0:
+            try:
+                return self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                raise asyncio.TimeoutError()
+        return await asyncio.wait_for(self._queue.get(), timeout)
+
+    async def _batch_loop(self):
+        stopping = False
+        while not stopping:
+            first = await self._next_request()
+            if first is None:
+                break
+            # only one batch runs at a time, requests keep queueing up meanwhile
+            await self._slot.acquire()
+
+            batch = [first]
+            max_len = len(first.signal)
+            deadline = first.arrival + self.max_wait
+            while len(batch) < self.max_batch_size:
+                # requests which are already queued join the batch even after the deadline
+                try:
+                    request = await self._next_request(deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if max(max_len, len(request.signal)) * (len(batch) + 1) > self.max_batch_frames:
+                    self._pending = request
+                    break
+                batch.append(request)
+                max_len = max(max_len, len(request.signal))
+
+            asyncio.ensure_future(self._run_batch(batch))
+
+        # serve a request held back from the last batch
+        if self._pending is not None:
+            await self._slot.acquire()
+            asyncio.ensure_future(self._run_batch([self._pending]))
+            self._pending = None
+
+    def _infer(self, signals: List[torch.Tensor]):
+        return self.model.transcribe_audio(signals, batch_size=len(signals), **self.transcribe_kwargs)
+
+    async def _run_batch(self, batch: List[_Request]):
+        loop = asyncio.get_event_loop()
+        try:
+            results = await loop.run_in_executor(self._executor, self._infer, [r.signal for r in batch])
+        except Exception as e:
+            logging.error(f'Failed to transcribe a batch of {len(batch)} requests: {e}')
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+        else:
+            for request, result in zip(batch, results):
+                if not request.future.done():
+                    request.future.set_result(result)
+        finally:
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            self._slot.release()
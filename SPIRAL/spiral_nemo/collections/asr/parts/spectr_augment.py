@@ -45,6 +45,12 @@ class SpecAugment(nn.Module):
         to be cut in one segment.
         If a float value, defines maximum percentage of timesteps that
         are cut adaptively.
+    max_time_masks - upper bound on the number of time segments if
+        `time_masks` is a float fraction of the length
+    gauss_mask_std - fill time segments with gaussian noise of this std
+        instead of zeros
+    rng - unused, kept for compatibility; masks are drawn in one batch
+        with the torch generator of the input device
     """
 
     def __init__(
@@ -52,8 +58,6 @@ class SpecAugment(nn.Module):
     ):
         super(SpecAugment, self).__init__()
 
-        self._rng = random.Random() if rng is None else rng
-
         self.freq_masks = freq_masks
         self.time_masks = time_masks
         self.max_time_masks = max_time_masks
@@ -82,38 +86,58 @@ class SpecAugment(nn.Module):
     @torch.no_grad()
     def forward(self, x, length):
         B, D, T = x.shape
+        device = x.device
+        length = length.to(device)
+
+        # all mask bounds are drawn at once on the device, masks of a dimension are the union of their segments
+        if self.freq_masks > 0:
+            freq_left = self._randint_below(max(D - self.freq_width, 0) + 1, (B, self.freq_masks), device)
+            freq_w = self._randint_below(self.freq_width + 1, (B, self.freq_masks), device)
+            freq_mask = self._segments_mask(freq_left, freq_w, D)
+            x = x.masked_fill(freq_mask.unsqueeze(2), 0.0)
+
+        if self.adaptive_temporal_width:
+            time_width = (length.float() * self.time_width).long().clamp(min=1)
+        else:
+            time_width = torch.full_like(length, self.time_width)
 
-        for idx in range(B):
-            for _ in range(self.freq_masks):
-                x_left = self._rng.randint(0, D - self.freq_width)
-
-                w = self._rng.randint(0, self.freq_width)
-
-                x[idx, x_left : x_left + w, :] = 0.0
-
-            if self.adaptive_temporal_width:
-                time_width = max(1, int(length[idx] * self.time_width))
-            else:
-                time_width = self.time_width
-
-            if self.adaptive_time_mask:
-                time_masks = int(length[idx] * self.time_masks)
-                time_masks = min(time_masks, self.max_time_masks)
+        if self.adaptive_time_mask:
+            time_masks = (length.float() * self.time_masks).long().clamp(max=self.max_time_masks)
+            num_time_masks = self.max_time_masks
+        else:
+            time_masks = None
+            num_time_masks = self.time_masks
+
+        if num_time_masks > 0:
+            time_left = self._randint_below((length - time_width).clamp(min=0).unsqueeze(1) + 1,
+                                            (B, num_time_masks), device)
+            time_w = self._randint_below(time_width.unsqueeze(1) + 1, (B, num_time_masks), device)
+            if time_masks is not None:
+                # utterances have different numbers of masks, unused ones are empty
+                time_w = time_w.masked_fill(torch.arange(num_time_masks, device=device) >= time_masks.unsqueeze(1), 0)
+            time_mask = self._segments_mask(time_left, time_w, T).unsqueeze(1)
+
+            if self.gauss_mask_std == 0:
+                x = x.masked_fill(time_mask, 0.0)
             else:
-                time_masks = self.time_masks
-
-            for _ in range(time_masks):
-                y_left = self._rng.randint(0, length[idx] - time_width)
-
-                w = self._rng.randint(0, time_width)
-
-                if self.gauss_mask_std == 0:
-                    x[idx, :, y_left:y_left + w] = 0.0
-                else:
-                    x[idx, :, y_left:y_left + w] = torch.normal(mean=0, std=self.gauss_mask_std, size=(D, w)).to(x.device)
+                x = torch.where(time_mask, torch.randn_like(x) * self.gauss_mask_std, x)
 
         return x
 
+    @staticmethod
+    def _randint_below(high, size, device):
+        # uniform integers in [0, high) for a scalar or broadcastable tensor `high`
+        values = (torch.rand(size, device=device) * high).long()
+        return torch.min(values, torch.as_tensor(high, device=device) - 1)
+
+    @staticmethod
+    def _segments_mask(left, width, size):
+        # [B, N] segments => [B, size] mask of positions inside any segment
+        positions = torch.arange(size, device=left.device)
+        left = left.unsqueeze(2)
+        inside = (positions >= left) & (positions < left + width.unsqueeze(2))
+        return inside.any(dim=1)
+
 
 class SpecCutout(nn.Module):
     """
@@ -0,0 +1,501 @@
+# Copyright (C) 2022. Huawei Technologies Co., Ltd. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from inspect import signature
+from typing import List, Optional
+
+import torch
+import torch.nn.functional as F
+
+from spiral_nemo.collections.asr.parts.convolution_layers import ConvNormAct
+from spiral_nemo.collections.asr.parts.features import CONSTANT
+from spiral_nemo.collections.asr.parts.wav2vec import TransformerEncoder
+
+__all__ = ['ST2VecStreamingEncoder', 'CTCStreamingTranscriber']
+
+
+def _empty(x, channels=None):
+    return x.new_zeros(x.size(0), x.size(1) if channels is None else channels, 0)
+
+
+class _StreamingFilterbank:
+    """Computes log-mel frames of `FilterbankFeatures` from audio received in chunks.
+
+    Only the STFT window tail is kept between chunks. Per-utterance normalization is replaced by running
+    statistics of all frames so far, and waveform peak normalization is skipped: the feature normalization
+    removes a constant gain anyway.
+    """
+
+    def __init__(self, featurizer):
+        if featurizer.stft_conv or featurizer.stft_exact_pad or featurizer.frame_splicing > 1:
+            raise ValueError('streaming supports only torch STFT with center padding and no frame splicing')
+        if featurizer.normalize not in (None, 'per_feature', 'all_features'):
+            raise ValueError(f'streaming does not support {featurizer.normalize} normalization')
+        self.featurizer = featurizer
+        self.half = featurizer.n_fft // 2
+        self.stft_kwargs = {'return_complex': True} if 'return_complex' in signature(torch.stft).parameters else {}
+        self.reset()
+
+    def reset(self):
+        self.samples = None
+        self.samples_start = 0
+        self.started = False
+        self.last_sample = None
+        self.num_samples = 0
+        self.num_frames = 0
+        self.stats = None
+
+    def step(self, x, final=False):
+        f = self.featurizer
+        x = x.to(device=f.fb.device, dtype=torch.float)
+        if x.numel() > 0:
+            if f.preemph is not None:
+                prev = x.new_zeros(1) if self.last_sample is None else self.last_sample
+                self.last_sample = x[-1:]
+                x = x - f.preemph * torch.cat([prev, x[:-1]])
+            self.samples = x if self.samples is None else torch.cat([self.samples, x])
+            self.num_samples += x.numel()
+
+        if self.samples is None or self.num_samples <= self.half:
+            # not enough audio for the reflection padding of the first frame yet
+            return torch.zeros(1, f.nfilt, 0, device=f.fb.device)
+        if not self.started:
+            self.samples = torch.cat([self.samples[1:self.half + 1].flip(0), self.samples])
+            self.samples_start = -self.half
+            self.started = True
+
+        if final:
+            # same number of frames as the offline features length
+            end = -(-self.num_samples // f.hop_length)
+            self.samples = torch.cat([self.samples, self.samples[-self.half - 1:-1].flip(0)])
+        else:
+            end = (self.num_samples - self.half) // f.hop_length + 1
+        if end <= self.num_frames:
+            return torch.zeros(1, f.nfilt, 0, device=f.fb.device)
+
+        lo = self.num_frames * f.hop_length - self.half - self.samples_start
+        hi = lo + (end - self.num_frames - 1) * f.hop_length + f.n_fft
+        spec = torch.stft(self.samples[lo:hi], n_fft=f.n_fft, hop_length=f.hop_length, win_length=f.win_length,
+                          center=False, window=f.window.to(dtype=torch.float), **self.stft_kwargs)
+        spec = spec.abs() if spec.is_complex() else torch.sqrt(spec.pow(2).sum(-1))
+        if f.mag_power != 1.0:
+            spec = spec.pow(f.mag_power)
+        x = torch.matmul(f.fb.to(spec.dtype), spec.unsqueeze(0))
+        if f.log:
+            if f.log_zero_guard_type == 'add':
+                x = torch.log(x + f.log_zero_guard_value_fn(x))
+            else:
+                x = torch.log(torch.clamp(x, min=f.log_zero_guard_value_fn(x)))
+        if f.normalize:
+            x = self._normalize(x)
+
+        drop = min(end * f.hop_length - self.half - self.samples_start, self.samples.numel())
+        self.samples = self.samples[drop:]
+        self.samples_start += drop
+        self.num_frames = end
+        return x
+
+    def _normalize(self, x):
+        # running mean and std of all frames so far, in place of the statistics of the whole utterance
+        dims = (0, 2) if self.featurizer.normalize == 'per_feature' else (0, 1, 2)
+        x64 = x.double()
+        count = x.size(2) if self.featurizer.normalize == 'per_feature' else x.size(1) * x.size(2)
+        stats = (count, x64.sum(dim=dims, keepdim=True), x64.pow(2).sum(dim=dims, keepdim=True))
+        if self.stats is not None:
+            stats = tuple(a + b for a, b in zip(self.stats, stats))
+        self.stats = stats
+        n, s1, s2 = stats
+        mean = s1 / n
+        std = ((s2 - n * mean.pow(2)).clamp(min=0) / max(n - 1, 1)).sqrt() + CONSTANT
+        return ((x64 - mean) / std).to(x.dtype)
+
+
+class _StreamingConv:
+    """Runs a `ConvNormAct` layer with TF style same padding over a stream of frames.
+
+    Input frames which later outputs still need are kept as left context. With `look_ahead` an output frame
+    is emitted once all its input frames arrived, so outputs equal the offline ones and are delayed by the
+    right padding of the layer. Without it, missing future frames are zeros, as at the end of an utterance.
+    """
+
+    def __init__(self, module: ConvNormAct, look_ahead: bool = True):
+        conv = module.conv
+        self.module = module
+        self.kernel = conv.conv.kernel_size[0]
+        self.stride = conv.conv.stride[0]
+        self.out_channels = conv.conv.out_channels
+        if conv.need_pad:
+            # same choice of padding as Conv.pad_like_tf
+            pad_num = conv.even_pad_num if conv.conv.in_channels % 2 == 0 else conv.pad_num
+            self.left, self.right = pad_num[0]
+        else:
+            self.left, self.right = 0, 0
+        self.look_ahead = look_ahead
+        self.reset()
+
+    def reset(self):
+        self.buffer = None
+        self.buffer_start = -self.left
+        self.num_inputs = 0
+        self.num_outputs = 0
+
+    def step(self, x, final=False):
+        if x.size(2) > 0:
+            self.num_inputs += x.size(2)
+            if self.buffer is None:
+                # left padding of the first frames
+                self.buffer = F.pad(x, (self.left, 0))
+            else:
+                self.buffer = torch.cat([self.buffer, x], dim=2)
+        if self.buffer is None:
+            return x
+
+        if final:
+            end = (self.num_inputs + self.left + self.right - self.kernel) // self.stride + 1
+        elif self.look_ahead:
+            end = (self.num_inputs + self.left - self.kernel) // self.stride + 1
+        else:
+            end = -(-self.num_inputs // self.stride)
+        if end <= self.num_outputs:
+            return _empty(self.buffer, self.out_channels)
+
+        lo = self.num_outputs * self.stride - self.left - self.buffer_start
+        hi = (end - 1) * self.stride - self.left + self.kernel - self.buffer_start
+        inputs = self.buffer[:, :, lo:hi]
+        if hi > self.buffer.size(2):
+            inputs = F.pad(inputs, (0, hi - self.buffer.size(2)))
+        output = _conv_norm_act(self.module, inputs)
+
+        drop = min(end * self.stride - self.left - self.buffer_start, self.buffer.size(2))
+        self.buffer = self.buffer[:, :, drop:]
+        self.buffer_start += drop
+        self.num_outputs = end
+        return output
+
+
+def _conv_norm_act(module: ConvNormAct, x):
+    # ConvNormAct.forward on inputs which already contain their padding
+    output = module.conv.conv(x)
+    if module.norm_type == 'ln':
+        output = torch.transpose(output, -1, -2)
+    output = module.norm(output)
+    if module.norm_type == 'ln':
+        output = torch.transpose(output, -1, -2)
+    output = module.act(output)
+    return module.drop(output)
+
+
+class _StreamingTransformer:
+    """Runs a `TransformerEncoder` over a stream of frames with cached attention keys and values.
+
+    New frames attend to each other and to keys/values of at most `look_back` earlier frames of every layer,
+    which are computed only once. The last `look_ahead` frames of a chunk are only used as right context and
+    are recomputed and emitted with the next chunk. The positional convolution sees its full left context
+    and zeros for frames not received yet.
+    """
+
+    def __init__(self, module: TransformerEncoder, look_back: Optional[int], look_ahead: int):
+        for layer in module.layers:
+            attn = layer.self_attn
+            if attn.bias_k is not None or attn.add_zero_attn:
+                raise ValueError('streaming does not support attention with bias_k or add_zero_attn')
+        self.module = module
+        self.look_back = look_back
+        self.look_ahead = look_ahead
+        self.pos_context = module.pos_conv[0].kernel_size[0] // 2
+        self.reset()
+
+    def reset(self):
+        self.pending = None
+        self.pos_history = None
+        self.kv_cache = [None] * len(self.module.layers)
+
+    def step(self, x, final=False):
+        if x.size(2) > 0:
+            self.pending = x if self.pending is None else torch.cat([self.pending, x], dim=2)
+        if self.pending is None:
+            return x
+        num_final = self.pending.size(2) if final else self.pending.size(2) - self.look_ahead
+        if num_final <= 0:
+            return _empty(self.pending)
+
+        module = self.module
+        # [B, D, T] => [B, T, D]
+        x = self.pending.transpose(1, 2)
+        num_frames = x.size(1)
+        context = x if self.pos_history is None else torch.cat([self.pos_history, x], dim=1)
+        x_conv = module.pos_conv(context.transpose(1, 2)).transpose(1, 2)
+        x = x + x_conv[:, -num_frames:]
+        if not module.layer_norm_first:
+            x = module.layer_norm(x)
+
+        # B x T x C -> T x B x C
+        x = x.transpose(0, 1)
+        for i, layer in enumerate(module.layers):
+            x = self._layer_step(i, layer, x, num_final)
+        x = x.transpose(0, 1)
+
+        if module.layer_norm_first:
+            x = module.layer_norm(x)
+
+        self.pos_history = context[:, :context.size(1) - num_frames + num_final][:, -self.pos_context:]
+        self.pending = self.pending[:, :, num_final:]
+        # [B, T, D] => [B, D, T]
+        return x[:, :num_final].transpose(1, 2)
+
+    def _layer_step(self, i, layer, x, num_final):
+        # TransformerSentenceEncoderLayer.forward with cached self-attention
+        residual = x
+        if layer.layer_norm_first:
+            x = layer.self_attn_layer_norm(x)
+        x = self._attend(i, layer.self_attn, x, num_final)
+        x = residual + layer.dropout1(x)
+        if not layer.layer_norm_first:
+            x = layer.self_attn_layer_norm(x)
+
+        residual = x
+        if layer.layer_norm_first:
+            x = layer.final_layer_norm(x)
+        x = layer.activation_fn(layer.fc1(x))
+        x = layer.fc2(layer.dropout2(x))
+        x = residual + layer.dropout3(x)
+        if not layer.layer_norm_first:
+            x = layer.final_layer_norm(x)
+        return x
+
+    def _attend(self, i, attn, x, num_final):
+        tgt_len, bsz, embed_dim = x.size()
+        q = attn.q_proj(x) * attn.scaling
+        k = attn.k_proj(x)
+        v = attn.v_proj(x)
+        if self.kv_cache[i] is not None:
+            prev_k, prev_v = self.kv_cache[i]
+            k_all, v_all = torch.cat([prev_k, k]), torch.cat([prev_v, v])
+        else:
+            prev_k = prev_v = None
+            k_all, v_all = k, v
+
+        def heads(t):
+            # T x B x C -> (B * H) x T x head_dim
+            return t.contiguous().view(t.size(0), bsz * attn.num_heads, attn.head_dim).transpose(0, 1)
+
+        attn_weights = torch.bmm(heads(q), heads(k_all).transpose(1, 2))
+        attn_probs = torch.softmax(attn_weights.float(), dim=-1).type_as(attn_weights)
+        output = torch.bmm(attn_probs, heads(v_all)).transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+
+        # keys and values of look-ahead frames change with the next chunk, so they are not cached
+        k_keep, v_keep = k[:num_final], v[:num_final]
+        if prev_k is not None:
+            k_keep, v_keep = torch.cat([prev_k, k_keep]), torch.cat([prev_v, v_keep])
+        if self.look_back is not None:
+            k_keep, v_keep = k_keep[-self.look_back:], v_keep[-self.look_back:]
+        self.kv_cache[i] = (k_keep, v_keep)
+        return attn.out_proj(output)
+
+
+class _FrameStage:
+    """Applies a frame-wise function, which needs no state between chunks."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def reset(self):
+        pass
+
+    def step(self, x, final=False):
+        if x.size(2) == 0:
+            return x
+        return self.fn(x)
+
+
+def _run_stages(stages, x, final=False):
+    for stage in stages:
+        x = stage.step(x, final=final)
+    return x
+
+
+class ST2VecStreamingEncoder:
+    """Stateful streaming inference of the `features_only` path of `ST2VecEncoder` for a single utterance.
+
+    `step` takes the next chunk of audio samples and returns the encoder frames which became available,
+    `flush` ends the utterance and returns the remaining frames. Nothing already computed is recomputed except
+    the `look_ahead_sec` right context of transformer blocks.
+
+    The encoder is bidirectional, so the output approximates the offline one: transformer frames see at most
+    `look_back_sec` of history and `look_ahead_sec` of future, and features are normalized with running
+    statistics. Convolutions are exact if `conv_look_ahead` is set, at the cost of waiting for their right
+    context.
+
+    Args:
+        encoder: `ST2VecEncoder` in evaluation mode.
+        look_back_sec: attention history kept for every transformer layer, in seconds. None keeps all of it.
+        look_ahead_sec: future context of transformer frames, in seconds.
+        conv_look_ahead: wait for the right context of convolutions instead of padding it with zeros.
+    """
+
+    def __init__(self, encoder, look_back_sec: Optional[float] = 10.0, look_ahead_sec: float = 0.32,
+                 conv_look_ahead: bool = True):
+        featurizer = encoder.wav2spec.featurizer
+        feature_encoder = encoder.feature_encoder
+        if feature_encoder.conv2d_block is not None:
+            raise ValueError('streaming does not support feature encoders with a conv2d block')
+
+        self.sample_rate = encoder.wav2spec._sample_rate
+        self.stages: List = [_StreamingFilterbank(featurizer)]
+        frame_sec = featurizer.hop_length / self.sample_rate
+        for module in feature_encoder.block_modules:
+            if isinstance(module, ConvNormAct):
+                self.stages.append(_StreamingConv(module, look_ahead=conv_look_ahead))
+                frame_sec *= module.conv.subsample_factor
+            else:
+                assert isinstance(module, TransformerEncoder)
+                look_back = None if look_back_sec is None else int(round(look_back_sec / frame_sec))
+                self.stages.append(_StreamingTransformer(module, look_back, int(round(look_ahead_sec / frame_sec))))
+        self.frame_sec = frame_sec
+        self.output_dim = feature_encoder.output_dim
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    @torch.no_grad()
+    def step(self, samples: torch.Tensor) -> torch.Tensor:
+        """Returns new encoder frames [1, D, T] for the next 1-D chunk of samples."""
+        return _run_stages(self.stages, samples)
+
+    @torch.no_grad()
+    def flush(self) -> torch.Tensor:
+        """Ends the utterance and returns its remaining encoder frames [1, D, T]."""
+        return _run_stages(self.stages, torch.zeros(0), final=True)
+
+
+def _upsample_frames(proj_upsampling, x):
+    # ProjUpsampling.forward after its projection
+    output = x.transpose(1, 2)
+    B, T, C = output.size()
+    output = output.reshape(B, T * proj_upsampling.upsample_rate, proj_upsampling.filters)
+    output = proj_upsampling.norm(output)
+    output = proj_upsampling.act(output)
+    output = proj_upsampling.drop(output)
+    return output.transpose(1, 2)
+
+
+class CTCStreamingTranscriber:
+    """Live transcription of a single utterance with a `CTCFinetuneModel`.
+
+    Audio is fed in chunks of any size and processed in hops of `hop_sec`. Encoder frames of every hop are
+    decoded by the streamed `ConvASRDecoder`, and the greedy hypothesis of all frames so far is returned as
+    the partial transcription. Only the frames of the new hop are collapsed and appended to it.
+
+    Usage::
+
+        transcriber = model.streaming_transcriber(hop_sec=0.16)
+        for chunk in microphone:
+            print(transcriber.feed(chunk))
+        print(transcriber.finish())
+
+    Args:
+        model: `CTCFinetuneModel`, switched to evaluation mode.
+        hop_sec: amount of audio processed at once, in seconds.
+        look_back_sec, look_ahead_sec, conv_look_ahead: see :class:`ST2VecStreamingEncoder`.
+        keep_log_probs: keep the log probabilities of all frames in `log_probs`, which beam search decoding
+            in `finish` needs.
+    """
+
+    def __init__(self, model, hop_sec: float = 0.16, look_back_sec: Optional[float] = 10.0,
+                 look_ahead_sec: float = 0.32, conv_look_ahead: bool = True, keep_log_probs: bool = False):
+        model.eval()
+        self.model = model
+        self.keep_log_probs = keep_log_probs
+        self.encoder = ST2VecStreamingEncoder(model.encoder, look_back_sec=look_back_sec,
+                                              look_ahead_sec=look_ahead_sec, conv_look_ahead=conv_look_ahead)
+        self.hop = int(hop_sec * self.encoder.sample_rate)
+        if self.hop <= 0:
+            raise ValueError(f'hop_sec={hop_sec} is shorter than one sample')
+
+        decoder = model.decoder
+        if decoder.projector is not None:
+            raise ValueError('streaming does not support decoders with a projector')
+        self.decoder_stages = []
+        if decoder.proj_upsampling is not None:
+            self.decoder_stages.append(_StreamingConv(decoder.proj_upsampling.proj, look_ahead=conv_look_ahead))
+            self.decoder_stages.append(_FrameStage(lambda x: _upsample_frames(decoder.proj_upsampling, x)))
+        for layer in decoder.conv_layers:
+            self.decoder_stages.append(_StreamingConv(layer, look_ahead=conv_look_ahead))
+        self.decoder_stages.append(_FrameStage(decoder.decoder_layers))
+        self.reset()
+
+    def reset(self):
+        """Starts a new utterance."""
+        self.encoder.reset()
+        for stage in self.decoder_stages:
+            stage.reset()
+        self._audio = torch.zeros(0)
+        self.log_probs = []
+        self.tokens = []
+        self._last_prediction = self.model.decoder.blank_idx
+        self.text = ''
+
+    @torch.no_grad()
+    def feed(self, audio) -> str:
+        """Adds a chunk of samples at the model sample rate and returns the partial transcription."""
+        audio = torch.as_tensor(audio, dtype=torch.float).flatten()
+        self._audio = torch.cat([self._audio, audio])
+        while self._audio.numel() >= self.hop:
+            hop, self._audio = self._audio[:self.hop], self._audio[self.hop:]
+            self._decode(self.encoder.step(hop), final=False)
+        return self.text
+
+    @torch.no_grad()
+    def finish(self, beam_decoder=None) -> str:
+        """
+        Processes the rest of the utterance and returns its final transcription.
+
+        Args:
+            beam_decoder: (CTCBeamSearchDecoder) decoder of all frame log probabilities instead of greedy decoding.
+        """
+        if self._audio.numel() > 0:
+            self._decode(self.encoder.step(self._audio), final=False)
+            self._audio = torch.zeros(0)
+        self._decode(self.encoder.flush(), final=True)
+        if beam_decoder is not None and not self.keep_log_probs:
+            raise ValueError('beam search decoding needs a transcriber created with keep_log_probs=True')
+        if beam_decoder is not None and self.log_probs:
+            self.text = beam_decoder.decode(torch.cat(self.log_probs).float().cpu().numpy())
+        return self.text
+
+    def _decode(self, frames, final):
+        logits = _run_stages(self.decoder_stages, frames, final=final)
+        if logits.size(2) == 0:
+            return
+        # [B, V, T] => [T, V]
+        log_probs = torch.log_softmax(logits[0].transpose(0, 1), dim=-1)
+        if self.keep_log_probs:
+            self.log_probs.append(log_probs)
+
+        # greedy CTC collapse of the new frames, continuing from the last frame of the previous hop
+        predictions = log_probs.argmax(dim=-1)
+        previous = torch.cat([predictions.new_tensor([self._last_prediction]), predictions[:-1]])
+        keep = (predictions != self.model.decoder.blank_idx) & (predictions != previous)
+        new_tokens = predictions[keep].tolist()
+        self._last_prediction = int(predictions[-1])
+        if not new_tokens:
+            return
+        self.tokens.extend(new_tokens)
+        if self.model.use_bpe:
+            # word pieces are joined with spaces depending on their neighbours, so the tokens are decoded together
+            self.text = self.model._wer.decode_tokens_to_str(self.tokens)
+        else:
+            self.text += self.model._wer.decode_tokens_to_str(new_tokens)
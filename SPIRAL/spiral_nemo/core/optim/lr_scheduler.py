@@ -596,9 +596,17 @@ def prepare_lr_scheduler(
         num_workers = scheduler_config.get('t_num_workers')
 
         # Compute effective num max_steps
-        num_samples = len(train_dataloader.dataset)
-        batch_size = train_dataloader.batch_size
-        drop_last = train_dataloader.drop_last
+        if train_dataloader.batch_size is None:
+            # a batch sampler yields the batches of this rank, the number of batches of an epoch is an estimate
+            # if it varies between epochs
+            num_samples = len(train_dataloader.batch_sampler)
+            batch_size = 1
+            drop_last = False
+            num_workers = 1
+        else:
+            num_samples = len(train_dataloader.dataset)
+            batch_size = train_dataloader.batch_size
+            drop_last = train_dataloader.drop_last
 
         max_steps = compute_max_steps(
             max_epochs=max_epochs,